@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 by Raytheon BBN Technologies Corp.  All Rights Reserved.
+
+"""
+Benchmark the SequenceExtractor with and without a pool of workers
+
+Compiles benchmarks/code/broadcast.py once for each number of
+workers, and prints the time spent generating the QGL1 function
+(the stage that SequenceExtractor.WORKERS affects) and the total
+compile time.  Also checks that the generated code is the same
+for every number of workers.
+
+Run from the root of the repository, with src/python on the
+PYTHONPATH, e.g.:
+
+    python benchmarks/bench_extractor.py -i 1000 -w 3 -j 0 2 4
+"""
+
+import os
+import sys
+import time
+
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.normpath(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')))
+
+import pyqgl2.main
+
+from pyqgl2.context import CompileContext
+from pyqgl2.main import compile_function
+from pyqgl2.sequences import SequenceExtractor
+from test.helpers import channel_setup
+
+PROGRAM = os.path.join('benchmarks', 'code', 'broadcast.py')
+
+def timed_extractor(times):
+    """
+    Return a wrapper for get_sequence_function that
+    appends the time of each call to times
+    """
+
+    get_sequence_function = pyqgl2.main.get_sequence_function
+
+    def wrapper(*args, **kwargs):
+        start_time = time.perf_counter()
+        result = get_sequence_function(*args, **kwargs)
+        times.append(time.perf_counter() - start_time)
+        return result
+
+    return wrapper
+
+def main(argv):
+    parser = ArgumentParser(description='SequenceExtractor benchmark')
+    parser.add_argument('-i', dest='iterations', type=int, default=500,
+            help='iterations of the loop in the program [default=%(default)d]')
+    parser.add_argument('-w', dest='width', type=int, default=3,
+            help='number of qubits in the QRegister [default=%(default)d]')
+    parser.add_argument('-j', dest='workers', type=int, nargs='+',
+            default=[0, 2, 4],
+            help='numbers of workers to try [default=%(default)s]')
+    opts = parser.parse_args(argv)
+
+    channel_setup()
+
+    times = list()
+    pyqgl2.main.get_sequence_function = timed_extractor(times)
+
+    reference = None
+    for workers in opts.workers:
+        context = CompileContext()
+        with context:
+            SequenceExtractor.WORKERS = workers
+            SequenceExtractor.MIN_PARALLEL_STATEMENTS = 0
+
+        start_time = time.perf_counter()
+        func = compile_function(PROGRAM, 'broadcast',
+                (opts.iterations, opts.width), context=context)
+        elapsed = time.perf_counter() - start_time
+
+        if reference is None:
+            reference = func.qgl_source
+        elif func.qgl_source != reference:
+            print('ERROR: code generated with %d workers differs' % workers)
+            return 1
+
+        print('RESULT: workers %d extractor %.3fs total %.3fs' %
+                (workers, times[-1], elapsed))
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 by Raytheon BBN Technologies Corp.  All Rights Reserved.
+
+"""
+Benchmark the compiler on the basic sequences at production scale
+
+Each benchmark compiles one of the basic sequences (or one of the
+programs in benchmarks/code) with realistic arguments, runs the
+resulting QGL1 function, and records:
+
+    compile_time: wall time of compile_function (seconds)
+    stages: wall time of each stage of the compiler (see pyqgl2.stats)
+    exec_time: wall time of running the QGL1 function (seconds)
+    peak_rss: peak resident set size of the process (bytes)
+    code_size: size of the generated QGL1 source (bytes)
+    code_lines: lines of the generated QGL1 source
+    instructions: number of instructions (pulses, waits, labels, etc)
+        in the sequences created by the QGL1 function
+    instruction_types: the number of instructions of each type
+
+Each benchmark runs in its own process, so that its peak RSS
+is not inflated by the benchmarks before it.
+
+There are two scales: 'full' (the default), which takes several
+minutes, and 'small', which is a quick check.  The saved baselines
+for each scale are in benchmarks/baselines.
+
+Run from the root of the repository, with src/python on the
+PYTHONPATH, e.g.:
+
+    # run the benchmarks and print the results
+    python benchmarks/bench_sequences.py run
+
+    # run two of the small benchmarks, and save the results
+    python benchmarks/bench_sequences.py run -s small -b qft Reset -o out.json
+
+    # save new baselines
+    python benchmarks/bench_sequences.py run -s small \\
+            -o benchmarks/baselines/small.json
+
+    # compare the current compiler (or saved results) to the baselines;
+    # exits with status 1 if anything has regressed
+    python benchmarks/bench_sequences.py compare -s small
+    python benchmarks/bench_sequences.py compare -s small -r out.json
+
+Code sizes and instruction counts are deterministic, so any increase
+is reported as a regression.  Times and memory are compared with a
+tolerance (because they vary from run to run), but they vary much more
+from machine to machine, so they are only compared if the baseline was
+recorded on the same host as the current results (the results record
+the name of the host); otherwise, an increase is printed as a warning,
+but is not a regression.  The saved baselines don't record a host, so
+against them, only the code sizes and instruction counts can regress;
+to check the times and memory as well, save a baseline on the host
+where the comparison will be run, and pass it with --baseline.
+"""
+
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+
+from argparse import ArgumentParser
+from collections import Counter, OrderedDict
+
+ROOT = os.path.normpath(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+sys.path.insert(0, ROOT)
+
+BASELINES = os.path.join(ROOT, 'benchmarks', 'baselines')
+
+SEQUENCES = os.path.join('src', 'python', 'qgl2', 'basic_sequences')
+
+SCALES = ('full', 'small')
+
+# The metrics compared by the compare command, and whether each is
+# compared with the time tolerance, the memory tolerance, or exactly
+METRICS = OrderedDict([
+        ('compile_time', 'time'),
+        ('exec_time', 'time'),
+        ('peak_rss', 'memory'),
+        ('code_size', 'exact'),
+        ('code_lines', 'exact'),
+        ('instructions', 'exact')
+    ])
+
+# Times shorter than this are too noisy to compare
+MIN_TIME = 0.05
+
+def qubit_names(count):
+    return ['q%d' % num for num in range(1, count + 1)]
+
+def rb_seqs(numQubits, lengths, repeats):
+    """
+    Create the RB sequences for the RB benchmarks, with a fixed seed
+    so that every run compiles the same sequences
+    """
+
+    from qgl2.basic_sequences.RB import create_RB_seqs_parallel, RB_seqs_to_lists
+
+    return RB_seqs_to_lists(create_RB_seqs_parallel(
+            numQubits, lengths, repeats=repeats, seed=20152606, workers=1))
+
+# Each benchmark is a function of the scale, which returns the
+# number of qubits for the channel library, the file and the name of
+# the main function to compile, and a function that creates the
+# arguments (after the channel library has been created).
+# Note that all the arguments must be given, because the compiler
+# doesn't use the defaults of the main function.
+
+def bench_SingleQubitRB(scale):
+    if scale == 'full':
+        lengths, repeats = [2, 4, 8, 16, 32, 64], 32
+    else:
+        lengths, repeats = [2, 4, 8], 8
+
+    def make_args():
+        from pyqgl2.qreg import QRegister
+        return (QRegister('q1'), rb_seqs(1, lengths, repeats), False, True)
+
+    return 1, os.path.join(SEQUENCES, 'RB.py'), 'SingleQubitRB', make_args
+
+def bench_TwoQubitRB(scale):
+    if scale == 'full':
+        lengths, repeats = [2, 4, 8, 16], 50
+    else:
+        lengths, repeats = [2, 4], 8
+
+    def make_args():
+        from pyqgl2.qreg import QRegister
+        return (QRegister('q1'), QRegister('q2'),
+                rb_seqs(2, lengths, repeats), True)
+
+    return 2, os.path.join(SEQUENCES, 'RB.py'), 'TwoQubitRB', make_args
+
+def bench_CPMG(scale):
+    if scale == 'full':
+        numPulses = list(range(0, 257, 16))
+    else:
+        numPulses = list(range(0, 33, 8))
+
+    def make_args():
+        from pyqgl2.qreg import QRegister
+        return (QRegister('q1'), numPulses, 500e-9, 2)
+
+    return 1, os.path.join(SEQUENCES, 'Decoupling.py'), 'CPMG', make_args
+
+def bench_RabiAmp(scale):
+    points = 1000 if scale == 'full' else 100
+
+    def make_args():
+        import numpy as np
+        from pyqgl2.qreg import QRegister
+        return (QRegister('q1'), np.linspace(-1, 1, points), 0)
+
+    return 1, os.path.join(SEQUENCES, 'Rabi.py'), 'RabiAmp', make_args
+
+def bench_qft(scale):
+    count = 12 if scale == 'full' else 8
+
+    def make_args():
+        from pyqgl2.qreg import QRegister
+        return (QRegister(*qubit_names(count)),)
+
+    return count, os.path.join('test', 'code', 'qft.py'), 'qft', make_args
+
+def bench_Reset(scale):
+    if scale == 'full':
+        count, rounds = 16, 200
+    else:
+        count, rounds = 8, 20
+
+    def make_args():
+        from pyqgl2.qreg import QRegister
+        return (QRegister(*qubit_names(count)), rounds, 1e-6)
+
+    return (count, os.path.join('benchmarks', 'code', 'reset.py'),
+            'reset_all', make_args)
+
+BENCHMARKS = OrderedDict([
+        ('SingleQubitRB', bench_SingleQubitRB),
+        ('TwoQubitRB', bench_TwoQubitRB),
+        ('CPMG', bench_CPMG),
+        ('RabiAmp', bench_RabiAmp),
+        ('qft', bench_qft),
+        ('Reset', bench_Reset)
+    ])
+
+def flatten(seqs):
+    """
+    Return a list of the instructions in the given
+    (possibly nested) sequences
+    """
+
+    if isinstance(seqs, list):
+        return [inst for seq in seqs for inst in flatten(seq)]
+    else:
+        return [seqs]
+
+def measure(name, scale):
+    """
+    Run the given benchmark in this process, and return its results
+    """
+
+    from pyqgl2.main import compile_function
+    from pyqgl2.stats import CompileStats
+    from pyqgl2.test_cl import create_default_channelLibrary
+
+    numQubits, filename, main_name, make_args = BENCHMARKS[name](scale)
+
+    create_default_channelLibrary(False, True, numQubits=max(3, numQubits))
+
+    # Some sequences choose random pulses when they are compiled
+    random.seed(20152606)
+
+    args = make_args()
+    stats = CompileStats()
+
+    start_time = time.perf_counter()
+    func = compile_function(filename, main_name, args, stats=stats)
+    compile_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    seqs = func()
+    exec_time = time.perf_counter() - start_time
+
+    instructions = flatten(seqs)
+    types = Counter(type(inst).__name__ for inst in instructions)
+
+    stages = OrderedDict()
+    for record in stats.stages:
+        if record.stage == 'exec':
+            continue
+        stages[record.stage] = stages.get(record.stage, 0) + record.wall_time
+
+    # ru_maxrss is in kilobytes on Linux (but bytes on macOS)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        peak_rss *= 1024
+
+    return OrderedDict([
+            ('compile_time', compile_time),
+            ('stages', stages),
+            ('exec_time', exec_time),
+            ('peak_rss', peak_rss),
+            ('code_size', len(func.qgl_source)),
+            ('code_lines', func.qgl_source.count('\n') + 1),
+            ('instructions', len(instructions)),
+            ('instruction_types', OrderedDict(sorted(types.items())))
+        ])
+
+def run_benchmark(name, scale):
+    """
+    Run the given benchmark in a new process, and return its results
+    """
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+            [os.path.join(ROOT, 'src', 'python'), ROOT] +
+            [path for path in env.get('PYTHONPATH', '').split(os.pathsep)
+                if path])
+
+    proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), 'measure', name,
+                '-s', scale],
+            cwd=ROOT, env=env, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, universal_newlines=True)
+
+    # The results are the last line of the output; everything
+    # before that is the chatter of the compiler
+    lines = proc.stdout.rstrip().split('\n')
+    if proc.returncode != 0:
+        raise RuntimeError('benchmark %s failed:\n%s' %
+                (name, '\n'.join(lines[-20:])))
+
+    return json.loads(lines[-1], object_pairs_hook=OrderedDict)
+
+def host_name():
+    """
+    Return the name of this host, as recorded in the results
+    """
+
+    return platform.node()
+
+def run_benchmarks(names, scale):
+    """
+    Run the given benchmarks, printing a line for each,
+    and return a dictionary of their results
+    """
+
+    results = OrderedDict([('scale', scale), ('host', host_name()),
+            ('benchmarks', OrderedDict())])
+
+    for name in names:
+        result = run_benchmark(name, scale)
+        results['benchmarks'][name] = result
+
+        print('%-14s compile %8.3fs exec %7.3fs rss %7.1fMB '
+                'code %8d instructions %7d' %
+                (name, result['compile_time'], result['exec_time'],
+                    result['peak_rss'] / 1e6, result['code_size'],
+                    result['instructions']))
+        sys.stdout.flush()
+
+    return results
+
+def compare_results(baseline, current, time_tolerance, memory_tolerance):
+    """
+    Print a comparison of the current results to the baseline,
+    and return the number of regressions
+
+    Times and memory are only regressions if the baseline and
+    the current results were recorded on the same host.
+    """
+
+    same_host = (baseline.get('host') is not None and
+            baseline.get('host') == current.get('host'))
+    if not same_host:
+        print('baseline is not from this host (%s): increases in time '
+                'and memory are only warnings\n' %
+                (baseline.get('host') or 'unknown'))
+
+    tolerances = {
+            'time': time_tolerance,
+            'memory': memory_tolerance,
+            'exact': 0.0
+        }
+
+    regressions = 0
+
+    print('%-14s %-13s %14s %14s %8s' %
+            ('benchmark', 'metric', 'baseline', 'current', 'change'))
+
+    for name, result in current['benchmarks'].items():
+        if name not in baseline['benchmarks']:
+            print('%-14s (no baseline)' % name)
+            continue
+
+        base_result = baseline['benchmarks'][name]
+        for metric, kind in METRICS.items():
+            base_value = base_result[metric]
+            value = result[metric]
+
+            if base_value:
+                change = (value - base_value) / base_value
+            else:
+                change = 0.0 if not value else float('inf')
+
+            regressed = change > tolerances[kind]
+            if kind == 'time' and max(value, base_value) < MIN_TIME:
+                regressed = False
+
+            if regressed and kind != 'exact' and not same_host:
+                flag = 'warning'
+            elif regressed:
+                regressions += 1
+                flag = 'REGRESSION'
+            elif change < -tolerances[kind]:
+                flag = 'improved'
+            else:
+                flag = ''
+
+            if kind == 'time':
+                values = ('%14.3f' % base_value, '%14.3f' % value)
+            else:
+                values = ('%14d' % base_value, '%14d' % value)
+
+            print('%-14s %-13s %s %s %+7.1f%% %s' %
+                    ((name, metric) + values + (change * 100, flag)))
+
+    return regressions
+
+def baseline_path(scale):
+    return os.path.join(BASELINES, '%s.json' % scale)
+
+def write_results(results, path):
+    with open(path, 'w') as out:
+        json.dump(results, out, indent=2)
+        out.write('\n')
+
+def read_results(path):
+    with open(path) as src:
+        return json.load(src, object_pairs_hook=OrderedDict)
+
+def main(argv):
+    parser = ArgumentParser(description='Basic sequence benchmarks')
+    subparsers = parser.add_subparsers(dest='command')
+
+    run_parser = subparsers.add_parser('run', help='run the benchmarks')
+    compare_parser = subparsers.add_parser('compare',
+            help='compare results to the baselines')
+    measure_parser = subparsers.add_parser('measure',
+            help='run one benchmark in this process (used by run)')
+
+    for sub in (run_parser, compare_parser, measure_parser):
+        sub.add_argument('-s', '--scale', choices=SCALES, default='full',
+                help='size of the benchmarks [default=%(default)s]')
+
+    for sub in (run_parser, compare_parser):
+        sub.add_argument('-b', '--benchmarks', nargs='+',
+                choices=list(BENCHMARKS), default=list(BENCHMARKS),
+                help='benchmarks to run [default=all]')
+
+    run_parser.add_argument('-o', '--output', default=None,
+            help='file to save the results to (as JSON)')
+
+    compare_parser.add_argument('-r', '--results', default=None,
+            help='saved results to compare, instead of running the benchmarks')
+    compare_parser.add_argument('--baseline', default=None,
+            help='baseline file [default=benchmarks/baselines/SCALE.json]')
+    compare_parser.add_argument('--time-tolerance', type=float, default=0.25,
+            help='allowed fractional increase in times [default=%(default)s]')
+    compare_parser.add_argument('--memory-tolerance', type=float, default=0.10,
+            help='allowed fractional increase in peak RSS [default=%(default)s]')
+
+    measure_parser.add_argument('name', choices=list(BENCHMARKS))
+
+    opts = parser.parse_args(argv)
+
+    if opts.command == 'measure':
+        print(json.dumps(measure(opts.name, opts.scale)))
+        return 0
+
+    elif opts.command == 'run':
+        results = run_benchmarks(opts.benchmarks, opts.scale)
+        if opts.output:
+            write_results(results, opts.output)
+        return 0
+
+    elif opts.command == 'compare':
+        baseline = read_results(opts.baseline or baseline_path(opts.scale))
+
+        if opts.results:
+            current = read_results(opts.results)
+        else:
+            current = run_benchmarks(opts.benchmarks, opts.scale)
+            print()
+
+        if current['scale'] != baseline['scale']:
+            print('ERROR: results are for scale %s, baseline for scale %s' %
+                    (current['scale'], baseline['scale']))
+            return 1
+
+        regressions = compare_results(baseline, current,
+                opts.time_tolerance, opts.memory_tolerance)
+        if regressions:
+            print('%d regressions' % regressions)
+            return 1
+
+        return 0
+
+    else:
+        parser.print_help()
+        return 2
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
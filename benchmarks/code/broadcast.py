@@ -0,0 +1,19 @@
+# Copyright 2016 by Raytheon BBN Technologies Corp.  All Rights Reserved.
+
+# A long program of single-qubit operations on a multi-qubit
+# QRegister, for benchmarking the expansion of the QRegister
+# operations into operations on each qubit
+
+from qgl2.qgl1 import Id, X90, Y, MEAS
+from qgl2.qgl2 import qgl2decl, QRegister
+from qgl2.util import init
+
+@qgl2decl
+def broadcast(iterations, width):
+    qs = QRegister(width)
+    for i in range(iterations):
+        init(qs)
+        X90(qs)
+        Id(qs, length=1e-7 * (i % 7))
+        Y(qs)
+        MEAS(qs)
@@ -0,0 +1,27 @@
+# Copyright 2016 by Raytheon BBN Technologies Corp.  All Rights Reserved.
+
+# Active reset of a register of qubits, for benchmarks/bench_sequences.py
+# (qgl2.basic_sequences.Feedback.Reset is not yet implemented)
+
+from qgl2.qgl2 import qgl2decl, qreg
+from qgl2.qgl1 import Id, MEAS, X
+from qgl2.util import init
+
+@qgl2decl
+def qreset_full(q: qreg, delay, measSign):
+    m = MEAS(q)
+    Id(q, length=delay)
+    if m == measSign:
+        X(q)
+    else:
+        Id(q)
+
+# Note that this resets the whole register at once: the compiler
+# does not yet handle a runtime measurement assigned inside a loop
+# over the qubits of the register (the measured qubit is not bound).
+@qgl2decl
+def reset_all(qs: qreg, rounds, measDelay):
+    for _ in range(rounds):
+        init(qs)
+        qreset_full(qs, measDelay, 1)
+        MEAS(qs)
@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 by Raytheon BBN Technologies Corp.  All Rights Reserved.
+
+"""
+Check how the cost of each stage of the compiler grows with the
+size of the program
+
+generate_program creates a synthetic QGL2 program whose size is
+controlled by a handful of parameters:
+
+    trips: the trip count of each loop
+    depth: the number of nested loops
+    helpers: the number of distinct qgl2decl helpers called in
+        the body of the innermost loop
+    call_depth: the length of the chain of calls made by each helper
+        (helper calls helper_1, which calls helper_2, etc)
+    qubits: the number of qubits in the register
+    ifs: the number of runtime ifs (on a measurement) in the body
+        of the innermost loop
+
+The harness sweeps one parameter at a time (holding the others at
+their base values), compiles the program for each value, and fits
+the wall time and peak memory of each stage (see pyqgl2.stats)
+against the size of the program, as a power law:
+
+    cost = a * size ** exponent
+
+The size is the parameter itself, except for depth, where it is
+the number of iterations of the innermost loop (trips ** depth).
+A stage whose exponent exceeds the threshold (--max-exponent) is
+flagged as superlinear: for example, the evaluator snapshotting the
+NameRewriter once per loop iteration, or the inliner needing another
+pass for each level of the call chain.  Stages whose cost is too
+small to measure reliably (at the largest size) are not flagged.
+
+These cover the performance cliffs that the small unit tests (such
+as test/code/for/*.py) never reach.  Run from the root of the
+repository, with src/python on the PYTHONPATH, e.g.:
+
+    # sweep every parameter, and print the fitted exponents
+    python benchmarks/scaling.py
+
+    # sweep the trip count and the call depth only, with larger sizes
+    python benchmarks/scaling.py -d trips call_depth -n 5 -f 4
+
+    # save a program, to compile or inspect it by hand
+    python benchmarks/scaling.py generate --trips 3 --helpers 2 -o /tmp/s.py
+
+Exits with status 1 if any stage is flagged as superlinear.
+Measuring memory (with tracemalloc) slows the compiler down, so each
+program is compiled twice: once for the times, and once for memory.
+"""
+
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+
+from argparse import ArgumentParser
+from collections import OrderedDict
+
+ROOT = os.path.normpath(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+sys.path.insert(0, ROOT)
+
+MAIN_NAME = 'scaling_main'
+
+# The base value of each parameter, and the sizes that each
+# parameter is swept through (for a sweep of the given number
+# of points, multiplying the value by the given factor at each
+# point).  Each sweep starts from its base value, except for
+# depth, which starts at one loop with a trip count of 2.
+PARAMETERS = OrderedDict([
+        ('trips', 4),
+        ('depth', 1),
+        ('helpers', 1),
+        ('call_depth', 1),
+        ('qubits', 1),
+        ('ifs', 1)
+    ])
+
+# Costs smaller than these (at the largest size of a sweep) are too
+# noisy to fit, so they are never flagged as superlinear
+MIN_TIME = 0.05
+MIN_MEMORY = 1024 * 1024
+
+def generate_program(trips=4, depth=1, helpers=1, call_depth=1,
+        qubits=1, ifs=1):
+    """
+    Return the source of a synthetic QGL2 program with the
+    given size (see the module documentation).  The main
+    function is scaling_main(qs: qreg), where qs is a register
+    of the given number of qubits (the qubits parameter is only
+    recorded in the header comment).
+
+    The ifs test a measurement of the whole register, because
+    the compiler doesn't handle a runtime measurement of one
+    element of the register inside a loop over the register.
+    """
+
+    assert trips >= 1 and depth >= 1 and qubits >= 1
+    assert helpers >= 0 and call_depth >= 1 and ifs >= 0
+
+    lines = [
+            '# Generated by benchmarks/scaling.py: trips=%d depth=%d '
+                'helpers=%d call_depth=%d qubits=%d ifs=%d' %
+                (trips, depth, helpers, call_depth, qubits, ifs),
+            '',
+            'from qgl2.qgl2 import qgl2decl, qreg',
+            'from qgl2.qgl1 import Id, MEAS, X, X90, Y90',
+            'from qgl2.util import init',
+            ''
+        ]
+
+    # Each helper is a chain of call_depth functions, each of which
+    # does a pulse and then calls the next one in the chain
+    for helper in range(helpers):
+        for link in range(call_depth):
+            lines += [
+                    '@qgl2decl',
+                    'def helper_%d_%d(q: qreg):' % (helper, link),
+                    '    %s(q)' % ('X90' if link % 2 == 0 else 'Y90')
+                ]
+            if link + 1 < call_depth:
+                lines.append('    helper_%d_%d(q)' % (helper, link + 1))
+            lines.append('')
+
+    lines += [
+            '@qgl2decl',
+            'def %s(qs: qreg):' % MAIN_NAME
+        ]
+
+    indent = '    '
+    for level in range(depth):
+        lines.append('%sfor i%d in range(%d):' % (indent, level, trips))
+        indent += '    '
+
+    lines.append('%sinit(qs)' % indent)
+    for helper in range(helpers):
+        lines.append('%shelper_%d_0(qs)' % (indent, helper))
+    for num in range(ifs):
+        lines += [
+                '%sm%d = MEAS(qs)' % (indent, num),
+                '%sif m%d == 1:' % (indent, num),
+                '%s    X(qs)' % indent,
+                '%selse:' % indent,
+                '%s    Id(qs)' % indent
+            ]
+    lines.append('%sMEAS(qs)' % indent)
+    lines.append('')
+
+    return '\n'.join(lines)
+
+def program_size(params):
+    """
+    Return the number of iterations of the innermost
+    loop of the program with the given parameters
+    """
+
+    return params['trips'] ** params['depth']
+
+def sweep_values(name, points, factor):
+    """
+    Return the values of the given parameter for a sweep
+    of the given number of points
+    """
+
+    if name == 'depth':
+        # the depth grows the program exponentially, so it
+        # is stepped by one (with a trip count of 2)
+        return list(range(1, points + 1))
+
+    start = PARAMETERS[name]
+    return [start * (factor ** point) for point in range(points)]
+
+def compile_program(path, params, track_memory):
+    """
+    Compile the program at the given path, for a register of
+    the given number of qubits, and return its CompileStats
+    """
+
+    from pyqgl2.main import compile_function
+    from pyqgl2.qreg import QRegister
+    from pyqgl2.stats import CompileStats
+
+    qubits = ['q%d' % num for num in range(1, params['qubits'] + 1)]
+
+    stats = CompileStats(track_memory=track_memory)
+    compile_function(path, MAIN_NAME, (QRegister(*qubits),), stats=stats)
+    stats.stop()
+
+    return stats
+
+def stage_costs(stats, field):
+    """
+    Return the total of the given field (wall_time or memory_peak)
+    for each stage of the given CompileStats.  The inliner
+    iterations are combined into one stage (for wall_time, their
+    total; for memory_peak, the largest).
+    """
+
+    costs = OrderedDict()
+    for record in stats.stages:
+        value = getattr(record, field) or 0
+        if field == 'memory_peak':
+            costs[record.stage] = max(costs.get(record.stage, 0), value)
+        else:
+            costs[record.stage] = costs.get(record.stage, 0) + value
+
+    return costs
+
+def measure_point(tmpdir, params, memory=True):
+    """
+    Generate and compile the program with the given parameters,
+    and return its measurements
+    """
+
+    from pyqgl2.test_cl import create_default_channelLibrary
+
+    create_default_channelLibrary(False, True,
+            numQubits=max(3, params['qubits']))
+
+    path = os.path.join(tmpdir, 'scaling_%s.py' % '_'.join(
+            '%s%d' % (name[0], value) for name, value in params.items()))
+    with open(path, 'w') as fout:
+        fout.write(generate_program(**params))
+
+    stats = compile_program(path, params, track_memory=False)
+    times = stage_costs(stats, 'wall_time')
+    times['total'] = stats.total('wall_time')
+
+    result = OrderedDict([
+            ('params', params),
+            ('size', program_size(params)),
+            ('inliner_iterations', sum(1 for record in stats.stages
+                if record.stage == 'inliner')),
+            ('statements', [record.statements_out for record in stats.stages
+                if record.stage == 'evaluator'][0]),
+            ('time', times)
+        ])
+
+    if memory:
+        stats = compile_program(path, params, track_memory=True)
+        peaks = stage_costs(stats, 'memory_peak')
+        peaks['total'] = max(peaks.values())
+        result['memory'] = peaks
+
+    return result
+
+def fit_exponent(sizes, costs):
+    """
+    Fit costs = a * sizes ** exponent by least squares on the
+    logarithms, and return (exponent, r_squared).  Points with
+    a cost of zero are ignored; returns (None, None) if fewer
+    than two distinct sizes remain.
+    """
+
+    points = [(math.log(size), math.log(cost))
+            for size, cost in zip(sizes, costs) if size > 0 and cost > 0]
+    if len(set(x for x, _ in points)) < 2:
+        return None, None
+
+    count = len(points)
+    mean_x = sum(x for x, _ in points) / count
+    mean_y = sum(y for _, y in points) / count
+
+    sxx = sum((x - mean_x) ** 2 for x, _ in points)
+    sxy = sum((x - mean_x) * (y - mean_y) for x, y in points)
+    syy = sum((y - mean_y) ** 2 for _, y in points)
+
+    exponent = sxy / sxx
+    r_squared = (sxy * sxy) / (sxx * syy) if syy else 1.0
+
+    return exponent, r_squared
+
+def sweep(tmpdir, name, points, factor, memory=True):
+    """
+    Sweep the given parameter, printing a line for each point,
+    and return the measurements
+    """
+
+    results = list()
+    for value in sweep_values(name, points, factor):
+        params = OrderedDict(PARAMETERS)
+        params[name] = value
+        if name == 'depth':
+            params['trips'] = 2
+
+        result = measure_point(tmpdir, params, memory=memory)
+        results.append(result)
+
+        print('%-10s %6d size %7d statements %7d inliner passes %2d '
+                'time %8.3fs' %
+                (name, value, result['size'] if name == 'depth' else value,
+                    result['statements'], result['inliner_iterations'],
+                    result['time']['total']))
+        sys.stdout.flush()
+
+    return results
+
+def fit_sweep(name, results, max_exponent):
+    """
+    Fit the cost of each stage in the given sweep against the
+    size, and return a list of (metric, stage, exponent, r_squared,
+    largest cost, flagged)
+    """
+
+    if name == 'depth':
+        sizes = [result['size'] for result in results]
+    else:
+        sizes = [result['params'][name] for result in results]
+
+    fits = list()
+    for metric, minimum in (('time', MIN_TIME), ('memory', MIN_MEMORY)):
+        if metric not in results[0]:
+            continue
+
+        for stage in results[-1][metric]:
+            costs = [result[metric].get(stage, 0) for result in results]
+            exponent, r_squared = fit_exponent(sizes, costs)
+            if exponent is None:
+                continue
+
+            flagged = exponent > max_exponent and costs[-1] >= minimum
+            fits.append((metric, stage, exponent, r_squared,
+                    costs[-1], flagged))
+
+    return fits
+
+def print_fits(name, fits):
+    print('%-10s %-7s %-17s %9s %6s %12s' %
+            ('sweep', 'metric', 'stage', 'exponent', 'r^2', 'largest'))
+
+    for metric, stage, exponent, r_squared, largest, flagged in fits:
+        if metric == 'time':
+            largest = '%11.3fs' % largest
+        else:
+            largest = '%10.1fMB' % (largest / 1e6)
+
+        print('%-10s %-7s %-17s %9.2f %6.2f %s %s' %
+                (name, metric, stage, exponent, r_squared, largest,
+                    'SUPERLINEAR' if flagged else ''))
+
+def main(argv):
+    parser = ArgumentParser(description='Compiler scaling checks')
+    subparsers = parser.add_subparsers(dest='command')
+
+    sweep_parser = subparsers.add_parser('sweep',
+            help='sweep the sizes, and fit the costs [default]')
+    gen_parser = subparsers.add_parser('generate',
+            help='generate one program')
+
+    sweep_parser.add_argument('-d', '--dimensions', nargs='+',
+            choices=list(PARAMETERS), default=list(PARAMETERS),
+            help='parameters to sweep [default=all]')
+    sweep_parser.add_argument('-n', '--points', type=int, default=4,
+            help='number of sizes in each sweep [default=%(default)s]')
+    sweep_parser.add_argument('-f', '--factor', type=int, default=2,
+            help='ratio between successive sizes [default=%(default)s]')
+    sweep_parser.add_argument('--max-exponent', type=float, default=1.25,
+            help='largest exponent that is not flagged as superlinear '
+                '[default=%(default)s]')
+    sweep_parser.add_argument('--no-memory', dest='memory', default=True,
+            action='store_false', help='do not measure memory')
+    sweep_parser.add_argument('-o', '--output', default=None,
+            help='file to save the measurements and fits to (as JSON)')
+
+    for name, value in PARAMETERS.items():
+        gen_parser.add_argument('--%s' % name.replace('_', '-'),
+                dest=name, type=int, default=value,
+                help='[default=%(default)s]')
+    gen_parser.add_argument('-o', '--output', default=None,
+            help='file to write the program to [default=stdout]')
+
+    # sweep is the default command
+    if not argv or argv[0] not in ('sweep', 'generate', '-h', '--help'):
+        argv = ['sweep'] + list(argv)
+
+    opts = parser.parse_args(argv)
+
+    if opts.command == 'generate':
+        source = generate_program(
+                **dict((name, getattr(opts, name)) for name in PARAMETERS))
+        if opts.output:
+            with open(opts.output, 'w') as fout:
+                fout.write(source)
+        else:
+            print(source)
+        return 0
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        sweeps = OrderedDict()
+        for name in opts.dimensions:
+            results = sweep(tmpdir, name, opts.points, opts.factor,
+                    memory=opts.memory)
+            sweeps[name] = (results,
+                    fit_sweep(name, results, opts.max_exponent))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    print()
+    flagged = 0
+    for name, (results, fits) in sweeps.items():
+        print_fits(name, fits)
+        print()
+        flagged += sum(1 for fit in fits if fit[-1])
+
+    if opts.output:
+        with open(opts.output, 'w') as out:
+            json.dump(OrderedDict(
+                    (name, OrderedDict([
+                        ('results', results),
+                        ('fits', [OrderedDict(zip(
+                            ('metric', 'stage', 'exponent', 'r_squared',
+                                'largest', 'flagged'), fit))
+                            for fit in fits])]))
+                    for name, (results, fits) in sweeps.items()),
+                out, indent=2)
+            out.write('\n')
+
+    if flagged:
+        print('%d superlinear stages' % flagged)
+        return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
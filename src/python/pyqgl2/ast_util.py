@@ -7,14 +7,69 @@ transform, or create a Python parse tree
 """
 
 import ast
-import sys
 
 from copy import deepcopy
 
+from pyqgl2.context import ContextState
+from pyqgl2.counters import count
 from pyqgl2.pysourcegen import dump_python_source
 
 
-class NodeError(object):
+class QGL2CompileError(Exception):
+    """
+    Raised when the compiler halts because of an error in the
+    program being compiled (see NodeError.halt_on_error)
+
+    messages is the list of the most recent messages (see
+    NodeError.LAST_MSGS), and level is the highest error level
+    seen (NodeError.NODE_ERROR_ERROR or NODE_ERROR_FATAL).
+    """
+
+    def __init__(self, messages, level):
+        self.messages = [str(message) for message in messages]
+        self.level = level
+
+        if self.messages:
+            text = 'compilation failed: %s' % self.messages[-1]
+        else:
+            text = 'compilation failed'
+
+        super(QGL2CompileError, self).__init__(text)
+
+
+class DeferredMsg(object):
+    """
+    A message that has been recorded (in NodeError.LAST_MSGS)
+    but not printed, and whose text has not been created yet.
+    The text is created the first time it is needed (see
+    NodeError.last_msgs).
+
+    The location of the node is saved when the DeferredMsg is
+    created, in case the node is changed before the text is created.
+    """
+
+    __slots__ = ('location', 'level', 'msg', 'text')
+
+    def __init__(self, node, level, msg):
+        if node:
+            self.location = (getattr(node, 'qgl_fname', '<unknown>'),
+                    node.lineno, node.col_offset)
+        else:
+            self.location = None
+
+        self.level = level
+        self.msg = msg
+        self.text = None
+
+    def __str__(self):
+        if self.text is None:
+            self.text = NodeError._format_msg(
+                    self.location, self.level, self.msg)
+            self.msg = None
+        return self.text
+
+
+class NodeError(object, metaclass=ContextState):
     """
     A mix-in to make it simplify the generation of
     consistent, meaningful error and warning messages
@@ -28,6 +83,19 @@ class NodeError(object):
     The methods are implemented with module methods (below)
     so that they don't need to be called from a
     Visitor/Transformer.
+
+    The error levels and messages are kept separately for
+    each CompileContext (see pyqgl2.context).
+
+    The msg of each method may be a string, or a callable that
+    returns the string.  If the message is not going to be printed
+    (because its level is below MUTE_ERR_LEVEL), then the callable
+    is not called (and the message is not formatted) unless the
+    message is fetched later via last_msgs.  This lets the hot
+    paths of the compiler create detailed diagnostics (for example,
+    with ast2str) without paying for them when they are muted.
+    The callable should only refer to values that don't change
+    after the message is created.
     """
 
     NODE_ERROR_NONE = 0
@@ -50,6 +118,9 @@ class NodeError(object):
     #
     MUTE_ERR_LEVEL = NODE_ERROR_WARNING
 
+    # The most recent msg given to each method (as given,
+    # so it may be a callable; see the docstring)
+    #
     LAST_DIAG_MSG = ''
     LAST_WARNING_MSG = ''
     LAST_ERROR_MSG = ''
@@ -65,6 +136,9 @@ class NodeError(object):
     # Record most recent LAST_N messages created, even if they
     # are NOT printed (either because they've already been
     # printed, or because they are filtered by level, etc).
+    # The messages that were not printed because of their level
+    # are DeferredMsgs; use last_msgs() to get the text of all
+    # of the messages.
     #
     # Used by unit tests, where we want to check that the right
     # messages are created.  (if the test expects to create a
@@ -74,6 +148,20 @@ class NodeError(object):
     LAST_N = 8
     LAST_MSGS = list()
 
+    # If not None, then the messages that would be printed are
+    # appended to this list, as (level, text) tuples, instead of
+    # being printed or recorded, so that a worker process can
+    # return them to its parent (see pyqgl2.inline.inline_level)
+    #
+    CAPTURED_MSGS = None
+
+    CONTEXT_ATTRS = (
+            'MAX_ERR_LEVEL', 'MUTE_ERR_LEVEL',
+            'LAST_DIAG_MSG', 'LAST_WARNING_MSG',
+            'LAST_ERROR_MSG', 'LAST_FATAL_MSG',
+            'ALL_PRINTED', 'LAST_N', 'LAST_MSGS', 'CAPTURED_MSGS')
+    CONTEXT_INHERIT = ('MUTE_ERR_LEVEL', 'LAST_N')
+
     def __init__(self):
         NodeError.MAX_ERR_LEVEL = NodeError.NODE_ERROR_NONE
         NodeError.MUTE_ERR_LEVEL = NodeError.NODE_ERROR_WARNING
@@ -95,6 +183,15 @@ class NodeError(object):
         NodeError.LAST_MSGS = list()
         NodeError.MAX_ERR_LEVEL = NodeError.NODE_ERROR_NONE
 
+    @staticmethod
+    def last_msgs():
+        """
+        Return the text of the most recent messages (see LAST_MSGS),
+        creating the text of any deferred messages
+        """
+
+        return [str(text) for text in NodeError.LAST_MSGS]
+
     @staticmethod
     def error_detected():
         return NodeError.MAX_ERR_LEVEL >= NodeError.NODE_ERROR_ERROR
@@ -108,11 +205,12 @@ class NodeError(object):
         At certain points in the program, however, it makes little sense
         to continue if there has been an error in an earlier part of
         the program.  Use halt_on_error() to detect this condition and
-        halt.
+        halt, by raising a QGL2CompileError.
         """
 
         if NodeError.error_detected():
-            sys.exit(1)
+            raise QGL2CompileError(
+                    NodeError.last_msgs(), NodeError.MAX_ERR_LEVEL)
 
     @staticmethod
     def diag_msg(node, msg=None):
@@ -166,6 +264,29 @@ class NodeError(object):
 
         assert level in NodeError.NODE_ERROR_LEGAL_LEVELS
 
+        if node:
+            if hasattr(node, 'qgl_fname'):
+                qgl_fname = node.qgl_fname
+            else:
+                qgl_fname = '<unknown>'
+
+            location = (qgl_fname, node.lineno, node.col_offset)
+        else:
+            location = None
+
+        return NodeError._format_msg(location, level, msg)
+
+    @staticmethod
+    def _format_msg(location, level, msg):
+        """
+        Format a message, given the (fname, lineno, col_offset)
+        location of its node (or None), its level, and the
+        message (a string, or a callable that returns a string)
+        """
+
+        if callable(msg):
+            msg = msg()
+
         if not msg:
             msg = '?'
 
@@ -174,14 +295,8 @@ class NodeError(object):
         else:
             level_str = 'weird'
 
-        if node:
-            if hasattr(node, 'qgl_fname'):
-                qgl_fname = node.qgl_fname
-            else:
-                qgl_fname = '<unknown>'
-
-            text = ('%s:%d:%d: ' %
-                    (qgl_fname, node.lineno, node.col_offset))
+        if location:
+            text = '%s:%d:%d: ' % location
         else:
             text = ''
 
@@ -198,11 +313,19 @@ class NodeError(object):
         to its level), and if so then print it and add it to the
         set of all printed messages (which is used to ensure that
         duplicates of the message won't be printed)
+
+        The text may be a DeferredMsg, if the message
+        is below MUTE_ERR_LEVEL.
         """
 
         if level > NodeError.MAX_ERR_LEVEL:
             NodeError.MAX_ERR_LEVEL = level
 
+        if NodeError.CAPTURED_MSGS is not None:
+            if level >= NodeError.MUTE_ERR_LEVEL:
+                NodeError.CAPTURED_MSGS.append((level, str(text)))
+            return
+
         # FIXME: slightly awkward: changes to LAST_N don't "take effect"
         # until a message is created
         #
@@ -221,6 +344,7 @@ class NodeError(object):
             # print it over and over again (for repeated
             # substitions, inlining, or loop unrolling)
             #
+            text = str(text)
             if text not in NodeError.ALL_PRINTED:
                 print('%s' % text)
                 NodeError.ALL_PRINTED.add(text)
@@ -231,10 +355,13 @@ class NodeError(object):
         Helper function that uses _create_msg and _emit_msg,
         and then  all the real work of creating
         the messages, updating the max error level observed, and
-        exiting when a fatal error is encountered
+        halting when a fatal error is encountered
 
         Does basic sanity checking on its inputs to make sure that
         the function is called correctly
+
+        If the message is not going to be printed, then its text
+        is not created now; a DeferredMsg is recorded instead.
         """
 
         # Detect improper usage, and bomb out
@@ -243,16 +370,20 @@ class NodeError(object):
 
         assert level in NodeError.NODE_ERROR_LEGAL_LEVELS
 
-        text = NodeError._create_msg(node, level, msg=msg)
+        if level >= NodeError.MUTE_ERR_LEVEL:
+            text = NodeError._create_msg(node, level, msg=msg)
+        else:
+            text = DeferredMsg(node, level, msg)
 
         NodeError._emit_msg(level, text)
 
         # If we've encountered a fatal error, then there's no
         # point in continuing (even if we haven't printed the
-        # error message): exit immediately.
+        # error message): halt immediately.
         #
         if NodeError.MAX_ERR_LEVEL == NodeError.NODE_ERROR_FATAL:
-            sys.exit(1)
+            raise QGL2CompileError(
+                    NodeError.last_msgs(), NodeError.MAX_ERR_LEVEL)
 
 
 # See NodeError above for more description.  These methods
@@ -323,7 +454,12 @@ def ast2str(ptree):
     (as a string)
     """
 
-    return dump_python_source(ptree)
+    text = dump_python_source(ptree)
+
+    count('ast2str_calls')
+    count('ast2str_chars', len(text))
+
+    return text
 
 
 def copy_all_loc(new_node, old_node, recurse=False):
@@ -334,8 +470,8 @@ def copy_all_loc(new_node, old_node, recurse=False):
     If recurse is not False, then recursively copy the location
     from old_node to each node within new_node
 
-    Currently the only new pyqgl2 field is qgl_fname, but
-    there will probably be others
+    The pyqgl2 fields are qgl_fname and qgl_origins
+    (see pyqgl2.explain)
     """
 
     assert isinstance(new_node, ast.AST), 'got %s' % str(type(new_node))
@@ -346,12 +482,16 @@ def copy_all_loc(new_node, old_node, recurse=False):
 
         if hasattr(old_node, 'qgl_fname'):
             new_node.qgl_fname = old_node.qgl_fname
+        if hasattr(old_node, 'qgl_origins'):
+            new_node.qgl_origins = old_node.qgl_origins
     else:
         for subnode in ast.walk(new_node):
             ast.copy_location(subnode, old_node)
 
             if hasattr(old_node, 'qgl_fname'):
                 subnode.qgl_fname = old_node.qgl_fname
+            if hasattr(old_node, 'qgl_origins'):
+                subnode.qgl_origins = old_node.qgl_origins
 
     return new_node
 
@@ -0,0 +1,238 @@
+# Copyright 2016 by Raytheon BBN Technologies Corp.  All Rights Reserved.
+
+"""
+Resource budgets for a compilation
+
+A mistyped program (for example, a loop over range(10**6) instead
+of range(10)) can make the evaluator unroll loops until the machine
+runs out of memory.  To stop this early, limits can be set on:
+
+    statements: the number of statements created by unrolling loops
+        (in the evaluator) and inlining calls (in the inliner)
+    memory: the growth of the resident set size of the process
+        since the compilation started (in bytes)
+    seconds: the wall time since the compilation started
+
+The limits are set with set_budget (or from the command line, with
+--max-statements, --max-memory, and --max-seconds).  Like the other
+settings of the compiler, they are kept in the active CompileContext,
+and are inherited by new contexts.  By default there are no limits.
+
+Each iteration of a loop unrolled by the evaluator (in do_for and
+do_classical_while), and each call inlined by the inliner, charges
+the statements it creates to its location in the source.  Statements
+created by an inner loop are charged to the inner loop, not to the
+loops that contain it.  If a limit is exceeded, then the compilation
+is halted with a fatal error, whose message includes a report of the
+source locations that created the most statements.
+
+If no limits are set, then start_budget doesn't create a BudgetUsage,
+and nothing is charged.
+"""
+
+import resource
+import sys
+import time
+
+from collections import Counter
+
+from pyqgl2.ast_util import NodeError
+from pyqgl2.context import ContextState
+
+
+class BudgetUsage(object):
+    """
+    The resources used by a compilation so far, and the number
+    of statements created at each source location, as a Counter
+    whose keys are (filename, lineno, kind) tuples, where kind
+    is 'for', 'while', or 'call'
+    """
+
+    # The memory is only checked once per this many charges,
+    # because it is more expensive to measure than the time
+    MEMORY_INTERVAL = 64
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.start_memory = current_memory()
+        self.statements = 0
+        self.blame = Counter()
+        self.charges = 0
+
+    def elapsed(self):
+        return time.perf_counter() - self.start_time
+
+    def memory(self):
+        return current_memory() - self.start_memory
+
+
+class CompileBudget(object, metaclass=ContextState):
+    """
+    The limits of the budget (inherited by new contexts), and
+    the usage of the current compilation in each CompileContext
+    (see start_budget)
+    """
+
+    MAX_STATEMENTS = None
+    MAX_MEMORY = None
+    MAX_SECONDS = None
+
+    USAGE = None
+
+    CONTEXT_ATTRS = ('MAX_STATEMENTS', 'MAX_MEMORY', 'MAX_SECONDS', 'USAGE')
+    CONTEXT_INHERIT = ('MAX_STATEMENTS', 'MAX_MEMORY', 'MAX_SECONDS')
+
+
+def current_memory():
+    """
+    Return the resident set size of this process, in bytes
+
+    If psutil is not available, then the peak resident set size
+    is used instead, which is only an approximation (because it
+    never shrinks)
+    """
+
+    try:
+        import psutil
+    except ImportError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        # ru_maxrss is in kilobytes on Linux (but bytes on macOS)
+        if sys.platform != 'darwin':
+            peak *= 1024
+        return peak
+
+    return psutil.Process().memory_info().rss
+
+
+def set_budget(statements=None, memory=None, seconds=None):
+    """
+    Set the limits of the budget in the active CompileContext.
+    A limit of None means that there is no limit.
+    """
+
+    CompileBudget.MAX_STATEMENTS = statements
+    CompileBudget.MAX_MEMORY = memory
+    CompileBudget.MAX_SECONDS = seconds
+
+
+def budget_active():
+    """
+    Return True if any limits are set in the active CompileContext
+    """
+
+    return bool(CompileBudget.MAX_STATEMENTS or CompileBudget.MAX_MEMORY
+            or CompileBudget.MAX_SECONDS)
+
+
+def start_budget():
+    """
+    Start charging a new compilation in the active CompileContext
+    (if any limits are set)
+    """
+
+    if budget_active():
+        CompileBudget.USAGE = BudgetUsage()
+    else:
+        CompileBudget.USAGE = None
+
+
+def budget_charged():
+    """
+    Return the number of statements charged so far, or zero if
+    the budget is not active.  Pass this to charge_budget to
+    exclude the statements charged by nested loops and calls.
+    """
+
+    usage = CompileBudget.USAGE
+    if usage is None:
+        return 0
+
+    return usage.statements
+
+
+def charge_budget(node, kind, statements, start_charged=None):
+    """
+    Charge the given number of statements, created by the loop
+    or call at the given node, to the budget, and then check
+    whether any limits have been exceeded.  kind is 'for',
+    'while', or 'call'.
+
+    If start_charged is given, then it is the value of
+    budget_charged before the statements were created, and the
+    statements charged since then (by nested loops and calls)
+    are not charged again.
+    """
+
+    usage = CompileBudget.USAGE
+    if usage is None:
+        return
+
+    if start_charged is not None:
+        statements -= usage.statements - start_charged
+        if statements < 0:
+            statements = 0
+
+    usage.statements += statements
+    usage.blame[(getattr(node, 'qgl_fname', '<unknown>'),
+            getattr(node, 'lineno', 0), kind)] += statements
+
+    check_budget(node)
+
+
+def check_budget(node=None):
+    """
+    Check whether any limits of the budget have been exceeded,
+    and if so, halt the compilation with a fatal error
+    (reported at the given node)
+    """
+
+    usage = CompileBudget.USAGE
+    if usage is None:
+        return
+
+    usage.charges += 1
+
+    max_statements = CompileBudget.MAX_STATEMENTS
+    if max_statements and usage.statements > max_statements:
+        budget_exceeded(node, usage, '%d statements created (limit %d)' %
+                (usage.statements, max_statements))
+
+    max_seconds = CompileBudget.MAX_SECONDS
+    if max_seconds and usage.elapsed() > max_seconds:
+        budget_exceeded(node, usage, '%.1f seconds elapsed (limit %.1f)' %
+                (usage.elapsed(), max_seconds))
+
+    max_memory = CompileBudget.MAX_MEMORY
+    if max_memory and (usage.charges % BudgetUsage.MEMORY_INTERVAL) == 1:
+        memory = usage.memory()
+        if memory > max_memory:
+            budget_exceeded(node, usage,
+                    '%.1f MB of memory used (limit %.1f MB)' %
+                    (memory / (1 << 20), max_memory / (1 << 20)))
+
+
+def blame_report(usage, limit=10):
+    """
+    Return the lines of a report of the source locations
+    that created the most statements
+    """
+
+    lines = ['statements created, by source location:']
+    for (fname, lineno, kind), statements in usage.blame.most_common(limit):
+        lines.append('    %s:%d: %s: %d' % (fname, lineno, kind, statements))
+
+    others = len(usage.blame) - limit
+    if others > 0:
+        lines.append('    (%d other locations)' % others)
+
+    return lines
+
+
+def budget_exceeded(node, usage, reason):
+    """
+    Halt the compilation with a fatal error, with a blame report
+    """
+
+    NodeError.fatal_msg(node, '\n'.join(
+            ['compile budget exceeded: %s' % reason] + blame_report(usage)))
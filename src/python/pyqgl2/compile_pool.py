@@ -0,0 +1,226 @@
+# Copyright 2016 by Raytheon BBN Technologies Corp.  All Rights Reserved.
+
+"""
+Compile many independent QGL2 programs in parallel
+
+compile_many distributes a list of compile jobs across a pool of
+worker processes.  The functions returned by compile_function cannot
+be passed between processes, so each job returns a CompileResult
+instead, which holds the generated QGL1 source and the values it
+refers to, along with the diagnostics from the compile.  The QGL1
+function can be recreated from a CompileResult in any process.
+
+Each worker process is reused for many jobs, and is "warmed up" before
+its first job by importing the compiler, QGL, and the QGL2 libraries, so
+the cost of these imports (which is usually much larger than the cost
+of compiling a typical program) is paid once per worker instead of
+once per job.  Each worker also enables the importer's module cache
+(see pyqgl2.importer.ModuleCache), so the QGL2 libraries and any other
+source files shared by its jobs are only parsed and executed once.
+"""
+
+import contextlib
+import functools
+import io
+import pickle
+import sys
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+import pyqgl2.sequences
+
+from pyqgl2.ast_util import NodeError
+from pyqgl2.context import CompileContext
+from pyqgl2.counters import get_counts
+from pyqgl2.eval import EvalTransformer
+from pyqgl2.importer import enable_module_cache
+from pyqgl2.main import compile_function, bind_precomputed_values
+
+
+class CompileResult(object):
+    """
+    The result of compiling one job with compile_many.
+
+    Unlike the function returned by compile_function, this can be
+    pickled, so it can be returned from a worker process.  It holds
+    the generated QGL1 source code and the precomputed values that
+    the code refers to, along with the diagnostics and the hot-path
+    counts (see pyqgl2.counters) from the compile.
+    Use function() to recreate the QGL1 function.
+
+    If the compile failed, then source is None and error describes
+    the failure.
+    """
+
+    def __init__(self, filename, main_name):
+        self.filename = filename
+        self.main_name = main_name
+
+        self.func_name = None
+        self.source = None
+        self.precomputed_values = None
+
+        self.error = None
+        self.messages = list()
+        self.counts = dict()
+        self.output = ''
+        self.elapsed = 0.0
+
+    def __repr__(self):
+        status = 'error' if self.error else 'ok'
+        return '<CompileResult %s %s: %s (%.3fs)>' % (
+                self.filename, self.main_name, status, self.elapsed)
+
+    def succeeded(self):
+        return self.error is None
+
+    def code(self):
+        """
+        Return the code object for the generated QGL1 source,
+        or None if the compile failed
+        """
+
+        if not self.succeeded():
+            return None
+
+        return compile(self.source, '<none>', mode='exec')
+
+    def function(self):
+        """
+        Recreate the QGL1 function from the source and the
+        precomputed values, or return None if the compile failed
+        """
+
+        if not self.succeeded():
+            return None
+
+        # Evaluate the code in the same scope that
+        # get_sequence_function uses
+        #
+        scratch_scope = dict()
+        eval(self.code(), dict(vars(pyqgl2.sequences)), scratch_scope)
+
+        context = CompileContext()
+        with context:
+            EvalTransformer.PRECOMPUTED_VALUES = self.precomputed_values
+
+        return bind_precomputed_values(
+                scratch_scope[self.func_name], context)
+
+
+# True once init_compile_worker has initialized this process
+#
+WORKER_INITIALIZED = False
+
+def init_compile_worker(initializer=None, initargs=()):
+    """
+    Initialize a compile_many worker process (if it has not already
+    been initialized): import the modules that compiling and running
+    QGL2 programs will need, so that every compile in this worker can
+    reuse them, enable the module cache, and then call the user-supplied
+    initializer (if any), which may, for example, load a channel library.
+    """
+
+    global WORKER_INITIALIZED
+
+    if WORKER_INITIALIZED:
+        return
+
+    import QGL
+    import qgl2.qgl1
+    import qgl2.qgl2
+
+    enable_module_cache()
+
+    if initializer:
+        initializer(*initargs)
+
+    WORKER_INITIALIZED = True
+
+
+def worker_compile_job(initializer, initargs, job):
+    """
+    Compile one compile_many job in a worker process,
+    initializing the worker first if this is its first job
+
+    (ProcessPoolExecutor only accepts an initializer in
+    Python 3.7 and later, so each job initializes its worker
+    if necessary)
+    """
+
+    init_compile_worker(initializer, initargs)
+    return compile_job(job)
+
+
+def compile_job(job):
+    """
+    Compile one compile_many job in the current process, and return
+    a CompileResult.  Each job is compiled in its own CompileContext,
+    and its output is captured instead of printed.
+    """
+
+    filename, main_name = job[0], job[1]
+    toplevel_bindings = job[2] if len(job) > 2 else None
+
+    result = CompileResult(filename, main_name)
+    output = io.StringIO()
+    start_time = time.perf_counter()
+
+    context = CompileContext()
+    with context:
+        # keep all of the messages, not just the last few
+        NodeError.LAST_N = sys.maxsize
+
+    with contextlib.redirect_stdout(output):
+        try:
+            qgl1_main = compile_function(
+                    filename, main_name, toplevel_bindings,
+                    context=context)
+
+            with context:
+                values = EvalTransformer.PRECOMPUTED_VALUES
+
+            # Make sure that the values can be returned
+            pickle.dumps(values)
+
+            result.func_name = qgl1_main.__name__
+            result.source = qgl1_main.qgl_source
+            result.precomputed_values = values
+        except Exception as exc:
+            result.error = '%s: %s' % (type(exc).__name__, str(exc))
+
+    with context:
+        result.messages = NodeError.last_msgs()
+        result.counts = dict(get_counts())
+
+    result.output = output.getvalue()
+    result.elapsed = time.perf_counter() - start_time
+
+    return result
+
+
+def compile_many(jobs, workers=None, initializer=None, initargs=()):
+    """
+    Compile a list of independent jobs in parallel, using a pool
+    of worker processes.
+
+    Each job is a tuple (filename, main_name, toplevel_bindings),
+    where toplevel_bindings may be omitted, as for compile_function.
+    The bindings must be picklable.
+
+    workers is the number of worker processes (by default, the
+    number of CPUs).  The optional initializer is called with
+    initargs in each worker before its first job.
+
+    Returns a list of CompileResults, in the same order as the jobs.
+    A job that fails to compile does not prevent the others from
+    being compiled; its CompileResult describes the failure.
+    """
+
+    jobs = list(jobs)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(
+                functools.partial(worker_compile_job, initializer, initargs),
+                jobs))
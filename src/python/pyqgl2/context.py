@@ -0,0 +1,212 @@
+# Copyright 2016 by Raytheon BBN Technologies Corp.  All Rights Reserved.
+
+"""
+Per-compilation state
+
+Several of the compiler classes (NodeError, DebugMsg, QRegister,
+TempVarManager, EvalTransformer) keep state in what look like class
+attributes, such as NodeError.MAX_ERR_LEVEL or QRegister.KNOWN_QUBITS.
+If a class uses the ContextState metaclass, then the attributes it
+lists in CONTEXT_ATTRS are not stored in the class itself, but in a
+CompileContext, so different compilations do not share this state.
+
+Each call to compile_function creates a new CompileContext (or uses
+the one passed to it via its context parameter), passes it to each
+of the compilation stages, and each stage activates it while it runs.
+The active contexts are kept in a stack in a threading.local, so each
+thread has its own active context.  A function run in another thread
+(for example, in an executor) does not see the context that was
+active when it was submitted; pass the context to it, and activate it
+there.  The compilation stages never yield to an event loop, so asyncio
+tasks (which share a thread) never see each other's contexts, as long
+as the compilation is run in an executor (as compile_function_async
+does).
+
+If no CompileContext is active, then a single process-wide default
+context is used, which is the same behavior as if this state were
+stored in the classes themselves.
+
+A new CompileContext inherits the attributes listed in the
+CONTEXT_INHERIT attributes of the classes (the user settings, such as
+the debug level, and the qubits that have already been allocated) from
+the context that is active when it is created, but none of the other
+state.
+
+The optional features that observe or limit a compilation (tracing,
+progress reports, statistics, budgets, and explain mode) all keep their
+hooks, listeners, or collectors in a ContextState class, with an empty
+default that is not inherited by new contexts.  The code in the compiler
+that feeds a feature checks for that default first, and does nothing
+else if the feature is not enabled in the active context, so a feature
+that is not being used costs one attribute read at each of its call
+sites.
+
+Reading one of these attributes costs one thread-local lookup and one
+dict lookup.  Code that reads them in a tight loop should fetch the
+values once, rather than once per iteration.
+"""
+
+import copy
+import functools
+import threading
+
+
+class CompileContext(object):
+    """
+    The mutable state of a single compilation
+
+    The state is stored as a map from (owner class, attribute name)
+    to value.  If a value has not been set in this context, then the
+    default (declared in the class body of the owner) is copied into
+    the context the first time it is referenced.
+
+    A CompileContext may be activated more than once (including
+    recursively, or in more than one thread at the same time),
+    but each activation must be exited in the reverse order.
+    """
+
+    # The (owner class, attribute name) of the attributes that are
+    # inherited by new contexts
+    #
+    INHERITED = set()
+
+    def __init__(self, inherit=True):
+
+        self.values = dict()
+
+        if inherit:
+            parent = current_context()
+            for key, value in parent.values.items():
+                if key in CompileContext.INHERITED:
+                    self.values[key] = copy.copy(value)
+
+    def __enter__(self):
+        _ACTIVE.stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        stack = _ACTIVE.stack
+        assert len(stack) > 1 and stack[-1] is self, 'context is not active'
+        stack.pop()
+        return False
+
+    def get(self, owner, name):
+        """
+        Return the value of the attribute with the given name
+        of the given owner class in this context
+        """
+
+        key = (owner, name)
+        try:
+            return self.values[key]
+        except KeyError:
+            value = copy.copy(owner._context_defaults[name])
+            self.values[key] = value
+            return value
+
+
+DEFAULT_CONTEXT = CompileContext(inherit=False)
+
+
+class _ActiveContexts(threading.local):
+    """
+    The stack of the active contexts of each thread; the last
+    is the active context.  The bottom of each stack is the
+    default context.
+    """
+
+    def __init__(self):
+        self.stack = [DEFAULT_CONTEXT]
+
+
+_ACTIVE = _ActiveContexts()
+
+
+def current_context():
+    """
+    Return the CompileContext that is active in the current thread
+    """
+
+    return _ACTIVE.stack[-1]
+
+
+def activates_context(func):
+    """
+    Decorator for compilation stages: adds a context keyword
+    parameter to func, and runs func with that CompileContext
+    active.  If no context is given, the currently active
+    context is used.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, context=None, **kwargs):
+        if context is None:
+            context = current_context()
+        with context:
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def _context_property(owner, name):
+    """
+    Create the property that redirects the given attribute of
+    the given owner class to the active CompileContext
+    """
+
+    key = (owner, name)
+    active = _ACTIVE
+
+    def getter(cls):
+        context = active.stack[-1]
+        try:
+            return context.values[key]
+        except KeyError:
+            return context.get(owner, name)
+
+    def setter(cls, value):
+        active.stack[-1].values[key] = value
+
+    return property(getter, setter)
+
+
+class ContextState(type):
+    """
+    Metaclass for classes that keep per-compilation state in
+    "class attributes"
+
+    The names of these attributes are listed in the CONTEXT_ATTRS
+    attribute of the class; the subset that are inherited by new
+    contexts are listed in CONTEXT_INHERIT.  The initial values
+    given in the class body become the defaults for each
+    CompileContext.
+
+    Each class gets its own subclass of this metaclass, with a
+    property for each of its CONTEXT_ATTRS, so that ordinary
+    attribute references (which don't refer to CONTEXT_ATTRS)
+    are not slowed down.
+    """
+
+    def __new__(mcs, name, bases, namespace):
+
+        attrs = namespace.pop('CONTEXT_ATTRS', ())
+        inherit = namespace.pop('CONTEXT_INHERIT', ())
+
+        defaults = dict()
+        for attr in attrs:
+            defaults[attr] = namespace.pop(attr)
+
+        namespace['_context_defaults'] = defaults
+
+        # Create the metaclass for this class, and then fill in
+        # its properties once the owner class exists
+        #
+        meta = type(name + 'ContextState', (mcs,), dict())
+        cls = super(ContextState, mcs).__new__(meta, name, bases, namespace)
+
+        for attr in attrs:
+            setattr(meta, attr, _context_property(cls, attr))
+        for attr in inherit:
+            CompileContext.INHERITED.add((cls, attr))
+
+        return cls
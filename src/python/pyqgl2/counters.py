@@ -0,0 +1,120 @@
+# Copyright 2016 by Raytheon BBN Technologies Corp.  All Rights Reserved.
+
+"""
+Counters for the hot paths of the compiler
+
+The functions that tend to dominate the cost of a compilation
+call count() each time they are called, so that we can see which
+parts of a program make the compilation expensive without running
+a profiler.  The counters are:
+
+    quickcopy_calls: calls to quickcopy
+    quickcopy_bytes: bytes pickled by quickcopy
+    quickcopy_deepcopies: quickcopy calls that fell back to deepcopy
+    native_eval_calls: calls to NameSpace.native_eval
+    resolve_sym_calls: calls to NameSpaces.resolve_sym
+    module_cache_hits: modules found in the importer's ModuleCache
+    module_cache_misses: modules read (and added to the ModuleCache)
+    ast2str_calls: calls to ast2str
+    ast2str_chars: characters of source created by ast2str
+    inline_expansions: calls inlined by inline_call
+    for_iterations: iterations of for loops unrolled by the evaluator
+    while_iterations: iterations of while loops unrolled by the evaluator
+
+The counts are kept in the active CompileContext (so concurrent
+compilations don't disturb each other's counts), and are always
+collected: each count costs one thread-local lookup and one dict
+update, which is small compared to the work being counted.
+
+compile_function attaches the counts for its compilation to the
+function it returns, as its qgl_counts attribute, and adds them
+to its CompileStats (if any).
+"""
+
+from collections import Counter
+
+from pyqgl2.context import ContextState
+
+
+COUNTER_NAMES = (
+        'quickcopy_calls',
+        'quickcopy_bytes',
+        'quickcopy_deepcopies',
+        'native_eval_calls',
+        'resolve_sym_calls',
+        'module_cache_hits',
+        'module_cache_misses',
+        'ast2str_calls',
+        'ast2str_chars',
+        'inline_expansions',
+        'for_iterations',
+        'while_iterations'
+    )
+
+
+class Counters(object, metaclass=ContextState):
+    """
+    The hot-path counts of the active CompileContext
+    """
+
+    COUNTS = Counter()
+
+    CONTEXT_ATTRS = ('COUNTS',)
+
+
+def count(name, amount=1):
+    """
+    Add amount to the counter with the given name
+    in the active CompileContext
+    """
+
+    Counters.COUNTS[name] += amount
+
+
+def add_counts(counts):
+    """
+    Add the given counts (for example, the counts from a
+    compilation done in another process) to the counts
+    of the active CompileContext
+    """
+
+    Counters.COUNTS.update(counts)
+
+
+def get_counts():
+    """
+    Return a copy of the counts of the active CompileContext
+    """
+
+    return Counter(Counters.COUNTS)
+
+
+def counts_since(start_counts):
+    """
+    Return the counts that have been added to the active
+    CompileContext since start_counts was fetched by get_counts.
+    Every name in COUNTER_NAMES is present in the result, even
+    if its count is zero.
+    """
+
+    current = Counters.COUNTS
+
+    counts = dict()
+    for name in COUNTER_NAMES:
+        counts[name] = current[name] - start_counts[name]
+    for name in current:
+        if name not in counts:
+            counts[name] = current[name] - start_counts[name]
+
+    return counts
+
+
+def format_counts(counts):
+    """
+    Return a human-readable table of the given counts
+    """
+
+    names = [name for name in COUNTER_NAMES if name in counts]
+    names += sorted(name for name in counts if name not in COUNTER_NAMES)
+
+    return '\n'.join('%-22s %12d' % (name, counts[name]) for name in names)
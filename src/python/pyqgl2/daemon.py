@@ -0,0 +1,342 @@
+# Copyright 2016 by Raytheon BBN Technologies Corp.  All Rights Reserved.
+
+"""
+A "warm" compile daemon for pyqgl2.main, and a thin client for it
+
+Starting the compiler from the commandline is slow, because importing
+QGL, the QGL2 libraries, and their dependencies usually takes much
+longer than compiling a typical program.  The daemon pays this cost
+once, and then compiles each program it is sent in the same process,
+so repeated compiles from the commandline (or from a build script)
+start immediately.
+
+Start the daemon with:
+
+    python -m pyqgl2.daemon --serve
+
+and then use
+
+    python -m pyqgl2.daemon <arguments>
+
+in place of
+
+    python src/python/pyqgl2/main.py <arguments>
+
+The client does not parse its arguments: it sends them, along with
+its working directory, to the daemon, which parses them with the
+same parse_args as pyqgl2.main and then does whatever pyqgl2.main
+would do.  The client prints the output of the compile and exits
+with the same status that pyqgl2.main would.  Stop the daemon with:
+
+    python -m pyqgl2.daemon --stop
+
+The daemon listens on a Unix socket, given by the QGL2D_SOCKET
+environment variable, or DEFAULT_SOCKET if that is not set.
+
+Each request is compiled in a new CompileContext (so the settings
+given by one request, such as -D or -v, do not affect the next),
+but the daemon compiles one request at a time, because each request
+changes process-wide state (the working directory, sys.stdout, and
+the channel library).  Note that ordinary Python modules imported by
+a QGL2 program are cached by the daemon, just as they would be in a
+notebook; restart the daemon if they change.
+
+The daemon also caches the work done for earlier requests, and reuses
+it as long as the files it depends on have not changed (according to
+their modification times and sizes):
+
+    QGL2 source files: the importer's module cache (see
+        pyqgl2.importer.ModuleCache) keeps the parsed AST and the
+        native globals of each file
+    channel libraries: a library loaded with -cl is kept, and
+        reused while it is still the active library
+    compiled programs: the function compiled for a request is kept
+        (see pyqgl2.main.RunCache), and reused for a later request
+        with the same working directory and arguments, if none of
+        its source files have changed; the output of the compile
+        is printed again.  (Requests that ask for information about
+        the compile, such as --stats or --trace, always compile.)
+
+This module only imports the standard library (until the daemon is
+started), so the client starts quickly.
+"""
+
+import contextlib
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+import traceback
+
+DEFAULT_SOCKET = os.path.join(
+        tempfile.gettempdir(), 'qgl2d-%d.sock' % os.getuid())
+
+# The modules that the daemon imports when it starts, so that
+# they are already imported when the first request arrives
+#
+WARM_MODULES = [
+        'QGL',
+        'QGL.Scheduler',
+        'QGL.PulseSequencePlotter',
+        'IPython.lib.pretty',
+        'psutil',
+        'qgl2.qgl1',
+        'qgl2.qgl2',
+        'pyqgl2.main',
+        'pyqgl2.test_cl'
+        ]
+
+
+def socket_path():
+    """
+    Return the path to the socket that the daemon listens on
+    """
+
+    return os.environ.get('QGL2D_SOCKET', DEFAULT_SOCKET)
+
+
+def send_request(request, path=None):
+    """
+    Send a request (a dictionary) to the daemon listening on the
+    given socket path, wait for it to finish, and return its reply
+    (also a dictionary).
+
+    Raises OSError if there is no daemon listening on the socket.
+    """
+
+    if path is None:
+        path = socket_path()
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        with sock.makefile('rwb') as stream:
+            stream.write(json.dumps(request).encode('utf-8') + b'\n')
+            stream.flush()
+            reply = stream.readline()
+
+    if not reply:
+        return {'status': 1, 'output': 'qgl2d: no reply from daemon\n'}
+
+    return json.loads(reply.decode('utf-8'))
+
+
+def exit_status(code):
+    """
+    Convert the code of a SystemExit to an exit status,
+    the way that the interpreter does
+    """
+
+    if code is None:
+        return 0
+    elif isinstance(code, int):
+        return code
+    else:
+        print(code, file=sys.stderr)
+        return 1
+
+
+class CompileRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Read one request from the client, and send back the reply
+    """
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+
+        try:
+            request = json.loads(line.decode('utf-8'))
+            reply = self.server.handle_compile_request(request)
+        except BaseException as exc:
+            reply = {'status': 1,
+                    'output': 'qgl2d: bad request: %s\n' % str(exc)}
+
+        self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+
+
+class CompileServer(socketserver.UnixStreamServer):
+    """
+    The compile daemon: a server that compiles each request it
+    receives with pyqgl2.main, one request at a time
+
+    A request is a dictionary with either an 'argv' (the arguments
+    for pyqgl2.main) and a 'cwd' (the working directory for the
+    compile), or a 'command', which is either 'ping' or 'stop'.
+
+    The reply is a dictionary with the 'status' (the exit status
+    that pyqgl2.main would have returned) and the 'output' (what
+    pyqgl2.main would have printed, on either stdout or stderr).
+    """
+
+    def __init__(self, path=None):
+
+        if path is None:
+            path = socket_path()
+
+        self.path = path
+        self.stopping = False
+        self.cache = None
+
+        remove_stale_socket(path)
+
+        socketserver.UnixStreamServer.__init__(
+                self, path, CompileRequestHandler)
+
+    def warm_up(self):
+        """
+        Import all of the modules that compiling a program will need
+        """
+
+        for name in WARM_MODULES:
+            __import__(name)
+
+    def serve(self):
+        """
+        Handle requests until a 'stop' request arrives
+        """
+
+        import pyqgl2.importer
+        from pyqgl2.main import RunCache
+
+        self.cache = RunCache()
+
+        # If the module cache wasn't already enabled, then
+        # disable it again when the daemon stops
+        #
+        module_cache = pyqgl2.importer.MODULE_CACHE
+        pyqgl2.importer.enable_module_cache()
+
+        try:
+            while not self.stopping:
+                self.handle_request()
+        finally:
+            self.server_close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            if module_cache is None:
+                pyqgl2.importer.disable_module_cache()
+
+    def handle_compile_request(self, request):
+
+        command = request.get('command')
+        if command == 'stop':
+            self.stopping = True
+            return {'status': 0, 'output': ''}
+        elif command == 'ping':
+            return {'status': 0, 'output': 'pid %d\n' % os.getpid()}
+        elif command is not None:
+            return {'status': 1,
+                    'output': 'qgl2d: unknown command [%s]\n' % command}
+
+        return run_compile(request['argv'], request['cwd'], self.cache)
+
+
+def run_compile(argv, cwd, cache=None):
+    """
+    Do whatever running pyqgl2.main with the given arguments in the
+    given working directory would do, and return a reply dictionary
+    with the exit status and the output.
+
+    If a RunCache is given, then run_main may reuse the work
+    done by earlier requests (see pyqgl2.main.run_main).
+
+    The working directory and sys.path are restored afterwards.
+    """
+
+    from pyqgl2.context import CompileContext
+    from pyqgl2.main import parse_args, run_main
+
+    output = io.StringIO()
+    saved_cwd = os.getcwd()
+    saved_path = list(sys.path)
+
+    try:
+        with contextlib.redirect_stdout(output), \
+                contextlib.redirect_stderr(output):
+            try:
+                os.chdir(cwd)
+
+                # parse_args changes the debugging settings,
+                # so it must run in the new context too
+                #
+                with CompileContext(inherit=False):
+                    status = run_main(parse_args(argv), cache)
+            except SystemExit as exc:
+                status = exit_status(exc.code)
+            except BaseException:
+                traceback.print_exc()
+                status = 1
+    finally:
+        os.chdir(saved_cwd)
+        sys.path[:] = saved_path
+
+    return {'status': status, 'output': output.getvalue()}
+
+
+def remove_stale_socket(path):
+    """
+    Remove the socket at the given path, if it is left over from
+    a daemon that is no longer running.  Raises OSError if there
+    is a daemon running on that socket.
+    """
+
+    if not os.path.exists(path):
+        return
+
+    try:
+        send_request({'command': 'ping'}, path)
+    except OSError:
+        os.unlink(path)
+    else:
+        raise OSError('qgl2d is already running on [%s]' % path)
+
+
+def client_main(argv):
+    """
+    Send the arguments to the daemon, print its output, and
+    return the exit status of the compile
+    """
+
+    path = socket_path()
+
+    try:
+        reply = send_request({'argv': argv, 'cwd': os.getcwd()}, path)
+    except OSError as exc:
+        print('qgl2d: cannot connect to daemon on [%s]: %s' %
+                (path, str(exc)), file=sys.stderr)
+        print('qgl2d: start the daemon with: python -m pyqgl2.daemon --serve',
+                file=sys.stderr)
+        return 1
+
+    sys.stdout.write(reply['output'])
+    sys.stdout.flush()
+
+    return reply['status']
+
+
+def main(argv):
+
+    if argv[:1] == ['--serve']:
+        server = CompileServer()
+        server.warm_up()
+        print('qgl2d: listening on [%s]' % server.path)
+        server.serve()
+        return 0
+    elif argv[:1] == ['--stop']:
+        try:
+            send_request({'command': 'stop'})
+        except OSError as exc:
+            print('qgl2d: no daemon on [%s]: %s' %
+                    (socket_path(), str(exc)), file=sys.stderr)
+            return 1
+        return 0
+    else:
+        return client_main(argv)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -3,6 +3,8 @@
 import os
 import traceback
 
+from pyqgl2.context import ContextState
+
 """
 Convenience class for managing debugging messages
 
@@ -63,7 +65,7 @@ Examples:
 
 """
 
-class DebugMsg(object):
+class DebugMsg(object, metaclass=ContextState):
     """
     Encapsulates the state of the debug message module:
     the active tags, and the active level
@@ -78,6 +80,12 @@ class DebugMsg(object):
     ACTIVE_TAGS = dict()
     ACTIVE_LEVEL = NONE
 
+    # The tags and level are user settings, but they are kept
+    # separately for each CompileContext (see pyqgl2.context)
+    #
+    CONTEXT_ATTRS = ('ACTIVE_TAGS', 'ACTIVE_LEVEL')
+    CONTEXT_INHERIT = CONTEXT_ATTRS
+
     @staticmethod
     def reset():
         DebugMsg.ACTIVE_TAGS = dict()
@@ -136,6 +144,28 @@ class DebugMsg(object):
 
         return old_level
 
+    @staticmethod
+    def is_active(level, tag=None):
+        """
+        Return True if a message with the given level and tag
+        would be printed, False otherwise.  This can be used to
+        skip the work of creating debugging output that would
+        be dropped.
+        """
+
+        # If there's a level for this tag, then use it as the
+        # active level; otherwise, use the general active level
+        #
+        if tag and (tag in DebugMsg.ACTIVE_TAGS):
+            active_level = DebugMsg.ACTIVE_TAGS[tag]
+        else:
+            active_level = DebugMsg.ACTIVE_LEVEL
+
+        # if the active level is higher than the given level,
+        # then the message is dropped
+        #
+        return level >= active_level
+
     @staticmethod
     def log(msg, level=ALL, tag=None):
         """
@@ -145,6 +175,9 @@ class DebugMsg(object):
         Debug messages can be suppressed so that only messages that
         match one of a set of tags, or that at a level greater than or
         equal to a global threshold, are printed.
+
+        The msg may be a callable that returns the message, in which
+        case it is only called if the message is going to be printed.
         """
 
         # truncate the level, if necessary
@@ -154,20 +187,14 @@ class DebugMsg(object):
         elif level > DebugMsg.HIGH:
             level = DebugMsg.HIGH
 
-        # If there's a level for this tag, then use it as the
-        # active level; otherwise, use the general active level
-        #
-        if tag and (tag in DebugMsg.ACTIVE_TAGS):
-            active_level = DebugMsg.ACTIVE_TAGS[tag]
-        else:
-            active_level = DebugMsg.ACTIVE_LEVEL
-
-        # if the active level is higher than the given level,
-        # then drop the message
+        # if the message isn't active, then drop the message
         #
-        if level < active_level:
+        if not DebugMsg.is_active(level, tag):
             return
 
+        if callable(msg):
+            msg = msg()
+
         (fname, lineno, funcname, code) = traceback.extract_stack(limit=2)[0]
 
         text = ('DEBUG-%d: %s:%d (%s) %s' %
@@ -4,22 +4,33 @@
 
 import ast
 import collections
+import collections.abc
+import itertools
+import numpy as np
 import re
+import types
 
 import pyqgl2.ast_util
 import pyqgl2.inline
 
 from pyqgl2.ast_util import NodeError, ast2str, expr2ast, copy_all_loc
+from pyqgl2.ast_util import contains_type
+from pyqgl2.context import ContextState
 from pyqgl2.debugmsg import DebugMsg
 from pyqgl2.importer import NameSpaces
 from pyqgl2.inline import inline_call
 from pyqgl2.inline import Inliner
 from pyqgl2.inline import NameFinder, NameRedirector, NameRewriter
 from pyqgl2.inline import TempVarManager
+from pyqgl2.inline import names_in_ptree
 from pyqgl2.qgl2_check import QGL2check
 from pyqgl2.qreg import is_qbit_create
 from pyqgl2.qreg import QRegister, QReference
 from pyqgl2.quickcopy import quickcopy
+from pyqgl2.counters import count
+from pyqgl2.trace import trace_span
+from pyqgl2.budget import budget_charged, charge_budget
+from pyqgl2.explain import add_origin
 
 def insert_keyword(kwargs, key, value):
 
@@ -31,6 +42,21 @@ def insert_keyword(kwargs, key, value):
         kwargs[key] = value
         return None
 
+def is_immutable_value(value):
+    """
+    Return True if the given value is of a type that is known to be
+    immutable (including tuples and frozensets of immutable values),
+    False otherwise
+    """
+
+    if value is None or isinstance(value, (
+            bool, int, float, complex, str, bytes, range, np.number)):
+        return True
+    elif isinstance(value, (tuple, frozenset)):
+        return all(is_immutable_value(elem) for elem in value)
+    else:
+        return False
+
 def compute_actuals(call_ast, importer, local_variables=None):
     """
     """
@@ -440,7 +466,8 @@ class SimpleEvaluator(object):
                 return
 
         else:
-            DebugMsg.log('bogus target_ast [%s]' % ast.dump(target_ast),
+            DebugMsg.log(
+                    lambda: 'bogus target_ast [%s]' % ast.dump(target_ast),
                     DebugMsg.HIGH)
 
 
@@ -706,7 +733,7 @@ class MarkRuntimeVars(ast.NodeVisitor):
 
         return marker.referenced_vars
 
-class EvalTransformer(object):
+class EvalTransformer(object, metaclass=ContextState):
     """
     Transform an AST by replacing expressions with their values
     where possible
@@ -726,6 +753,9 @@ class EvalTransformer(object):
 
     PRECOMPUTED_VALUES = dict()
 
+    # kept separately for each CompileContext
+    CONTEXT_ATTRS = ('PRECOMPUTED_VALUES',)
+
     def __init__(self, eval_state):
         """
         eval_state is a SimpleEvaluator instance
@@ -787,6 +817,16 @@ class EvalTransformer(object):
         # use a list because measurements are ordered
         self.runtime_variables = list()
 
+        # the constant pool: a map from the names of numpy arrays
+        # that are iterated over by for loops to the arrays, and
+        # a map from the names of the loop variables to the
+        # (array name, index) of their values in the pool.
+        # This lets us refer to each value by its position in
+        # the array, instead of converting each value to AST.
+        #
+        self.constant_pool = dict()
+        self.pooled_values = dict()
+
     def get_state(self):
         """
         Save a reference to the top of the locals_stack in
@@ -834,7 +874,8 @@ class EvalTransformer(object):
 
         name_finder = NameFinder()
         name_redirector = NameRedirector(
-                values=new_values, table_name=self.redirect_name)
+                values=new_values, table_name=self.redirect_name,
+                pooled=self.pooled_values)
 
         for stmnt in stmnts:
 
@@ -845,7 +886,10 @@ class EvalTransformer(object):
             names, _dotted_names, _sub_names = name_finder.find_names(stmnt)
 
             for name in names:
-                if name in local_variables:
+                if name in self.pooled_values:
+                    pool_name, _index = self.pooled_values[name]
+                    new_values[pool_name] = self.constant_pool[pool_name]
+                elif name in local_variables:
                     new_values[name] = local_variables[name]
                 else:
                     # for debugging only
@@ -1074,6 +1118,489 @@ class EvalTransformer(object):
 
         return stmnts
 
+    # Builtins that have no side effects and return a value that can be
+    # safely reused (i.e. not a single-use iterator).  Calls to these are
+    # the only calls permitted in a loop-invariant assignment.
+    #
+    PURE_FUNCTIONS = frozenset([
+            'abs', 'bool', 'complex', 'divmod', 'float', 'frozenset',
+            'int', 'len', 'list', 'max', 'min', 'pow', 'range', 'round',
+            'sorted', 'str', 'sum', 'tuple'])
+
+    # The PURE_FUNCTIONS that always return an immutable value,
+    # no matter what their parameters are, and those that always
+    # return a new mutable value
+    #
+    IMMUTABLE_FUNCTIONS = frozenset([
+            'bool', 'complex', 'float', 'int', 'len', 'round', 'str'])
+    MUTABLE_FUNCTIONS = frozenset(['list', 'sorted'])
+
+    # The itertools functions that construct an iterator over the
+    # combinations of their parameters.  These have no side effects,
+    # but the iterator they return can only be used once, so they
+    # may only be hoisted where the iterator is used up immediately
+    # (see is_invariant_expr).
+    #
+    ITERATOR_CONSTRUCTORS = frozenset([
+            itertools.combinations, itertools.combinations_with_replacement,
+            itertools.permutations, itertools.product])
+
+    def current_value(self, name, fname=None):
+        """
+        Find the value currently bound to the given (original,
+        not rewritten) local name, or if it is not a local name,
+        the global name in the namespace of fname (if any).
+
+        Returns (True, value) if the name is bound to a value,
+        or (False, None) if it is not (i.e. it is not bound yet,
+        or it has been replaced with a constant expression)
+        """
+
+        name_ast = self.rewriter.rewrite(ast.Name(id=name, ctx=ast.Load()))
+        if not isinstance(name_ast, ast.Name):
+            return False, None
+
+        local_variables = self.eval_state.locals_stack[-1]
+        if name_ast.id in local_variables:
+            return True, local_variables[name_ast.id]
+
+        importer = self.eval_state.importer
+        if fname and importer and fname in importer.path2namespace:
+            global_variables = importer.path2namespace[fname].native_globals
+            if name_ast.id in global_variables:
+                return True, global_variables[name_ast.id]
+
+        return False, None
+
+    def is_immutable_name(self, name, fname=None):
+        """
+        Return True if the current binding of the given name is
+        known to be immutable, and therefore cannot be modified
+        by passing it to a function
+
+        QRegisters (and references to them) and functions are not
+        modified by the functions they are passed to, so they count
+        as immutable.
+        """
+
+        name_ast = self.rewriter.rewrite(ast.Name(id=name, ctx=ast.Load()))
+        if not isinstance(name_ast, ast.Name):
+            # it was replaced by a constant
+            return True
+
+        found, value = self.current_value(name, fname)
+        return found and (is_immutable_value(value) or
+                isinstance(value, (QRegister, QReference,
+                    types.FunctionType, types.BuiltinFunctionType)))
+
+    def is_bound_name(self, name, fname=None):
+        """
+        Return True if the given name has a value at compile time
+        (it is bound to a value, or has been replaced with a constant)
+        """
+
+        name_ast = self.rewriter.rewrite(ast.Name(id=name, ctx=ast.Load()))
+        if not isinstance(name_ast, ast.Name):
+            return True
+
+        found, _value = self.current_value(name, fname)
+        return found
+
+    def is_iterator_constructor(self, name, fname=None):
+        """
+        Return True if the given name is bound to one of the
+        ITERATOR_CONSTRUCTORS
+        """
+
+        found, value = self.current_value(name, fname)
+        try:
+            return found and value in self.ITERATOR_CONSTRUCTORS
+        except TypeError:
+            # value is not hashable
+            return False
+
+    def is_immutable_expr(self, expr, immutable_names, fname=None):
+        """
+        Return True if the given expression always has an immutable
+        value: if it is built from literals, names bound to immutable
+        values (or listed in immutable_names), and operators, and
+        calls to PURE_FUNCTIONS that return immutable values when
+        called on these (or on sequences of immutable values)
+        """
+
+        if isinstance(expr, (ast.Num, ast.Str, ast.Bytes, ast.NameConstant)):
+            return True
+        elif isinstance(expr, ast.Name):
+            return ((expr.id in immutable_names) or
+                    self.is_immutable_name(expr.id, fname))
+        elif isinstance(expr, ast.BinOp):
+            return (self.is_immutable_expr(expr.left, immutable_names, fname)
+                    and self.is_immutable_expr(
+                        expr.right, immutable_names, fname))
+        elif isinstance(expr, ast.UnaryOp):
+            return self.is_immutable_expr(expr.operand, immutable_names, fname)
+        elif isinstance(expr, (ast.BoolOp, ast.Tuple)):
+            values = expr.values if isinstance(expr, ast.BoolOp) else expr.elts
+            return all(self.is_immutable_expr(value, immutable_names, fname)
+                    for value in values)
+        elif isinstance(expr, ast.Call):
+            if not isinstance(expr.func, ast.Name):
+                return False
+            elif expr.func.id in self.IMMUTABLE_FUNCTIONS:
+                return True
+            elif expr.func.id in self.MUTABLE_FUNCTIONS:
+                return False
+            elif expr.func.id not in self.PURE_FUNCTIONS:
+                return False
+
+            # The other pure functions (sum, max, etc) return an
+            # immutable value if their parameters are immutable,
+            # or sequences of immutable values
+            #
+            for arg in expr.args + [kw.value for kw in expr.keywords]:
+                if self.is_immutable_expr(arg, immutable_names, fname):
+                    continue
+                elif not isinstance(arg, ast.Name):
+                    return False
+
+                found, value = self.current_value(arg.id, fname)
+                if not (found and isinstance(value, (list, tuple, set)) and
+                        all(is_immutable_value(elem) for elem in value)):
+                    return False
+
+            return True
+        else:
+            return False
+
+    def split_loop_invariants(self, body, loop_var_names, loop_values=None):
+        """
+        Partition the body of a for loop into the assignments that
+        compute the same value on every iteration, and the rest of
+        the body.  Returns (hoisted, remaining), where hoisted is a
+        list of the invariant assignments (in their original order)
+        and remaining is the body without them.
+
+        An assignment is loop-invariant if it is a simple assignment
+        to a single name that is not assigned anywhere else in the
+        body, its target is not referenced earlier in the body, and
+        the expression refers only to names that are not modified
+        within the body (or are themselves invariant) and only calls
+        functions in PURE_FUNCTIONS (see is_invariant_expr).
+        The creation of a QRegister from invariant names is also
+        loop-invariant.
+
+        The invariant parts of the other statements (such as 2 * pi *
+        periods, as the parameter of a call) are also hoisted, by
+        assigning them to new temporary names (see hoist_invariant_exprs),
+        and the hoisted list includes these assignments.
+
+        This is conservative: anything that might modify a name (an
+        assignment, a subscript or attribute store, a method call, or
+        passing a mutable value to a function) makes that name, and
+        any name bound to the same value, variant.  Names that are
+        assigned an immutable value in the body (see is_immutable_expr)
+        may be passed to functions without making them variant, as
+        may the loop variables if loop_values (the values that the loop
+        iterates over) is given and is a sequence of immutable values.
+
+        The scan stops at the first statement that might change the
+        flow of control through the body, because any assignment after
+        that point might not be executed at all.
+        """
+
+        fname = getattr(body[0], 'qgl_fname', None) if body else None
+
+        assigned_cnt = collections.Counter()
+        mutated_names = set()
+        passed_names = set()
+
+        for node in ast.walk(ast.Module(body=body)):
+            if isinstance(node, ast.Name):
+                if not isinstance(node.ctx, ast.Load):
+                    assigned_cnt[node.id] += 1
+
+        # Find the names that are assigned exactly once in the body,
+        # and always bound to an immutable value.  Passing these to a
+        # function can't modify them, even though they are not bound
+        # yet (so we can't check their values).
+        #
+        immutable_names = set()
+        if isinstance(loop_values, range) or (
+                isinstance(loop_values, (list, tuple, np.ndarray)) and
+                all(is_immutable_value(value) for value in loop_values)):
+            immutable_names.update(loop_var_names)
+
+        for stmnt in body:
+            if (isinstance(stmnt, ast.Assign) and
+                    len(stmnt.targets) == 1 and
+                    isinstance(stmnt.targets[0], ast.Name) and
+                    assigned_cnt[stmnt.targets[0].id] == 1 and
+                    (is_qbit_create(stmnt) or self.is_immutable_expr(
+                        stmnt.value, immutable_names, fname))):
+                immutable_names.add(stmnt.targets[0].id)
+
+        for node in ast.walk(ast.Module(body=body)):
+            if isinstance(node, (ast.Subscript, ast.Attribute)):
+                if not isinstance(node.ctx, ast.Load):
+                    mutated_names.update(
+                            names_in_ptree(node.value))
+            elif isinstance(node, ast.Call):
+                if isinstance(node.func, ast.Attribute):
+                    mutated_names.update(
+                            names_in_ptree(node.func.value))
+                elif (isinstance(node.func, ast.Name) and
+                        (node.func.id in self.PURE_FUNCTIONS or
+                            self.is_iterator_constructor(
+                                node.func.id, fname))):
+                    continue
+
+                for arg in node.args + node.keywords:
+                    for name in names_in_ptree(arg):
+                        if name in immutable_names:
+                            continue
+                        elif not self.is_immutable_name(name, fname):
+                            passed_names.add(name)
+
+        # A name is also variant if it is an alias for a value
+        # that is modified via another name.  This only catches
+        # simple aliases, but that's all we expect to see in
+        # QGL2 programs.  If a name is only passed to a function
+        # (rather than modified directly), then it can only be an
+        # alias if the expression assigned to it can return the
+        # value of another name (i.e. it is not an operator or
+        # a constant).
+        #
+        for node in ast.walk(ast.Module(body=body)):
+            if not isinstance(node, ast.Assign):
+                continue
+
+            for target in node.targets:
+                if not isinstance(target, ast.Name):
+                    continue
+                elif target.id in mutated_names:
+                    pass
+                elif target.id not in passed_names:
+                    continue
+                elif isinstance(node.value, (ast.BinOp, ast.UnaryOp,
+                        ast.Compare, ast.Num, ast.Str, ast.NameConstant)):
+                    continue
+
+                mutated_names.update(names_in_ptree(node.value))
+
+        mutated_names.update(passed_names)
+
+        mutated_ids = set()
+        for name in mutated_names:
+            found, value = self.current_value(name, fname)
+            if found:
+                mutated_ids.add(id(value))
+
+        if mutated_ids:
+            for name in names_in_ptree(ast.Module(body=body)):
+                found, value = self.current_value(name, fname)
+                if found and id(value) in mutated_ids:
+                    mutated_names.add(name)
+
+        variant_names = set(loop_var_names)
+        variant_names.update(assigned_cnt.keys())
+        variant_names.update(mutated_names)
+
+        hoisted = list()
+        remaining = list()
+        referenced = set()
+        hoisted_names = set()
+
+        for index, stmnt in enumerate(body):
+            if contains_type(stmnt, (ast.Break, ast.Continue,
+                    ast.Return, ast.Raise)):
+                remaining += body[index:]
+                break
+
+            if self.is_invariant_assign(stmnt, assigned_cnt,
+                    variant_names, mutated_names, referenced, fname):
+                hoisted.append(stmnt)
+                variant_names.discard(stmnt.targets[0].id)
+                hoisted_names.add(stmnt.targets[0].id)
+            else:
+                stmnt, assigns = self.hoist_invariant_exprs(stmnt,
+                        variant_names, immutable_names, hoisted_names, fname)
+                hoisted.extend(assigns)
+                remaining.append(stmnt)
+                referenced.update(names_in_ptree(stmnt))
+
+        return hoisted, remaining
+
+    def is_invariant_expr(self, expr, variant_names, fname=None,
+            bound_names=None, iterable=False):
+        """
+        Return True if the given expression computes the same value
+        on every iteration of a loop: if it refers to none of the
+        variant_names, and only calls functions in PURE_FUNCTIONS,
+        or ITERATOR_CONSTRUCTORS if the iterator is used up at once
+        (because it is passed directly to one of the PURE_FUNCTIONS,
+        or because expr is the call and iterable is True)
+
+        If bound_names is given, then each name must also be bound
+        to a value at compile time, or be one of the bound_names.
+        """
+
+        consumed = set()
+        if iterable:
+            consumed.add(id(expr))
+
+        for node in ast.walk(expr):
+            if (isinstance(node, ast.Call) and
+                    isinstance(node.func, ast.Name) and
+                    node.func.id in self.PURE_FUNCTIONS):
+                consumed.update(id(arg) for arg in node.args)
+
+        func_names = set()
+        for node in ast.walk(expr):
+            if isinstance(node, ast.Call):
+                if not isinstance(node.func, ast.Name):
+                    return False
+
+                func_names.add(id(node.func))
+                if node.func.id in self.PURE_FUNCTIONS:
+                    continue
+                elif not (id(node) in consumed and
+                        self.is_iterator_constructor(node.func.id, fname)):
+                    return False
+            elif isinstance(node, (ast.Lambda, ast.comprehension,
+                    ast.Yield, ast.YieldFrom)):
+                return False
+            elif isinstance(node, ast.Name):
+                if node.id in variant_names:
+                    return False
+                elif bound_names is None or id(node) in func_names:
+                    continue
+                elif not (node.id in bound_names or
+                        self.is_bound_name(node.id, fname)):
+                    return False
+
+        return True
+
+    def hoist_invariant_exprs(self, stmnt, variant_names, immutable_names,
+            bound_names, fname=None):
+        """
+        Helper for split_loop_invariants: replace each of the largest
+        invariant sub-expressions of stmnt that compute something (an
+        operator or a call) with a new temporary name.
+
+        Only the parameters of calls, the values of assignments and
+        the iterables of for loops are examined, because the other
+        parts of compound statements might not be evaluated on each
+        iteration.  The parameters and values must be immutable (see
+        is_immutable_expr), because every iteration will use the same
+        value.  An iterable is only iterated over, so it may have any
+        value; if it is an iterator created by one of the
+        ITERATOR_CONSTRUCTORS, then it is converted to a tuple.
+        Each name in a sub-expression must have a value at compile
+        time (or be one of the bound_names, which are hoisted before
+        it), because the temporaries are evaluated at compile time.
+
+        Returns (stmnt, assigns), where stmnt is a copy of the given
+        statement with the sub-expressions replaced (or the same
+        statement, if there are none) and assigns is the list of
+        assignments of the sub-expressions to the new names.
+        """
+
+        tmp_names = TempVarManager.create_temp_var_manager(
+                name_prefix='___inv')
+        assigns = list()
+
+        def hoist(expr, iterable=False):
+            if not (isinstance(expr, (ast.BinOp, ast.BoolOp,
+                    ast.Compare, ast.Call)) and
+                    self.is_invariant_expr(expr, variant_names, fname,
+                        bound_names, iterable) and
+                    (iterable or self.is_immutable_expr(
+                        expr, immutable_names, fname))):
+                if isinstance(expr, ast.Call):
+                    expr.args = [hoist(arg) for arg in expr.args]
+                    for keyword in expr.keywords:
+                        keyword.value = hoist(keyword.value)
+                elif not isinstance(expr, (ast.Lambda, ast.ListComp,
+                        ast.SetComp, ast.DictComp, ast.GeneratorExp)):
+                    for field, value in ast.iter_fields(expr):
+                        if isinstance(value, ast.expr):
+                            setattr(expr, field, hoist(value))
+                        elif isinstance(value, list):
+                            value[:] = [
+                                    hoist(elem)
+                                    if isinstance(elem, ast.expr) else elem
+                                    for elem in value]
+                return expr
+
+            value = expr
+            if (iterable and isinstance(expr, ast.Call) and
+                    expr.func.id not in self.PURE_FUNCTIONS):
+                value = ast.Call(
+                        func=ast.Name(id='tuple', ctx=ast.Load()),
+                        args=[expr], keywords=[])
+                copy_all_loc(value, expr)
+                copy_all_loc(value.func, expr)
+
+            tmp_name = tmp_names.create_tmp_name()
+            target = copy_all_loc(
+                    ast.Name(id=tmp_name, ctx=ast.Store()), expr)
+            assigns.append(copy_all_loc(
+                    ast.Assign(targets=[target], value=value), expr))
+
+            return copy_all_loc(ast.Name(id=tmp_name, ctx=ast.Load()), expr)
+
+        new_stmnt = quickcopy(stmnt)
+        if is_qbit_create(new_stmnt):
+            # QRegister.factory only understands simple parameters
+            pass
+        elif isinstance(new_stmnt, ast.Assign):
+            new_stmnt.value = hoist(new_stmnt.value)
+        elif (isinstance(new_stmnt, ast.Expr) and
+                isinstance(new_stmnt.value, ast.Call) and
+                not hasattr(new_stmnt.value, 'qgl2_check_vector')):
+            call = new_stmnt.value
+            call.args = [hoist(arg) for arg in call.args]
+            for keyword in call.keywords:
+                keyword.value = hoist(keyword.value)
+        elif isinstance(new_stmnt, ast.For):
+            new_stmnt.iter = hoist(new_stmnt.iter, iterable=True)
+
+        if assigns:
+            return new_stmnt, assigns
+        else:
+            return stmnt, assigns
+
+    def is_invariant_assign(self, stmnt, assigned_cnt,
+            variant_names, mutated_names, referenced, fname=None):
+        """
+        Helper for split_loop_invariants: return True if stmnt is an
+        assignment that can be hoisted out of the loop
+        """
+
+        if not isinstance(stmnt, ast.Assign):
+            return False
+
+        if len(stmnt.targets) != 1:
+            return False
+
+        target = stmnt.targets[0]
+        if not isinstance(target, ast.Name):
+            return False
+        elif assigned_cnt[target.id] != 1:
+            return False
+        elif target.id in referenced or target.id in mutated_names:
+            return False
+
+        if is_qbit_create(stmnt):
+            # The QRegister is created from the values of its
+            # parameters (see QRegister.factory)
+            params = stmnt.value.args + [
+                    keyword.value for keyword in stmnt.value.keywords]
+            return not any(names_in_ptree(param) & variant_names
+                    for param in params)
+
+        return self.is_invariant_expr(stmnt.value, variant_names, fname)
+
     def do_for(self, stmnt):
         """
         Unroll a for loop.
@@ -1091,7 +1618,17 @@ class EvalTransformer(object):
 
         self.rewriter.rewrite(iter_copy)
 
-        success, loop_values = self.eval_state.eval_expr(iter_copy)
+        # If the iterable is a local name (such as the name of an
+        # iterable hoisted out of an enclosing loop), then its value
+        # is already known
+        #
+        local_variables = self.eval_state.locals_stack[-1]
+        if (isinstance(iter_copy, ast.Name) and
+                iter_copy.id in local_variables):
+            success = True
+            loop_values = local_variables[iter_copy.id]
+        else:
+            success, loop_values = self.eval_state.eval_expr(iter_copy)
         if not success:
             NodeError.error_msg(stmnt.iter,
                     ('could not evaluate iter expression [%s]' %
@@ -1102,7 +1639,8 @@ class EvalTransformer(object):
         # This can be a symptom of supply a list with value of None to iterate over,
         # EG failing to handle if measChans is None: measChans = qubits
         if loop_values is None:
-            DebugMsg.log("None loop values for %s" % ast2str(stmnt).strip())
+            DebugMsg.log(
+                    lambda: "None loop values for %s" % ast2str(stmnt).strip())
             NodeError.error_msg(stmnt.iter,
                                 ("Success evaluating but got None loop_values for %s" % ast2str(stmnt.iter).strip()))
             return False, None
@@ -1150,7 +1688,45 @@ class EvalTransformer(object):
         body_template = stmnt.body
         targets_template = targets
 
-        for loop_value in loop_values:
+        # If we're iterating over a numpy array with a simple loop
+        # variable, then add a copy of the array to the constant pool
+        # (in case the original is modified later) so that each
+        # iteration can refer to its element of the array by index.
+        # Iterate over the copy, so the values used at compile time
+        # are the same as the values referenced at runtime.
+        #
+        if (isinstance(loop_values, np.ndarray) and
+                isinstance(targets, ast.Name)):
+            pool_name = loop_iters_name
+            loop_values = loop_values.copy()
+            self.constant_pool[pool_name] = loop_values
+        else:
+            pool_name = None
+
+        # If any of the assignments in the body compute the same
+        # value on every iteration, then evaluate them once, before
+        # the first iteration, instead of once per iteration.
+        # This is only correct if there is at least one iteration,
+        # so make sure that loop_values can be checked for length
+        # (and isn't a one-shot iterator that we'd consume).
+        #
+        hoisted, remaining = self.split_loop_invariants(
+                body_template, loop_var_names, loop_values)
+        if hoisted:
+            if not isinstance(loop_values, collections.abc.Sized):
+                loop_values = list(loop_values)
+                self.preamble_values[-1] = loop_values
+
+            if len(loop_values) > 0:
+                DebugMsg.log('hoisting %d loop-invariant assignments' %
+                        len(hoisted))
+                self.change_cnt += len(hoisted)
+                iters_list.extend(self.do_body(quickcopy(hoisted)))
+                body_template = remaining
+
+        for index, loop_value in enumerate(loop_values):
+
+            count('for_iterations')
 
             new_body = quickcopy(body_template)
             new_targets = quickcopy(targets_template)
@@ -1161,6 +1737,9 @@ class EvalTransformer(object):
                 # print('EV Fl loop var %s -> %s' % (name, new_name))
                 self.rewriter.add_mapping(name, new_name)
 
+                if pool_name:
+                    self.pooled_values[new_name] = (pool_name, index)
+
             self.rewriter.rewrite(new_targets)
 
             # Fake the assignment, to update the current variable bindings
@@ -1169,8 +1748,11 @@ class EvalTransformer(object):
 
             # and now recurse, to expand this copy of the body
             #
+            start_charged = budget_charged()
             new_body = self.do_body(new_body)
             iters_list.extend(new_body)
+            charge_budget(stmnt, 'for', len(new_body), start_charged)
+            add_origin(new_body, stmnt, 'for')
 
             # if we've seen a "continue", then continue, but if we've
             # seen a "break", then we need to break out of this loop.
@@ -1228,7 +1810,11 @@ class EvalTransformer(object):
         # test must have been true the first time it was
         # evaluated.
         #
+        count('while_iterations')
+        start_charged = budget_charged()
         new_body = self.do_body(stmnt.body)
+        charge_budget(stmnt, 'while', len(new_body), start_charged)
+        add_origin(new_body, stmnt, 'while')
 
         while True:
             # Make a copy, so that the rewriter changes the
@@ -1243,7 +1829,13 @@ class EvalTransformer(object):
                         'test changed from classical to quantum?')
                 return False, list()
             elif test:
-                new_body += self.do_body(stmnt.body)
+                count('while_iterations')
+                start_charged = budget_charged()
+                iteration_body = self.do_body(stmnt.body)
+                new_body += iteration_body
+                charge_budget(stmnt, 'while', len(iteration_body),
+                        start_charged)
+                add_origin(iteration_body, stmnt, 'while')
             else:
                 break
 
@@ -1453,15 +2045,20 @@ class EvalTransformer(object):
             DebugMsg.log("local_variables has length: %d!" % len(local_variables), DebugMsg.HIGH)
         else:
             DebugMsg.log("local_variables has length: %d:" % len(local_variables), DebugMsg.MEDIUM)
-            for k in local_variables:
-                v = local_variables[k]
-                DebugMsg.log(f"local_var[{k}]={v}\n", DebugMsg.LOW)
+
+            # Formatting the values can be expensive (they may be
+            # large lists), so skip the loop unless it's needed
+            #
+            if DebugMsg.is_active(DebugMsg.LOW):
+                for k in local_variables:
+                    v = local_variables[k]
+                    DebugMsg.log(f"local_var[{k}]={v}\n", DebugMsg.LOW)
 
         for check in vec:
             (var_name, type_name, fp_name, func, src, row, col) = check
 
             mapped_name = self.rewriter.get_mapping(var_name)
-            DebugMsg.log(f"For var '{var_name}' found mapped '{mapped_name}' to look up in local_variables\n", DebugMsg.MEDIUM)
+            DebugMsg.log(lambda: f"For var '{var_name}' found mapped '{mapped_name}' to look up in local_variables\n", DebugMsg.MEDIUM)
             value = local_variables[mapped_name]
 
             # QGL2check actually does the check and prints
@@ -1601,6 +2198,17 @@ class EvalTransformer(object):
                 success, values = self.eval_state.do_assignment(stmnt)
                 if success:
                     self.change_cnt += 1
+
+                    # A copy of a pooled value refers to the same
+                    # element of the constant pool
+                    #
+                    target = stmnt.targets[0]
+                    if (isinstance(target, ast.Name) and
+                            isinstance(stmnt.value, ast.Name) and
+                            stmnt.value.id in self.pooled_values):
+                        self.pooled_values[target.id] = \
+                                self.pooled_values[stmnt.value.id]
+
                     # print('EV did assignment [%s]' % ast2str(stmnt))
                     self.preamble_stmnts.append(stmnt)
                     self.preamble_values.append(values)
@@ -1681,7 +2289,10 @@ class EvalTransformer(object):
                 # An old example of this is done in the loop unroller.
                 # The do_for function only tries to expand the elts.
 
-                success, new_stmnts = self.do_for(stmnt)
+                with trace_span('for', 'unroll', node=stmnt) as span:
+                    success, new_stmnts = self.do_for(stmnt)
+                    if success:
+                        span.set_arg('statements', len(new_stmnts))
                 if not success:
                     NodeError.error_msg(stmnt,
                             'failed to unroll [%s]' % ast2str(stmnt).strip())
@@ -1697,7 +2308,10 @@ class EvalTransformer(object):
                 new_body += if_body
 
             elif isinstance(stmnt, ast.While):
-                success, while_body = self.do_while(stmnt)
+                with trace_span('while', 'unroll', node=stmnt) as span:
+                    success, while_body = self.do_while(stmnt)
+                    if success:
+                        span.set_arg('statements', len(while_body))
                 if not success:
                     break
 
@@ -1748,7 +2362,7 @@ class EvalTransformer(object):
 
             elif isinstance(stmnt, ast.AugAssign):
                 DebugMsg.log(
-                        'unexpected AugAssign [%s]' % ast.dump(stmnt),
+                        lambda: 'unexpected AugAssign [%s]' % ast.dump(stmnt),
                         DebugMsg.HIGH)
                 NodeError.fatal_msg(stmnt, 'unhandled statement (op=)')
                 return new_body
@@ -0,0 +1,228 @@
+# Copyright 2016 by Raytheon BBN Technologies Corp.  All Rights Reserved.
+
+"""
+Explain mode: a map from the source lines of a program to the
+output they produce
+
+When a program compiles into a huge sequence, it's often not obvious
+which loop or helper is responsible.  If compile_function is given an
+ExpansionMap, then it records, for each line of the source (each
+qgl_fname and lineno):
+
+    statements: the number of statements in the QGL1 sequence
+        that the line produced, through inlining and unrolling
+    pulses: how many of those statements are pulses (rather than
+        control-flow instructions, such as labels and gotos)
+    seconds: the compile time spent unrolling the loop, or inlining
+        the call, on that line
+
+A statement of the sequence is counted for its own line, and for each
+call site and loop that it was produced through: for example, if a
+helper with two pulses is called from a loop with ten iterations,
+then each pulse line has ten statements, and the call and the loop
+each have twenty.  The times are inclusive (the time of a loop includes
+the time of the loops and calls inside it).
+
+To track where each statement came from, the inliner and the evaluator
+add the location of the call or loop to the qgl_origins attribute of
+each statement they create, but only while an ExpansionMap is active.
+
+From the command line, use --explain to print the lines that
+produced the most statements.
+"""
+
+import ast
+import time
+
+from pyqgl2.context import ContextState
+from pyqgl2.trace import TraceHook
+
+
+class LineExpansion(object):
+    """
+    The output produced by one line of the source
+
+    kinds is the set of the kinds of the constructs on that line
+    that produced output through inlining or unrolling ('call',
+    'for', or 'while'); it is empty for a line whose statements
+    were copied to the output directly.
+    """
+
+    def __init__(self, fname, lineno):
+        self.fname = fname
+        self.lineno = lineno
+        self.statements = 0
+        self.pulses = 0
+        self.seconds = 0.0
+        self.kinds = set()
+
+    def __repr__(self):
+        return '<LineExpansion %s>' % str(self.to_dict())
+
+    def to_dict(self):
+        return {
+                'fname': self.fname,
+                'lineno': self.lineno,
+                'statements': self.statements,
+                'pulses': self.pulses,
+                'seconds': self.seconds,
+                'kinds': sorted(self.kinds)
+            }
+
+
+class ExpansionMap(TraceHook):
+    """
+    The map from (fname, lineno) to the LineExpansion for that line
+
+    An ExpansionMap is also a TraceHook, which records the time of
+    each span for a loop or a call (see pyqgl2.trace); compile_function
+    adds it to the trace hooks of the compilation.
+    """
+
+    def __init__(self):
+        self.lines = dict()
+
+        # The start times of the spans that have not ended yet
+        # (and the depth of each, for recursive inlining)
+        self.starts = dict()
+
+    def line(self, fname, lineno):
+        key = (fname, lineno)
+        record = self.lines.get(key)
+        if record is None:
+            record = LineExpansion(fname, lineno)
+            self.lines[key] = record
+        return record
+
+    def add_output(self, stmnt, statements, pulses):
+        """
+        Add the given number of output statements and pulses,
+        created from the given statement of the final program,
+        to the line of the statement and to each of its origins
+        """
+
+        # Each line is only counted once, even if the statement
+        # came from more than one construct on that line
+        #
+        kinds = {(getattr(stmnt, 'qgl_fname', '<unknown>'),
+                getattr(stmnt, 'lineno', 0)): set()}
+        for (fname, lineno, kind) in getattr(stmnt, 'qgl_origins', ()):
+            kinds.setdefault((fname, lineno), set()).add(kind)
+
+        for key, line_kinds in kinds.items():
+            record = self.line(*key)
+            record.statements += statements
+            record.pulses += pulses
+            record.kinds.update(line_kinds)
+
+    def before(self, span):
+        if 'line' not in span.args or span.category == 'pass':
+            return
+
+        key = (span.args['file'], span.args['line'])
+        if key in self.starts:
+            self.starts[key][1] += 1
+        else:
+            self.starts[key] = [time.perf_counter(), 1]
+
+    def after(self, span):
+        if 'line' not in span.args or span.category == 'pass':
+            return
+
+        key = (span.args['file'], span.args['line'])
+        start = self.starts[key]
+        start[1] -= 1
+        if start[1] == 0:
+            del self.starts[key]
+            self.line(*key).seconds += time.perf_counter() - start[0]
+
+    def ranked(self, field='statements', limit=None):
+        """
+        Return the LineExpansions, sorted by the given field
+        (largest first), and then by location
+        """
+
+        records = sorted(self.lines.values(),
+                key=lambda record: (-getattr(record, field),
+                    record.fname, record.lineno))
+        if limit:
+            records = records[:limit]
+        return records
+
+    def to_dict(self):
+        return {
+                'lines': [record.to_dict() for record in self.ranked()]
+            }
+
+    def format_table(self, field='statements', limit=20):
+        """
+        Return a human-readable table of the lines that
+        produced the most output (by the given field)
+        """
+
+        lines = ['%10s %10s %9s  %-10s %s' %
+                ('statements', 'pulses', 'time(s)', 'kind', 'location')]
+
+        for record in self.ranked(field, limit):
+            lines.append('%10d %10d %9.3f  %-10s %s:%d' %
+                    (record.statements, record.pulses, record.seconds,
+                        ','.join(sorted(record.kinds)) or '-',
+                        record.fname, record.lineno))
+
+        others = len(self.lines) - limit
+        if limit and others > 0:
+            lines.append('(%d other lines)' % others)
+
+        return '\n'.join(lines)
+
+
+class ExplainState(object, metaclass=ContextState):
+    """
+    The ExpansionMap (if any) of the active CompileContext
+    """
+
+    EXPLAIN = None
+
+    CONTEXT_ATTRS = ('EXPLAIN',)
+
+
+def add_origin(stmnts, site, kind):
+    """
+    Record that the given statements (and the statements nested
+    within them) were created by inlining or unrolling the call or
+    loop at the given site (a statement), along with all of the
+    origins of the site itself.  kind is 'call', 'for', or 'while'.
+
+    Does nothing unless there is an ExpansionMap in the active
+    CompileContext.
+    """
+
+    if ExplainState.EXPLAIN is None:
+        return
+
+    new_origins = ((getattr(site, 'qgl_fname', '<unknown>'),
+            getattr(site, 'lineno', 0), kind),)
+    new_origins += getattr(site, 'qgl_origins', ())
+
+    for stmnt in stmnts:
+        for node in ast.walk(stmnt):
+            if not isinstance(node, ast.stmt):
+                continue
+
+            origins = getattr(node, 'qgl_origins', ())
+            added = tuple(origin for origin in new_origins
+                    if origin not in origins)
+            if added:
+                node.qgl_origins = origins + added
+
+
+def explain_output(stmnt, statements, pulses):
+    """
+    Add the output created from the given statement of the
+    final program to the ExpansionMap (if any) of the active
+    CompileContext
+    """
+
+    explain = ExplainState.EXPLAIN
+    if explain is not None:
+        explain.add_output(stmnt, statements, pulses)
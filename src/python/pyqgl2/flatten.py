@@ -10,6 +10,7 @@ by events.
 """
 
 import ast
+import threading
 
 from copy import deepcopy
 
@@ -34,17 +35,25 @@ class LabelManager(object):
 
     NEXT_LABEL_NUM = 0
 
+    # Unlike most of the compiler state, the label index is NOT
+    # kept in the CompileContext: labels are unique across all the
+    # programs compiled in the same process, even if they are
+    # compiled concurrently
+    #
+    LOCK = threading.Lock()
+
     @staticmethod
     def allocate_ind():
         """
         Allocate and return the next label index
 
-        Since the preprocessor is single-threaded, there is
-        no need to guard against concurrent allocations
+        Several threads may run the preprocessor at the same time,
+        so the allocation is guarded by LabelManager.LOCK
         """
 
-        ind = LabelManager.NEXT_LABEL_NUM
-        LabelManager.NEXT_LABEL_NUM += 1
+        with LabelManager.LOCK:
+            ind = LabelManager.NEXT_LABEL_NUM
+            LabelManager.NEXT_LABEL_NUM += 1
 
         return ind
 
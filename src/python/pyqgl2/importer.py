@@ -29,9 +29,11 @@ within functions, or nested functions of any kind.
 import ast
 import inspect
 import os
+import pickle
 import sys
 
 from pyqgl2.ast_util import NodeError
+from pyqgl2.counters import count
 from pyqgl2.lang import QGL2
 
 import pyqgl2
@@ -217,6 +219,154 @@ def add_import_from_as(importer, namespace_name, module_name,
         return False
 
 
+class ModuleCache(object):
+    """
+    Cache of the modules read by the importer, for a process that
+    compiles many programs (such as a compile_many worker, or the
+    compile daemon)
+
+    For each source file, the cache keeps the parsed and labeled AST
+    (see parse_module) and the native_globals created by executing
+    the file, keyed by the path and the modification time and size
+    of the file, so a file that changes is read again.
+
+    The compiler modifies the ASTs it is given, so the AST is kept
+    pickled, and each lookup returns a new copy.  The native_globals
+    are shared, the way that modules imported by Python are: each
+    lookup returns a new dict, but the code of the module is not run
+    again.
+
+    The importer only uses the cache if it is enabled (see
+    enable_module_cache).
+    """
+
+    def __init__(self):
+        self.modules = dict()
+        self.globals = dict()
+
+    @staticmethod
+    def file_stamp(path):
+        """
+        Return the (mtime, size) of the file at the given path,
+        or None if there is no such file
+        """
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def get_module(self, path, stamp):
+        """
+        Return a copy of the (ptree, conditional_imports) for the
+        file at the given path, or None if it is not in the cache
+        or the file has changed
+        """
+
+        # The nodes are labeled with the path as given,
+        # which depends on the working directory
+        #
+        entry = self.modules.get((os.path.abspath(path), path))
+        if stamp is None or entry is None or entry[0] != stamp:
+            count('module_cache_misses')
+            return None
+
+        count('module_cache_hits')
+        return pickle.loads(entry[1])
+
+    def put_module(self, path, stamp, parsed):
+        if stamp is not None:
+            self.modules[(os.path.abspath(path), path)] = (
+                    stamp, pickle.dumps(parsed))
+
+    def get_globals(self, path, stamp):
+        """
+        Return a new dict of the native_globals for the file at
+        the given path, or None if they are not in the cache or
+        the file has changed
+        """
+
+        entry = self.globals.get(os.path.abspath(path))
+        if stamp is None or entry is None or entry[0] != stamp:
+            return None
+
+        return dict(entry[1])
+
+    def put_globals(self, path, stamp, native_globals):
+        if stamp is not None:
+            self.globals[os.path.abspath(path)] = (
+                    stamp, dict(native_globals))
+
+
+# The ModuleCache used by the importer, or None if the
+# module cache is not enabled
+#
+MODULE_CACHE = None
+
+def enable_module_cache():
+    """
+    Enable the module cache (if it is not already enabled)
+    for the rest of the life of this process, and return it
+    """
+
+    global MODULE_CACHE
+
+    if MODULE_CACHE is None:
+        MODULE_CACHE = ModuleCache()
+
+    return MODULE_CACHE
+
+def disable_module_cache():
+    """
+    Disable (and discard) the module cache
+    """
+
+    global MODULE_CACHE
+
+    MODULE_CACHE = None
+
+
+def parse_module(text, path, module_name):
+    """
+    Parse the text of the module at the given path, and label each
+    node with the path and the module name.
+
+    Returns the AST and a list of the import statements in it that
+    are not at the top level of the module (which the importer
+    ignores, with a warning)
+    """
+
+    ptree = ast.parse(text, mode='exec')
+
+    # label each node with the name of the input file;
+    # this will make error messages that reference these
+    # notes much more readable
+    #
+    for node in ast.walk(ptree):
+        node.qgl_fname = path
+        node.qgl_modname = module_name
+
+    # The preprocessor will ignore any imports that are not
+    # at the "top level" (imports that happen conditionally,
+    # or when a function is executed for the first time, etc)
+    # because it can't figure out if/when these imports would
+    # occur, and it only understands imports that occur before
+    # the execution of any other statements of the program.
+    #
+    # TODO: we don't make any attempt to find calls to
+    # __import__() or importlib.import_module().  The
+    # preprocessor always ignores these, without warning.
+    #
+    conditional_imports = [node for node in ast.walk(ptree)
+            if ((isinstance(node, ast.Import) or
+                isinstance(node, ast.ImportFrom)) and
+                (node.col_offset != 0))]
+
+    return ptree, conditional_imports
+
+
 class NameSpace(object):
     """
     Manage the namespace for a single file
@@ -302,6 +452,14 @@ class NameSpace(object):
         will be properly initialized
         """
 
+        cache = MODULE_CACHE
+        if cache:
+            stamp = cache.file_stamp(self.path)
+            native_globals = cache.get_globals(self.path, stamp)
+            if native_globals is not None:
+                self.native_globals = native_globals
+                return True
+
         try:
             fin = open(self.path, 'r')
             text = fin.read()
@@ -313,6 +471,8 @@ class NameSpace(object):
 
         try:
             exec(text, self.native_globals)
+            if cache:
+                cache.put_globals(self.path, stamp, self.native_globals)
             return True
         except BaseException as exc:
             NodeError.error_msg(None,
@@ -525,6 +685,8 @@ class NameSpace(object):
         this right now.
         """
 
+        count('native_eval_calls')
+
         if (not isinstance(expr, str)) and (not isinstance(expr, ast.AST)):
             print('INVALID EXPR type %s' % str(type(expr)))
             return False, None
@@ -661,6 +823,8 @@ class NameSpaces(object):
         the namespace denoted by the given path
         """
 
+        count('resolve_sym_calls')
+
         # keep a copy of the starting name and context,
         # before we start to chase it through other modules,
         # so we can print meaningful diagnostics
@@ -760,6 +924,17 @@ class NameSpaces(object):
         if path in self.path2ast:
             return self.path2ast[path]
 
+        # If the module cache is enabled, and this file hasn't
+        # changed since it was cached, then use the cached AST
+        #
+        cache = MODULE_CACHE
+        if cache:
+            stamp = cache.file_stamp(path)
+            parsed = cache.get_module(path, stamp)
+            if parsed:
+                ptree, conditional_imports = parsed
+                return self.add_module(ptree, conditional_imports, path)
+
         # TODO: this doesn't do anything graceful if the file
         # can't be opened, or doesn't exist, or anything else goes
         # wrong.  We just assume that Python will raise an exception
@@ -778,7 +953,13 @@ class NameSpaces(object):
             return None
 
         try:
-            return self.read_import_str(text, path)
+            ptree, conditional_imports = parse_module(text, path, '__main__')
+
+            # cache the AST before add_module changes it
+            if cache:
+                cache.put_module(path, stamp, (ptree, conditional_imports))
+
+            return self.add_module(ptree, conditional_imports, path)
         except BaseException as exc:
             NodeError.fatal_msg(None,
                     'failed to import [%s]: %s %s' % (path, type(exc), exc))
@@ -787,39 +968,24 @@ class NameSpaces(object):
 
     def read_import_str(self, text, path='<stdin>', module_name='__main__'):
 
-        ptree = ast.parse(text, mode='exec')
+        ptree, conditional_imports = parse_module(text, path, module_name)
+        return self.add_module(ptree, conditional_imports, path)
+
+    def add_module(self, ptree, conditional_imports, path):
+        """
+        Add the module at the given path, with the given AST
+        (see parse_module), and recursively read its imports
+        """
 
         self.path2ast[path] = ptree
 
-        # label each node with the name of the input file;
-        # this will make error messages that reference these
-        # notes much more readable
-        #
-        for node in ast.walk(ptree):
-            node.qgl_fname = path
-            node.qgl_modname = module_name
-
-        # The preprocessor will ignore any imports that are not
-        # at the "top level" (imports that happen conditionally,
-        # or when a function is executed for the first time, etc)
-        # because it can't figure out if/when these imports would
-        # occur, and it only understands imports that occur before
-        # the execution of any other statements of the program.
-        #
-        # Therefore warn the programmer that any such detected
+        # Warn the programmer that any conditional
         # imports will be ignored.
         #
-        # TODO: we don't make any attempt to find calls to
-        # __import__() or importlib.import_module().  The
-        # preprocessor always ignores these, without warning.
-        #
-        for node in ast.walk(ptree):
-            if ((isinstance(node, ast.Import) or
-                    isinstance(node, ast.ImportFrom)) and
-                    (node.col_offset != 0)):
-                NodeError.warning_msg(node,
-                        ('conditional/runtime import [%s] ignored by pyqgl2' %
-                            pyqgl2.ast_util.ast2str(node).strip()))
+        for node in conditional_imports:
+            NodeError.warning_msg(node,
+                    ('conditional/runtime import [%s] ignored by pyqgl2' %
+                        pyqgl2.ast_util.ast2str(node).strip()))
 
         # Populate the namespace
         #
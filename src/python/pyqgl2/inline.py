@@ -2,21 +2,32 @@
 
 import ast
 import meta
+import multiprocessing
 import numpy as np
+import pickle
 
-from pyqgl2.ast_util import NodeError, expr2ast
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from pyqgl2.ast_util import NodeError, QGL2CompileError, expr2ast
+from pyqgl2.budget import CompileBudget, budget_charged, charge_budget
+from pyqgl2.budget import check_budget
+from pyqgl2.context import ContextState
+from pyqgl2.counters import add_counts, count, counts_since, get_counts
+from pyqgl2.explain import ExplainState, add_origin
 from pyqgl2.importer import NameSpaces
 from pyqgl2.importer import collapse_name
 from pyqgl2.lang import QGL2
 from pyqgl2.quickcopy import quickcopy
 from pyqgl2.qreg import QRegister, QReference
+from pyqgl2.trace import trace_span
 
 import pyqgl2.ast_util
 import pyqgl2.scope
 
 from pyqgl2.ast_util import ast2str
 
-class TempVarManager(object):
+class TempVarManager(object, metaclass=ContextState):
     """
     Manages the state needed to create variable names
     that are (with high probability) unique across
@@ -30,10 +41,13 @@ class TempVarManager(object):
 
     # There may be more than one TempVarManager, with different
     # rules for constructing names.  This is the map from
-    # base names to instances of TempVarManager
+    # base names to instances of TempVarManager.
+    # This is kept separately for each CompileContext.
 
     NAME2REF = dict()
 
+    CONTEXT_ATTRS = ('NAME2REF',)
+
     def __init__(self):
 
         # These are intentionally bogus values, to make
@@ -918,17 +932,43 @@ class NameRedirector(ast.NodeTransformer):
     See find_names() for more info
     """
 
-    def __init__(self, values=None, table_name='_T'):
+    def __init__(self, values=None, table_name='_T', pooled=None):
 
         self.table_name = table_name
         self.values = values
 
+        # pooled maps names to (pool_name, index) pairs, for names
+        # whose values are elements of an array in the constant pool.
+        # The array is stored (once) in the values table as pool_name,
+        # and each of these names is replaced with a reference to
+        # its element of the array
+        #
+        if not pooled:
+            pooled = dict()
+        self.pooled = pooled
+
+    def table_ref(self, name):
+        """
+        Create a reference to the given name in the values table
+        """
+
+        return ast.Subscript(
+                value=ast.Name(id=self.table_name, ctx=ast.Load()),
+                slice=ast.Index(value=ast.Str(s=name)))
+
     def visit_Attribute(self, node):
         return node
 
     def visit_Name(self, node):
 
         name = node.id
+
+        if name in self.pooled:
+            pool_name, index = self.pooled[name]
+            return ast.Subscript(
+                    value=self.table_ref(pool_name),
+                    slice=ast.Index(value=ast.Num(n=index)))
+
         # if the name doesn't have an entry in the values
         # table, then we can't transform it
         #
@@ -952,14 +992,21 @@ class NameRedirector(ast.NodeTransformer):
 
         value = self.values[name]
 
-        numpy_scalar_types = (
-            np.int8, np.int16, np.int32, np.int64,
-            np.uint8, np.uint16, np.uint32, np.uint64,
-            np.float16, np.float32, np.float64,
-            np.complex64, np.complex128
-        )
-        if (isinstance(value, int) or isinstance(value, float) or
-                isinstance(value, numpy_scalar_types)):
+        # numpy values are checked first, because some numpy
+        # scalar types are also subclasses of int or float.
+        #
+        # Integers and doubles can be converted to native Python
+        # values without any loss of precision, but for the other
+        # numpy types we would lose precision or the type (or get
+        # an unparsable repr), so we reference them through the table
+        # instead.  Arrays are always referenced through the table,
+        # rather than converting each of their elements.
+        #
+        if isinstance(value, (np.integer, np.float64, np.complex128)):
+            redirection = ast.Num(n=value.item())
+        elif isinstance(value, (np.generic, np.ndarray)):
+            redirection = self.table_ref(name)
+        elif isinstance(value, int) or isinstance(value, float):
             redirection = ast.Num(n=value)
         elif isinstance(value, str):
             redirection = ast.Str(s=value)
@@ -991,9 +1038,7 @@ class NameRedirector(ast.NodeTransformer):
             except Exception as e:
                 NodeError.warning_msg(node,
                     "Could not represent the value [%s] of [%s] (iterable) as an AST node: %s" % (value, name, e))
-                redirection = ast.Subscript(
-                        value=ast.Name(id=self.table_name, ctx=ast.Load()),
-                        slice=ast.Index(value=ast.Str(s=name)))
+                redirection = self.table_ref(name)
         else:
             # value is not an int, float, str, QRegister, QReference or iterable
             # EG, could be a function reference
@@ -1001,9 +1046,7 @@ class NameRedirector(ast.NodeTransformer):
             # or whatever, create a reference to 'tanh' and hope no-one redefines 'tanh'.
             NodeError.warning_msg(node,
                 "Could not represent the value [%s] (an %s) of [%s] as an AST node." % (value, type(value), name))
-            redirection = ast.Subscript(
-                    value=ast.Name(id=self.table_name, ctx=ast.Load()),
-                    slice=ast.Index(value=ast.Str(s=name)))
+            redirection = self.table_ref(name)
 
         return redirection
 
@@ -1275,7 +1318,10 @@ class Inliner(ast.NodeTransformer):
                     'expected ast.FunctionDef got [%s]' % str(type(funcdef)))
 
         if not is_qgl2_def(funcdef):
-            # unexpected: all FunctionDef nodes should be marked
+            # unexpected: all FunctionDef nodes should be marked.
+            # Remember that there's nothing to inline, so that
+            # inline_call doesn't try again for every call.
+            funcdef.qgl_inlined = funcdef
             return funcdef
 
         namespace = self.importer.path2namespace[funcdef.qgl_fname]
@@ -1315,9 +1361,7 @@ class Inliner(ast.NodeTransformer):
         new_name = temp_manager.create_tmp_name(new_ptree.name)
         new_ptree.name = new_name
 
-        self.importer.add_function(namespace, new_name, new_ptree)
-
-        funcdef.qgl_inlined = new_ptree
+        add_inlined_function(self.importer, funcdef, new_ptree)
 
         return new_ptree
 
@@ -1567,6 +1611,7 @@ class Inliner(ast.NodeTransformer):
                 call_ptree = chk_call.value
                 stmnt.value = call_ptree
 
+            start_charged = budget_charged()
             inlined = inline_call(call_ptree, self.importer)
             if isinstance(inlined, ast.Call):
                 stmnt.value = inlined
@@ -1574,17 +1619,21 @@ class Inliner(ast.NodeTransformer):
             elif isinstance(inlined, list):
                 new_body += inlined
                 self.change_cnt += 1
+                charge_budget(call_ptree, 'call', len(inlined), start_charged)
+                add_origin(inlined, stmnt, 'call')
 
+            # These messages are usually muted, so don't create
+            # their text (which needs ast2str) unless it's needed
+            #
+            call_text = lambda: ast2str(call_ptree).strip()
             if inlined != call_ptree:
                 NodeError.diag_msg(
                         call_ptree,
-                        ('inlined call to %s' %
-                            ast2str(call_ptree).strip()))
+                        lambda: 'inlined call to %s' % call_text())
             else:
                 NodeError.diag_msg(
                         call_ptree,
-                        ('did not inline call to %s' %
-                            ast2str(call_ptree).strip()))
+                        lambda: 'did not inline call to %s' % call_text())
 
         return new_body
 
@@ -1992,7 +2041,9 @@ def inline_call(base_call, importer):
             new_func = func_ptree
         elif not hasattr(func_ptree, 'qgl_inlined'):
             inliner = Inliner(importer)
-            new_func = inliner.inline_function(func_ptree)
+            with trace_span('inline_function %s' % func_name, 'inline',
+                    node=func_ptree):
+                new_func = inliner.inline_function(func_ptree)
         else:
             new_func = func_ptree.qgl_inlined
 
@@ -2039,15 +2090,326 @@ def inline_call(base_call, importer):
                     global_names=namespace.native_globals):
                 return None
 
-        inlined = create_inline_procedure(func_ptree, base_call)
+        with trace_span('inline %s' % func_name, 'inline', node=base_call):
+            inlined = create_inline_procedure(func_ptree, base_call)
         if not inlined:
             NodeError.diag_msg(base_call,
                     'inlining of %s() failed' % func_name)
             return base_call
 
+        count('inline_expansions')
         return inlined
 
 
+def called_functions(body, importer):
+    """
+    Return the definitions of the functions called by the given
+    list of statements, in the order they are first called, that
+    the Inliner would try to inline (or to optimize): calls that
+    are statements by themselves, in the body of the function or
+    in the bodies of its loops, conditionals, etc.
+    """
+
+    callees = list()
+
+    for stmnt in body:
+        if (isinstance(stmnt, ast.Expr) and
+                isinstance(stmnt.value, ast.Call) and
+                isinstance(stmnt.value.func, ast.Name) and
+                hasattr(stmnt.value, 'qgl_fname')):
+            func_ptree = importer.resolve_sym(
+                    stmnt.value.qgl_fname, stmnt.value.func.id)
+            if (isinstance(func_ptree, ast.FunctionDef) and
+                    func_ptree not in callees):
+                callees.append(func_ptree)
+
+        for field in ('body', 'orelse', 'finalbody'):
+            sub_body = getattr(stmnt, field, None)
+            if isinstance(sub_body, list):
+                for func_ptree in called_functions(sub_body, importer):
+                    if func_ptree not in callees:
+                        callees.append(func_ptree)
+
+    return callees
+
+def callee_levels(funcdef, importer):
+    """
+    Build the call graph of the functions called (directly or
+    indirectly) by the given function definition, and return
+    the functions (not including funcdef itself) grouped into
+    levels: the first level is the functions that don't call
+    any other functions, and each function in each of the
+    following levels only calls functions in earlier levels.
+
+    The functions in the same level are independent of each
+    other, and may be processed in any order once the earlier
+    levels have been processed.  Recursive calls are ignored.
+    """
+
+    heights = dict()
+    order = list()
+
+    def visit(func_ptree, active):
+        key = id(func_ptree)
+        if key in heights:
+            return heights[key]
+
+        active.add(key)
+        height = 0
+        for callee in called_functions(func_ptree.body, importer):
+            if id(callee) not in active:
+                height = max(height, visit(callee, active) + 1)
+        active.remove(key)
+
+        heights[key] = height
+        order.append(func_ptree)
+        return height
+
+    visit(funcdef, set())
+
+    levels = list()
+    for func_ptree in order:
+        if func_ptree is funcdef:
+            continue
+
+        height = heights[id(func_ptree)]
+        while len(levels) <= height:
+            levels.append(list())
+        levels[height].append(func_ptree)
+
+    return [level for level in levels if level]
+
+def add_inlined_function(importer, funcdef, new_ptree):
+    """
+    Add new_ptree, the inlined version of funcdef (with a new
+    name), to the namespace of funcdef, and cache it as the
+    qgl_inlined attribute of funcdef
+    """
+
+    namespace = importer.path2namespace[funcdef.qgl_fname]
+    importer.add_function(namespace, new_ptree.name, new_ptree)
+
+    funcdef.qgl_inlined = new_ptree
+
+    # The new function is already inlined, so calls to it
+    # (which replace the calls to the original) don't need
+    # to be inlined again
+    #
+    new_ptree.qgl_inlined = new_ptree
+
+
+class InlineSettings(object, metaclass=ContextState):
+    """
+    The settings of inline_callees
+
+    If WORKERS is more than 1, then each level of the call graph
+    that has at least MIN_PARALLEL_FUNCTIONS functions to inline,
+    with at least MIN_PARALLEL_STATEMENTS statements between them,
+    is inlined by a pool of (up to) WORKERS processes.  (Starting
+    the pool takes tens of milliseconds, so it's not worth it for
+    small functions.)
+    """
+
+    WORKERS = 0
+    MIN_PARALLEL_FUNCTIONS = 2
+    MIN_PARALLEL_STATEMENTS = 200
+
+    # These are user settings, like the debugging level
+    CONTEXT_ATTRS = ('WORKERS', 'MIN_PARALLEL_FUNCTIONS',
+            'MIN_PARALLEL_STATEMENTS')
+    CONTEXT_INHERIT = CONTEXT_ATTRS
+
+
+def inline_callees(funcdef, importer):
+    """
+    Inline the functions that funcdef calls, but which can't be
+    inlined into it (because they are not QGL2 procedures), from
+    the leaves of the call graph towards funcdef, so that each
+    of them is only inlined once, and each one is inlined after
+    the functions that it calls.  The inlined version of each
+    function is cached as its qgl_inlined attribute, and is used
+    by inline_call whenever the function is called.
+
+    The functions in each level of the call graph are independent,
+    so if InlineSettings.WORKERS is more than 1, they are inlined
+    concurrently (see inline_level).  The result is the same
+    either way.
+
+    Returns the number of functions inlined.
+    """
+
+    count = 0
+
+    workers = InlineSettings.WORKERS
+    parallel = (workers > 1 and ExplainState.EXPLAIN is None and
+            can_fork_workers())
+
+    for level in callee_levels(funcdef, importer):
+        pending = [func_ptree for func_ptree in level
+                if not (hasattr(func_ptree, 'qgl_inlined') or
+                    is_qgl_procedure(func_ptree) or
+                    getattr(func_ptree, 'qgl_stub', False))]
+
+        if (parallel and
+                len(pending) >= InlineSettings.MIN_PARALLEL_FUNCTIONS and
+                sum(count_statements(func_ptree) for func_ptree in pending) >=
+                    InlineSettings.MIN_PARALLEL_STATEMENTS):
+            with trace_span('inline_level', 'inline',
+                    functions=len(pending)):
+                inline_level(pending, importer, workers)
+        else:
+            for func_ptree in pending:
+                with trace_span('inline_function %s' % func_ptree.name,
+                        'inline', node=func_ptree):
+                    Inliner(importer).inline_function(func_ptree)
+
+        count += len(pending)
+
+    return count
+
+
+def count_statements(ptree):
+    """
+    Return the number of statements in the given AST
+    """
+
+    return sum(1 for node in ast.walk(ptree) if isinstance(node, ast.stmt))
+
+
+def can_fork_workers():
+    """
+    Return True if this process can fork worker processes
+    (which inherit its state) for inline_level
+    """
+
+    # The workers of a compile_many pool are daemons,
+    # which may not have children
+    #
+    return (multiprocessing.get_start_method() == 'fork' and
+            not multiprocessing.current_process().daemon)
+
+
+# The functions (and the importer) given to inline_level.
+# These can't be sent to a worker (the importer can't be pickled),
+# so the workers are forked, and inherit them instead.
+#
+INLINE_LEVEL_STATE = None
+
+# Each worker of inline_level starts its temporary names at a
+# different multiple of this stride, so the names that they
+# create are distinct (and don't depend on the scheduling of
+# the workers)
+#
+TEMP_NAME_STRIDE = 100000
+
+def inline_level(level, importer, workers):
+    """
+    Inline each of the functions in the given level of the call
+    graph (which must be independent of each other, and must
+    only call functions that have already been inlined) in a pool
+    of forked worker processes, and then add the results to the
+    namespaces, in order.
+
+    Each worker returns the messages, the hot-path counts, and
+    the statements charged to the budget while inlining its
+    function, which are added to the active CompileContext here.
+    A function whose inlined version can't be returned from its
+    worker is inlined here instead.
+    """
+
+    global INLINE_LEVEL_STATE
+
+    INLINE_LEVEL_STATE = (level, importer)
+    try:
+        with ProcessPoolExecutor(
+                max_workers=min(workers, len(level))) as executor:
+            results = list(executor.map(
+                    inline_level_worker, range(len(level))))
+    finally:
+        INLINE_LEVEL_STATE = None
+
+    temp_manager = TempVarManager.create_temp_var_manager()
+    usage = CompileBudget.USAGE
+
+    for func_ptree, result in zip(level, results):
+        data, messages, counts, statements, blame, temp_index = result
+
+        for msg_level, text in messages:
+            NodeError._emit_msg(msg_level, text)
+        add_counts(counts)
+        temp_manager.index = max(temp_manager.index, temp_index)
+
+        if usage is not None:
+            usage.statements += statements
+            usage.blame.update(blame)
+            check_budget(func_ptree)
+
+        if NodeError.MAX_ERR_LEVEL == NodeError.NODE_ERROR_FATAL:
+            raise QGL2CompileError(
+                    NodeError.last_msgs(), NodeError.MAX_ERR_LEVEL)
+
+        func_ptree.qgl2_scope_checked = True
+
+        if data is None:
+            # the worker didn't change the function
+            func_ptree.qgl_inlined = func_ptree
+        elif data is False:
+            Inliner(importer).inline_function(func_ptree)
+        else:
+            add_inlined_function(importer, func_ptree, pickle.loads(data))
+
+
+def inline_level_worker(index):
+    """
+    Worker for inline_level: inline the function with the given
+    index in the level, and return a tuple of:
+
+        the pickled inlined function (or None if the function
+            was not changed, or False if it could not be pickled)
+        the (level, text) of each message that would have been
+            printed
+        the hot-path counts
+        the statements charged to the budget, and their blame
+        the index of the last temporary name created
+    """
+
+    level, importer = INLINE_LEVEL_STATE
+    func_ptree = level[index]
+
+    temp_manager = TempVarManager.create_temp_var_manager()
+    temp_manager.index += (index + 1) * TEMP_NAME_STRIDE
+
+    NodeError.CAPTURED_MSGS = list()
+    start_counts = get_counts()
+
+    usage = CompileBudget.USAGE
+    if usage is not None:
+        start_statements = usage.statements
+        start_blame = Counter(usage.blame)
+
+    data = None
+    try:
+        new_ptree = Inliner(importer).inline_function(func_ptree)
+        if new_ptree is not func_ptree:
+            data = pickle.dumps(new_ptree)
+    except QGL2CompileError:
+        # The messages (including the fatal error)
+        # are sent back to the parent
+        pass
+    except pickle.PicklingError:
+        data = False
+
+    if usage is not None:
+        statements = usage.statements - start_statements
+        blame = usage.blame - start_blame
+    else:
+        statements = 0
+        blame = Counter()
+
+    return (data, NodeError.CAPTURED_MSGS, counts_since(start_counts),
+            statements, blame, temp_manager.index)
+
+
 class TestInliner(object):
 
     def init_code(self, text):
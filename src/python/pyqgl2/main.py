@@ -12,11 +12,21 @@ during prototyping/debugging.  The real driver is in scripts/qgl2prep
 """
 
 import ast
+import asyncio
+import contextlib
+import functools
+import io
 import os
+import random
 import re
 import sys
+import threading
+import time
+
+import numpy as np
 
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
 from pyqgl2.quickcopy import quickcopy
 from datetime import datetime
 
@@ -37,13 +47,24 @@ sys.path.append(os.path.normpath(os.path.join(DIRNAME, '..')))
 
 import pyqgl2.ast_util
 
-from pyqgl2.ast_util import NodeError
+from pyqgl2.ast_util import NodeError, QGL2CompileError
+from pyqgl2.context import CompileContext, activates_context
+from pyqgl2.budget import check_budget, set_budget, start_budget
+from pyqgl2.counters import counts_since, get_counts
 from pyqgl2.debugmsg import DebugMsg
 from pyqgl2.eval import EvalTransformer, SimpleEvaluator
+from pyqgl2.explain import ExpansionMap, ExplainState
 from pyqgl2.flatten import Flattener
-from pyqgl2.importer import NameSpaces, add_import_from_as
-from pyqgl2.inline import Inliner
-from pyqgl2.sequences import SequenceExtractor, get_sequence_function
+from pyqgl2.importer import ModuleCache, NameSpaces, add_import_from_as
+from pyqgl2.inline import InlineSettings, Inliner, can_fork_workers
+from pyqgl2.inline import inline_callees
+from pyqgl2.profiling import PROFILE_FORMATS, CompileProfiler
+from pyqgl2.progress import CompileCancelled, report_progress
+from pyqgl2.progress import add_progress_listener, remove_progress_listener
+from pyqgl2.sequences import SequenceExtractor, get_generator_function
+from pyqgl2.sequences import get_sequence_function
+from pyqgl2.stats import CompileStats, StatsState, stats_stage
+from pyqgl2.trace import ChromeTrace, TraceHooks, add_trace_hook, trace_span
 
 
 def parse_args(argv):
@@ -74,6 +95,28 @@ def parse_args(argv):
             help=('Specify the debugging level (0=all, 4=none)' +
                     '[default=%(default)d)]'))
 
+    parser.add_argument('-j', '--jobs',
+            dest='workers', type=int, metavar='N',
+            default=0,
+            help=('Use N worker processes to inline independent ' +
+                    'functions, to generate the QGL1 code ' +
+                    'for long programs, and to schedule the ' +
+                    'sequence for -hw [default=%(default)d]'))
+
+    parser.add_argument('--max-memory',
+            dest='max_memory', type=int, metavar='MB', default=None,
+            help=('Halt if the compiler uses more than MB megabytes ' +
+                    'of additional memory'))
+
+    parser.add_argument('--max-seconds',
+            dest='max_seconds', type=float, metavar='SECONDS', default=None,
+            help='Halt if the compilation takes more than SECONDS seconds')
+
+    parser.add_argument('--max-statements',
+            dest='max_statements', type=int, metavar='N', default=None,
+            help=('Halt if unrolling loops and inlining calls ' +
+                    'creates more than N statements'))
+
     parser.add_argument('-m',
             dest='main_name', type=str, metavar='FUNCNAME',
             default='',
@@ -94,6 +137,21 @@ def parse_args(argv):
             default="",
             help="Compiled filename suffix")
 
+    parser.add_argument('--profile',
+            dest='profile', default=None, metavar='FILE',
+            help='Profile the compilation, and save the profile to FILE')
+
+    parser.add_argument('--profile-exec',
+            dest='profile_exec', default=False, action='store_true',
+            help=('Also profile running the compiled function ' +
+                    '(with --profile)'))
+
+    parser.add_argument('--profile-format',
+            dest='profile_format', choices=PROFILE_FORMATS,
+            default='pstats',
+            help=('Format of the profile: pstats, or collapsed stacks ' +
+                    'for flame graphs [default=%(default)s]'))
+
     parser.add_argument('-S', '--save-intermediate',
             type=str, dest='intermediate_output', metavar='SAVE-FILENAME',
             default='',
@@ -103,10 +161,26 @@ def parse_args(argv):
             dest='showplot', default=False, action='store_true',
             help="show the waveform plots")
 
+    parser.add_argument('--stats',
+            dest='stats', choices=['json', 'text'], default=None,
+            help=('Print the time and memory used by each stage ' +
+                    'of the compiler, in the given format'))
+
+    parser.add_argument('--trace',
+            dest='trace', default=None, metavar='FILE',
+            help=('Save a trace of the passes of the compiler to FILE, ' +
+                    'in the Chrome trace-event (JSON) format'))
+
     parser.add_argument('-v', dest='verbose',
             default=False, action='store_true',
             help='Run in verbose mode')
 
+    parser.add_argument('--explain',
+            dest='explain', type=int, metavar='N', nargs='?',
+            default=None, const=20,
+            help=('Print the N source lines that produced the most ' +
+                    'output statements [default N=%(const)d]'))
+
     parser.add_argument('-hw', dest='tohw', default=False, action='store_true',
                         help='Compile sequences to hardware (default %(default)s)')
 
@@ -125,7 +199,7 @@ def parse_args(argv):
     # directory, add its directory to the search path
     #
     source_dir = os.path.dirname(options.filename)
-    if source_dir:
+    if source_dir and os.path.normpath(source_dir) not in sys.path:
         sys.path.append(os.path.normpath(source_dir))
 
     if options.verbose:
@@ -133,37 +207,48 @@ def parse_args(argv):
 
     DebugMsg.set_level(options.debug_level)
 
-    return options
+    set_budget(statements=options.max_statements,
+            memory=(options.max_memory * (1 << 20)
+                if options.max_memory else None),
+            seconds=options.max_seconds)
 
-# Takes filename (relative path), name of main (-m arg)
-# If no main, look for function in the file with decorator @qgl2main
-# toplevel_bindings is list of arguments the function takes
-# saveOutput: save the generated qgl1 program? See -o flag
-# intermediate_output: name of file to save intermediate/debug output to; see -S flag
-def compile_function(filename,
-                    main_name=None,
-                    toplevel_bindings=None,
-                    saveOutput=False,
-                    intermediate_output=None):
+    SequenceExtractor.WORKERS = options.workers
+    InlineSettings.WORKERS = options.workers
 
-    NodeError.reset()
+    return options
 
-    print('\n\nCOMPILING [%s] main %s' %
-            (filename, main_name if main_name else '(default)'))
+def open_intermediate_output(intermediate_output):
+    """
+    Open the file for saving intermediate output, if any.
 
-    # Use whether intermediate_output is None to decide
-    # whether to call printout blocks at all
-    # Old code set intermediate_output to /dev/null
+    Returns the open file, or None if intermediate_output is empty
+    """
 
     if intermediate_output:
         try:
-            intermediate_fout = open(intermediate_output, 'w')
+            return open(intermediate_output, 'w')
         except BaseException as exc:
             NodeError.fatal_msg(None,
                     ('cannot save intermediate output in [%s]' %
                         intermediate_output))
     else:
-        intermediate_fout = None
+        return None
+
+@activates_context
+def import_and_inline(filename, main_name=None, intermediate_fout=None):
+    """
+    Run the stages of the compiler that do not depend on the
+    toplevel bindings: process the imports in the input file,
+    find the qgl2main, and inline it until the expansion converges.
+
+    Returns (filename, importer, ptree, ptree1) where filename is the
+    relative path to the input file, importer is the NameSpaces
+    instance, ptree is the original qgl2main, and ptree1 is the
+    inlined qgl2main.
+
+    The optional context parameter is the CompileContext to run in
+    (see pyqgl2.context); by default, the active context is used.
+    """
 
     # Process imports in the input file, and find the main.
     # If there's no main, then bail out right away.
@@ -179,15 +264,18 @@ def compile_function(filename,
     NodeError.halt_on_error()
 
     print('%s: CALLING IMPORTER' % datetime.now())
-    importer = NameSpaces(filename, main_name)
+    with stats_stage('importer') as stage, trace_span('NameSpaces'):
+        importer = NameSpaces(filename, main_name)
+        stage.set_output(importer.qglmain)
     if not importer.qglmain:
         NodeError.fatal_msg(None, 'no qglmain function found')
 
     NodeError.halt_on_error()
 
     ptree = importer.qglmain
+    report_progress('importer', ptree)
 
-    if intermediate_output:
+    if intermediate_fout:
         ast_text_orig = pyqgl2.ast_util.ast2str(ptree)
         print(('%s: ORIGINAL CODE:\n%s' % (datetime.now(), ast_text_orig)),
               file=intermediate_fout, flush=True)
@@ -224,16 +312,30 @@ def compile_function(filename,
     #
 
     print('%s: CALLING INLINER' % datetime.now())
+
+    # First inline the functions called by the qgl2main that
+    # can't be inlined into it, from the leaves of the call graph
+    # up, so each is inlined once, before any of its callers
+    #
+    with stats_stage('inline_callees', ptree1), trace_span('inline_callees'):
+        inline_callees(ptree1, importer)
+    NodeError.halt_on_error()
+
     MAX_ITERS = 20
     for iteration in range(MAX_ITERS):
 
         print('%s: ITERATION %d' % (datetime.now(), iteration))
 
-        inliner = Inliner(importer)
-        ptree1 = inliner.inline_function(ptree1)
+        with stats_stage('inliner', ptree1, iteration) as stage, \
+                trace_span('Inliner', iteration=iteration):
+            inliner = Inliner(importer)
+            ptree1 = inliner.inline_function(ptree1)
+            stage.set_output(ptree1)
         NodeError.halt_on_error()
+        check_budget()
+        report_progress('inliner', ptree1, iteration)
 
-        if intermediate_output:
+        if intermediate_fout:
             print(('INLINED CODE (iteration %d):\n%s' %
                    (iteration, pyqgl2.ast_util.ast2str(ptree1))),
                   file=intermediate_fout, flush=True)
@@ -247,6 +349,32 @@ def compile_function(filename,
         NodeError.error_msg(None,
                 ('expansion did not converge after %d iterations' % MAX_ITERS))
 
+    return filename, importer, ptree, ptree1
+
+@activates_context
+def evaluate_and_extract(filename, importer, ptree, ptree1,
+                    main_name=None,
+                    toplevel_bindings=None,
+                    saveOutput=False,
+                    intermediate_fout=None,
+                    output_suffix=''):
+    """
+    Run the stages of the compiler that depend on the toplevel
+    bindings: evaluate the inlined qgl2main (ptree1) with the
+    given bindings, flatten it, and extract the QGL1 function.
+
+    ptree1 is not modified, so this may be called several times
+    for the same inlined qgl2main with different bindings.
+    If saveOutput is True, then output_suffix is added to the
+    name of the file the QGL1 code is saved in, so that the
+    output of each call can be saved separately.
+
+    The optional context parameter is the CompileContext to run in
+    (see pyqgl2.context); by default, the active context is used.
+
+    Returns the QGL1 function.
+    """
+
     # transform passed toplevel_bindings into a local_context dictionary
 
     # FIXME: If the qgl2main provides a default for an arg
@@ -278,7 +406,10 @@ def compile_function(filename,
     evaluator = EvalTransformer(SimpleEvaluator(importer, local_context))
 
     print('%s: CALLING EVALUATOR' % datetime.now())
-    ptree1 = evaluator.visit(ptree1)
+    with stats_stage('evaluator', ptree1) as stage, \
+            trace_span('EvalTransformer.visit'):
+        ptree1 = evaluator.visit(ptree1)
+        stage.set_output(ptree1)
     NodeError.halt_on_error()
 
     if DebugMsg.ACTIVE_LEVEL < 3:
@@ -293,18 +424,22 @@ def compile_function(filename,
     # print('EV total state:')
     # evaluator.print_state()
 
-    evaluator.replace_bindings(ptree1.body)
+    with stats_stage('replace_bindings', ptree1) as stage, \
+            trace_span('replace_bindings'):
+        evaluator.replace_bindings(ptree1.body)
+        stage.set_output(ptree1)
+    report_progress('evaluator', ptree1)
 
     if DebugMsg.ACTIVE_LEVEL < 3:
         print('%s: EVALUATOR REBINDINGS:\n%s' % (datetime.now(),
                                                  pyqgl2.ast_util.ast2str(ptree1)))
-    if intermediate_output:
+    if intermediate_fout:
         print(('EVALUATOR + REBINDINGS:\n%s' % pyqgl2.ast_util.ast2str(ptree1)),
               file=intermediate_fout, flush=True)
 
     # base_namespace = importer.path2namespace[filename]
 
-    # if intermediate_output:
+    # if intermediate_fout:
     #     text = base_namespace.pretty_print()
     #     print(('EXPANDED NAMESPACE:\n%s' % text),
     #           file=intermediate_fout, flush=True)
@@ -314,9 +449,13 @@ def compile_function(filename,
     # Try to flatten out repeat, range, ifs
     flattener = Flattener()
     print('%s: CALLING FLATTENER' % datetime.now())
-    new_ptree2 = flattener.visit(new_ptree1)
+    with stats_stage('flattener', new_ptree1) as stage, \
+            trace_span('Flattener.visit'):
+        new_ptree2 = flattener.visit(new_ptree1)
+        stage.set_output(new_ptree2)
     NodeError.halt_on_error()
-    if intermediate_output:
+    report_progress('flattener', new_ptree2)
+    if intermediate_fout:
         print(('%s: FLATTENED CODE:\n%s' % (datetime.now(), pyqgl2.ast_util.ast2str(new_ptree2))),
               file=intermediate_fout, flush=True)
 
@@ -324,7 +463,7 @@ def compile_function(filename,
     # evaluator.replace_bindings(new_ptree2.body)
     # evaluator.get_state()
 
-    if intermediate_output:
+    if intermediate_fout:
         print(('Final qglmain: %s\n' % new_ptree2.name),
               file=intermediate_fout, flush=True)
 
@@ -342,52 +481,617 @@ def compile_function(filename,
 
     # Get the QGL1 function that produces the proper sequences
     print('%s: GENERATING QGL1 SEQUENCE FUNCTION' % datetime.now())
-    qgl1_main = get_sequence_function(new_ptree3, fname,
-            importer, evaluator.allocated_qbits, intermediate_fout,
-            saveOutput, filename, setup=evaluator.setup())
+    with stats_stage('extractor', new_ptree3), \
+            trace_span('get_sequence_function'):
+        qgl1_main = get_sequence_function(new_ptree3, fname,
+                importer, evaluator.allocated_qbits, intermediate_fout,
+                saveOutput, filename, setup=evaluator.setup(),
+                output_suffix=output_suffix)
     NodeError.halt_on_error()
+    report_progress('extractor')
     return qgl1_main
 
-def qgl2_compile_to_hardware(seqs, filename, suffix='', axis_descriptor=None, extra_meta=None, tdm_seq = False):
+# Takes filename (relative path), name of main (-m arg)
+# If no main, look for function in the file with decorator @qgl2main
+# toplevel_bindings is list of arguments the function takes
+# saveOutput: save the generated qgl1 program? See -o flag
+# intermediate_output: name of file to save intermediate/debug output to; see -S flag
+# context: the CompileContext to compile in.  By default, a new
+# context is created for each compilation, so concurrent compilations
+# (in different threads) do not interfere with each other.
+# The context is available as the qgl_context attribute of the result.
+# stats: a pyqgl2.stats.CompileStats to fill in with the statistics
+# for each stage of the compilation (and each call of the result).
+# It is also available as the qgl_stats attribute of the result.
+# The hot-path counts of the compilation (see pyqgl2.counters) are
+# available as the qgl_counts attribute of the result, and are
+# added to the stats (if any).
+# The paths of the QGL2 source files read by the compilation are
+# available as the qgl_sources attribute of the result.
+# If the context has a budget (see pyqgl2.budget), then the
+# compilation halts with a QGL2CompileError as soon as the
+# budget is exceeded.
+# explain: a pyqgl2.explain.ExpansionMap to fill in with the output
+# statements and compile time of each line of the source.
+# It is also available as the qgl_explain attribute of the result.
+def compile_function(filename,
+                    main_name=None,
+                    toplevel_bindings=None,
+                    saveOutput=False,
+                    intermediate_output=None,
+                    context=None,
+                    stats=None,
+                    explain=None):
+
+    if context is None:
+        context = CompileContext()
+
+    with context:
+        NodeError.reset()
+        start_budget()
+        if stats is not None:
+            StatsState.STATS = stats
+        if explain is not None:
+            ExplainState.EXPLAIN = explain
+            if explain not in TraceHooks.HOOKS:
+                add_trace_hook(explain)
+        start_counts = get_counts()
+
+    print('\n\nCOMPILING [%s] main %s' %
+            (filename, main_name if main_name else '(default)'))
+
+    # Use whether intermediate_output is None to decide
+    # whether to call printout blocks at all
+    # Old code set intermediate_output to /dev/null
+
+    intermediate_fout = open_intermediate_output(intermediate_output)
+
+    filename, importer, ptree, ptree1 = import_and_inline(
+            filename, main_name, intermediate_fout, context=context)
+
+    qgl1_main = evaluate_and_extract(filename, importer, ptree, ptree1,
+            main_name, toplevel_bindings, saveOutput, intermediate_fout,
+            context=context)
+
+    with context:
+        counts = counts_since(start_counts)
+    if stats is not None:
+        stats.add_counts(counts)
+
+    resFunction = bind_precomputed_values(qgl1_main, context)
+    resFunction.qgl_counts = counts
+    resFunction.qgl_sources = list(importer.path2ast)
+    return resFunction
+
+# Like compile_function, but for use in asyncio programs: the
+# compilation runs in the given executor (by default, the event loop's
+# default executor), so it does not block the event loop.
+#
+# progress (if not None) is called, in the event loop, with a
+# pyqgl2.progress.CompileProgress at the end of each stage of the
+# compilation (the importer, each iteration of the inliner, the
+# evaluator, the flattener, and the sequence extractor).
+#
+# If the task awaiting this is cancelled, then the compilation stops
+# at the end of the stage that is running, and the task sees the
+# usual asyncio.CancelledError.
+#
+async def compile_function_async(filename,
+                    main_name=None,
+                    toplevel_bindings=None,
+                    saveOutput=False,
+                    intermediate_output=None,
+                    context=None,
+                    progress=None,
+                    executor=None):
+
+    # (Inside a coroutine, this is the running loop)
+    loop = asyncio.get_event_loop()
+
+    if context is None:
+        context = CompileContext()
+
+    cancelled = threading.Event()
+
+    # Called in the executor at the end of each stage
+    def listener(event):
+        if progress:
+            loop.call_soon_threadsafe(progress, event)
+        if cancelled.is_set():
+            raise CompileCancelled('compilation of [%s] cancelled' % filename)
+
+    with context:
+        add_progress_listener(listener)
+
+    try:
+        return await loop.run_in_executor(executor, functools.partial(
+                compile_function, filename, main_name, toplevel_bindings,
+                saveOutput, intermediate_output, context))
+    except asyncio.CancelledError:
+        cancelled.set()
+        raise
+    finally:
+        # If the compilation is still running, then the listener
+        # must stay in place to stop it
+        if not cancelled.is_set():
+            with context:
+                remove_progress_listener(listener)
+
+# Like compile_function, but compiles the same qgl2main once for each
+# element of bindings_list (each of which is a toplevel_bindings tuple
+# or dict).  The importer and inliner are only run once, and their
+# results are shared by all of the variants; only the evaluator,
+# flattener, and sequence extractor are run for each variant.
+#
+# The shared stages run in the given context (or a new context, if
+# none is given), and each variant runs in a new context that
+# inherits its settings from that context.
+#
+# If saveOutput is True, then the QGL1 code for each variant is saved
+# separately, with the index of the variant as a suffix.
+#
+# Returns a list of (function, seconds) pairs, in the same order as
+# bindings_list, where function is the QGL1 function for that variant
+# and seconds is the time taken to compile that variant (not including
+# the shared stages).  The qgl_counts of each function are the
+# hot-path counts of that variant (again, not including the shared
+# stages).  Each variant has its own budget (see pyqgl2.budget),
+# separate from the budget of the shared stages.
+#
+def compile_function_batch(filename,
+                    main_name=None,
+                    bindings_list=None,
+                    saveOutput=False,
+                    intermediate_output=None,
+                    context=None):
+
+    if context is None:
+        context = CompileContext()
+
+    with context:
+        NodeError.reset()
+        start_budget()
+
+    if not bindings_list:
+        bindings_list = [None]
+
+    print('\n\nCOMPILING [%s] main %s (%d variants)' %
+            (filename, main_name if main_name else '(default)',
+                len(bindings_list)))
+
+    intermediate_fout = open_intermediate_output(intermediate_output)
+
+    start_time = time.perf_counter()
+    filename, importer, ptree, ptree1 = import_and_inline(
+            filename, main_name, intermediate_fout, context=context)
+    print('%s: SHARED STAGES took %.3fs' %
+            (datetime.now(), time.perf_counter() - start_time))
+
+    results = list()
+    for variant, toplevel_bindings in enumerate(bindings_list):
+        start_time = time.perf_counter()
+
+        # Each QGL1 function finds its precomputed values through
+        # EvalTransformer.PRECOMPUTED_VALUES, so each variant needs
+        # its own context.  The variants share the stats, the
+        # expansion map, and the trace hooks (if any) of the
+        # shared stages.
+        #
+        with context:
+            variant_context = CompileContext()
+            stats = StatsState.STATS
+            explain = ExplainState.EXPLAIN
+            hooks = TraceHooks.HOOKS
+        with variant_context:
+            StatsState.STATS = stats
+            ExplainState.EXPLAIN = explain
+            TraceHooks.HOOKS = list(hooks)
+            start_budget()
+
+        qgl1_main = evaluate_and_extract(filename, importer, ptree, ptree1,
+                main_name, toplevel_bindings, saveOutput, intermediate_fout,
+                output_suffix='_%d' % variant, context=variant_context)
+
+        elapsed = time.perf_counter() - start_time
+        print('%s: VARIANT %d took %.3fs' % (datetime.now(), variant, elapsed))
+
+        with variant_context:
+            counts = dict(get_counts())
+        if stats is not None:
+            stats.add_counts(counts)
+
+        resFunction = bind_precomputed_values(qgl1_main, variant_context)
+        resFunction.qgl_counts = counts
+        resFunction.qgl_sources = list(importer.path2ast)
+        results.append((resFunction, elapsed))
+
+    return results
+
+def bind_precomputed_values(qgl1_main, context):
+    """
+    Return a wrapper for the given QGL1 function that activates
+    the CompileContext it was compiled in (which holds its
+    precomputed values) before calling it, so that it may be
+    called after another function has been compiled, or from
+    outside that context
+
+    The context is available as the qgl_context attribute
+    of the wrapper (and its CompileStats and ExpansionMap, if
+    any, as the qgl_stats and qgl_explain attributes).
+
+    The qgl_segments attribute of the wrapper is a function that
+    returns an iterator over the init-delimited segments of the
+    sequence (see split_segments), which creates each segment
+    only when it is needed.
+    """
+
+    @functools.wraps(qgl1_main)
+    def wrapper():
+        with context:
+            with stats_stage('exec'), trace_span('exec'):
+                return qgl1_main()
+
+    def segments():
+        generator = get_generator_function(qgl1_main)
+        if generator is None:
+            return split_segments(wrapper())
+
+        # Only the preamble of the generator (which reads the
+        # precomputed values) is run in the context; the instructions
+        # are created as the segments are read
+        with context:
+            with stats_stage('exec'), trace_span('exec'):
+                instructions = generator()
+        return split_segments(instructions)
+
+    wrapper.qgl_context = context
+    wrapper.qgl_segments = segments
+    with context:
+        wrapper.qgl_stats = StatsState.STATS
+        wrapper.qgl_explain = ExplainState.EXPLAIN
+
+    return wrapper
+
+def split_segments(seq):
+    """
+    Split a QGL1 sequence (or any iterable of instructions) into
+    segments, each of which begins with the WAIT created by a call
+    to init (except for the instructions before the first WAIT, if
+    any).  Yields each segment (as a list) as soon as it is complete,
+    so the input may be produced incrementally.
+    """
+
+    from QGL.ControlFlow import Wait
+
+    segment = list()
+    for instr in seq:
+        if isinstance(instr, Wait) and segment:
+            yield segment
+            segment = list()
+        segment.append(instr)
+
+    if segment:
+        yield segment
+
+def schedule_segments(seq):
+    """
+    Schedule the given QGL1 sequence one init-delimited segment at a
+    time (see split_segments), and return the concatenation of the
+    scheduled segments.
+
+    Each WAIT synchronizes all of the channels, so no instruction can
+    be moved earlier than the WAIT that begins its segment, and the
+    result is the same as scheduling the entire sequence at once.
+    """
+
+    from QGL.Scheduler import schedule
+
+    return [instr for segment in split_segments(seq)
+            for instr in schedule(segment)]
+
+def schedule_plan(segment, measured_qubits=None):
+    """
+    Return the plan for scheduling the given segment: for each
+    instruction of the segment, the index in the scheduled segment
+    of the instruction that it is appended to or combined with
+    (or None for a Barrier, which is dropped).
+
+    This is the same algorithm as QGL.Scheduler.schedule, but only
+    records where each instruction goes, so the plan can be made in
+    one process and applied (by apply_schedule_plan) in another.
+    The plan depends only on the channels of the instructions,
+    so it's the same for every evaluation of the sequence.
+
+    Finding the qubit of a measurement requires a query of the
+    channel library, so if measured_qubits is given, it is used
+    to remember the channels of each measurement (by the label of
+    its channel) from one call to the next.
+    """
+
+    from QGL.Channels import Measurement
+    from QGL.ControlFlow import Barrier, ControlInstruction
+    from QGL.Scheduler import get_channels, synchronize_counters
+
+    if measured_qubits is None:
+        measured_qubits = dict()
+
+    def instr_channels(instr, channel_set=None):
+        channel = getattr(instr, 'channel', None)
+        if not isinstance(channel, Measurement):
+            return get_channels(instr, channel_set)
+
+        if channel.label not in measured_qubits:
+            measured_qubits[channel.label] = get_channels(instr)
+        return measured_qubits[channel.label]
+
+    # as in QGL.Scheduler.find_all_channels
+    channel_set = set()
+    for instr in segment:
+        channels = instr_channels(instr)
+        if channels is not None:
+            channel_set.update(channels)
+
+    counters = dict()
+    is_control = list()
+    plan = list()
+
+    for instr in segment:
+        if isinstance(instr, Barrier):
+            synchronize_counters(counters, instr.chanlist)
+            plan.append(None)
+            continue
+
+        channels = instr_channels(instr, channel_set)
+        if channels is None:
+            raise Exception(
+                    "No channels found from 'get_channels(%s, channel_set)'" %
+                    instr)
+        idx = max(counters.get(ch, 0) for ch in channels)
+
+        if idx >= len(is_control) or is_control[idx]:
+            idx = len(is_control)
+            is_control.append(isinstance(instr, ControlInstruction))
+        plan.append(idx)
+
+        for ch in channels:
+            counters[ch] = idx + 1
+
+    return plan
+
+def apply_schedule_plan(segment, plan):
+    """
+    Schedule the given segment according to the given plan
+    (see schedule_plan), and return the scheduled segment
+    """
+
+    scheduled = list()
+    for instr, idx in zip(segment, plan):
+        if idx is None:
+            continue
+        elif idx == len(scheduled):
+            scheduled.append(instr)
+        else:
+            scheduled[idx] *= instr
+
+    return scheduled
+
+# The number of segments in each task of schedule_pipelined
+SCHEDULE_CHUNK = 64
+
+# The state of each schedule_plan_worker: the function whose segments
+# are scheduled, the states of the random generators when the segments
+# were first created, the worker's iterator over its segments (if any),
+# and the index of the next segment of that iterator
+SCHEDULE_STATE = None
+
+def schedule_pipelined(function, workers):
+    """
+    Schedule the sequence of the given function (returned by
+    compile_function), making the schedule in a pool of the given
+    number of worker processes while the sequence is being created.
+
+    QGL1 instructions can't be pickled, so the instructions are not
+    sent to the workers.  The segments of the sequence (see
+    split_segments) are created incrementally, and as each chunk
+    of segments is created, a worker is asked for the plan for
+    scheduling that chunk (see schedule_plan).  Each worker creates
+    its own copy of the same segments, and returns the plans, which
+    are then applied to the segments created here.
+
+    Some QGL1 functions (such as clifford_seq) make random choices,
+    so each worker starts from the same state of the random and
+    numpy.random generators as this process; the function must not
+    use any other source of randomness.
+
+    The workers are forked, so they inherit the function; if this
+    process can't fork workers, or workers is less than 2, then the
+    segments are planned and scheduled here, one at a time.
+    """
+
+    global SCHEDULE_STATE
+
+    if workers < 2 or not can_fork_workers():
+        measured_qubits = dict()
+        return [instr for segment in function.qgl_segments()
+                for instr in apply_schedule_plan(
+                    segment, schedule_plan(segment, measured_qubits))]
+
+    SCHEDULE_STATE = [function, (random.getstate(), np.random.get_state()),
+            None, 0]
+    segments = list()
+    futures = list()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            start = 0
+            for segment in function.qgl_segments():
+                segments.append(segment)
+                if len(segments) - start == SCHEDULE_CHUNK:
+                    futures.append(executor.submit(
+                            schedule_plan_worker, start, len(segments)))
+                    start = len(segments)
+            if start < len(segments):
+                futures.append(executor.submit(
+                        schedule_plan_worker, start, len(segments)))
+
+            scheduled = list()
+            plans = [plan for future in futures for plan in future.result()]
+            for segment, plan in zip(segments, plans):
+                scheduled.extend(apply_schedule_plan(segment, plan))
+    finally:
+        SCHEDULE_STATE = None
+
+    return scheduled
+
+def schedule_plan_worker(start, stop):
+    """
+    Worker for schedule_pipelined: return the schedule plans for
+    the segments from start up to (but not including) stop
+
+    The tasks are taken in order, so each worker usually only needs
+    to advance its iterator over the segments to reach start; it only
+    starts over if start is before its current position.
+    """
+
+    function, random_states, segments, index = SCHEDULE_STATE
+    if segments is None or index > start:
+        random.setstate(random_states[0])
+        np.random.set_state(random_states[1])
+        segments = function.qgl_segments()
+        index = 0
+
+    measured_qubits = dict()
+    plans = list()
+    for segment in segments:
+        if index >= start:
+            plans.append(schedule_plan(segment, measured_qubits))
+        index += 1
+        if index == stop:
+            break
+
+    SCHEDULE_STATE[2:] = [segments, index]
+    return plans
+
+def qgl2_compile_to_hardware(seqs, filename, suffix='', axis_descriptor=None, extra_meta=None, tdm_seq = False, pipelined=False, workers=None):
     '''
     Custom compile_to_hardware for QGL2
+
+    If pipelined is True, then seqs must instead be a function returned
+    by compile_function, and its sequence is created one init-delimited
+    segment at a time and scheduled in a pool of worker processes (see
+    schedule_pipelined) with the given number of workers (by default,
+    the number of CPUs).
     '''
 
     from QGL.Compiler import compile_to_hardware
     from QGL.Scheduler import schedule
 
-    scheduled_seq = schedule(seqs)
+    if pipelined:
+        if workers is None:
+            workers = os.cpu_count() or 1
+        scheduled_seq = schedule_pipelined(seqs, workers)
+    else:
+        scheduled_seq = schedule(seqs)
 
     return compile_to_hardware([scheduled_seq], filename, suffix=suffix, axis_descriptor=axis_descriptor, extra_meta=extra_meta, tdm_seq=tdm_seq)
 
-######
-# Run the main with
-# main.py <path to file with a qgl2decl to compile that creates
-#              sequences you want to compile and plot>
-#        -m <name of qgl2main if not decorated>
-#        [-o if you want the compiled qgl1 function saved to a file]
-#####
+class RunCache(object):
+    """
+    The state that run_main may reuse from one run to the next,
+    in a process that runs it many times (see pyqgl2.daemon)
+
+    channel_libraries maps the name of each channel library that
+    has been loaded to the (file stamp, ChannelLibrary) for it.
+    A library is only reused if it is still the active channel
+    library, and its file has not changed.
+
+    functions maps the working directory and options of each run
+    that has compiled a program to a CompiledRun, which is reused
+    if none of its source files have changed, and the same channel
+    library is active.
+    """
 
-if __name__ == '__main__':
-    import psutil
-    opts = parse_args(sys.argv[1:])
-    if opts.verbose:
-        process = psutil.Process(os.getpid())
-        print("Memory usage: {} MB".format(process.memory_info().rss // (1 << 20)))
+    def __init__(self):
+        self.channel_libraries = dict()
+        self.functions = dict()
+
+    @staticmethod
+    def run_key(opts):
+        """
+        Return the key for the compiled function of a run with
+        the given options, or None if the run must compile the
+        program, because its options ask for information (or
+        files) created during the compilation
+        """
+
+        if (opts.saveOutput or opts.intermediate_output or opts.stats or
+                opts.trace or opts.explain or opts.profile):
+            return None
+
+        return (os.getcwd(), tuple(sorted(vars(opts).items())))
+
+
+class CompiledRun(object):
+    """
+    A function compiled by run_main, along with what the
+    compilation printed, and what it depends on
+    """
+
+    def __init__(self, function, output, channel_library):
+        self.function = function
+        self.output = output
+        self.channel_library = channel_library
+        self.stamps = [(path, ModuleCache.file_stamp(path))
+                for path in function.qgl_sources]
+
+    def is_current(self, channel_library):
+        return ((channel_library is self.channel_library) and
+                all(ModuleCache.file_stamp(path) == stamp
+                    for path, stamp in self.stamps))
+
+
+def load_channel_library(opts, cache=None):
+    """
+    Load or create the channel library requested by the
+    commandline options (see parse_args).
+
+    If a RunCache is given, then a channel library that it
+    has already loaded is reused if it is still current.
+
+    Returns True if there is a usable channel library,
+    False otherwise.
+    """
 
     import QGL
 
     # Handle option asking to use an existing channel library
     if opts.channel_library is not None:
-        cl = None
-        try:
-            # This will load or create a file of the given name,
-            # unless the name is the special ":memory:"
-            cl = QGL.ChannelLibraries.ChannelLibrary(db_resource_name=opts.channel_library)
-            qcnt = len(cl.qubits())
-            print(f"Loaded Channel Library from '{opts.channel_library}' with {qcnt} qubits")
-        except Exception as e:
-            print(f"Failed to load Channel Library from '{opts.channel_library}': {e}")
+        name = opts.channel_library
+        stamp = ModuleCache.file_stamp(name)
+
+        cached = None
+        if cache and stamp:
+            cached = cache.channel_libraries.get(name)
+
+        if (cached and cached[0] == stamp and
+                cached[1] is QGL.ChannelLibraries.channelLib):
+            qcnt = len(cached[1].qubits())
+            print(f"Using Channel Library from '{name}' with {qcnt} qubits")
+        else:
+            cl = None
+            try:
+                # This will load or create a file of the given name,
+                # unless the name is the special ":memory:"
+                cl = QGL.ChannelLibraries.ChannelLibrary(db_resource_name=name)
+                qcnt = len(cl.qubits())
+                print(f"Loaded Channel Library from '{name}' with {qcnt} qubits")
+            except Exception as e:
+                print(f"Failed to load Channel Library from '{name}': {e}")
+
+            # Loading a library may change its file,
+            # so check its stamp again
+            stamp = ModuleCache.file_stamp(name)
+            if cache and cl and stamp:
+                cache.channel_libraries[name] = (stamp, cl)
 
     # We require that the CL have a slave trigger to be usable currently, otherwise
     # We create a new one if so requested, or we give up.
@@ -399,18 +1103,125 @@ if __name__ == '__main__':
         print("Will create and use APS2ish 3 qubit test channel library")
         # Hack. Create a basic channel library for testing
         # FIXME: Allow supplying a CL file to read?
-        import test_cl
+        from pyqgl2 import test_cl
         test_cl.create_default_channelLibrary(opts.tohw)
     else:
         print('No valid ChannelLibrary found')
-        sys.exit(1)
+        return False
+
+    return True
+
+def print_stats(stats, stats_format):
+    """
+    Print the given CompileStats in the given format
+    ('json' or 'text'), and stop collecting memory statistics
+    """
+
+    stats.stop()
+
+    if stats_format == 'json':
+        print(stats.to_json())
+    else:
+        print(stats.format_table())
+
+def run_main(opts, cache=None):
+    """
+    Do everything that running this module as a program does,
+    given the commandline options (see parse_args): load the
+    channel library, compile the program, and then run the
+    QGL1 function and print (or compile to hardware) the
+    sequences it creates.
+
+    If a RunCache is given, then the channel library and the
+    compiled function are reused from an earlier run with the
+    same options (if they are still current), and what the
+    compilation printed is printed again.
+
+    Returns the exit status for the program.
+    """
+
+    import psutil
+    if opts.verbose:
+        process = psutil.Process(os.getpid())
+        print("Memory usage: {} MB".format(process.memory_info().rss // (1 << 20)))
+
+    if not load_channel_library(opts, cache):
+        return 1
 
     # FIXME: parse remaining commandling arguments as toplevel_bindings
 
-    resFunction = compile_function(
-            opts.filename, opts.main_name,
-            toplevel_bindings=None, saveOutput=opts.saveOutput,
-            intermediate_output=opts.intermediate_output)
+    if opts.stats:
+        stats = CompileStats(track_memory=True)
+    else:
+        stats = None
+
+    if opts.explain:
+        explain = ExpansionMap()
+    else:
+        explain = None
+
+    context = CompileContext()
+    if opts.trace:
+        trace = ChromeTrace()
+        with context:
+            add_trace_hook(trace)
+    else:
+        trace = None
+
+    # Only the compilation (and, optionally, the call of the
+    # compiled function) is profiled, not the rest of this program
+    if opts.profile:
+        profiler = CompileProfiler(opts.profile_format)
+    else:
+        profiler = None
+
+    import QGL
+
+    run_key = cache.run_key(opts) if cache else None
+    compiled = cache.functions.get(run_key) if run_key else None
+    channel_library = QGL.ChannelLibraries.channelLib
+
+    def compile_program():
+        with profiler or contextlib.ExitStack():
+            return compile_function(
+                    opts.filename, opts.main_name,
+                    toplevel_bindings=None, saveOutput=opts.saveOutput,
+                    intermediate_output=opts.intermediate_output,
+                    context=context, stats=stats, explain=explain)
+
+    # This is the only place where a compilation error
+    # should cause the program to fail
+    try:
+        if compiled and compiled.is_current(channel_library):
+            print(compiled.output, end='')
+            resFunction = compiled.function
+        elif run_key:
+            # Keep what the compilation prints,
+            # so it can be printed again
+            output = io.StringIO()
+            try:
+                with contextlib.redirect_stdout(output):
+                    resFunction = compile_program()
+            finally:
+                print(output.getvalue(), end='')
+
+            cache.functions[run_key] = CompiledRun(
+                    resFunction, output.getvalue(), channel_library)
+        else:
+            resFunction = compile_program()
+    except QGL2CompileError as exc:
+        print(str(exc))
+        if stats:
+            print_stats(stats, opts.stats)
+        if trace:
+            trace.write(opts.trace)
+        if profiler:
+            profiler.write(opts.profile)
+        return 1
+
+    if explain:
+        print('\nSource lines that produced the most output:')
+        print(explain.format_table(limit=opts.explain))
 
     if not resFunction:
         # If there aren't any Qubit operations, then we're
@@ -418,12 +1229,33 @@ if __name__ == '__main__':
         # non-quantum effects.
         #
         print("The program in {} contains no Qubit operations?".format(opts.filename))
+        if profiler:
+            profiler.write(opts.profile)
     else:
         # Now import the QGL1 things we need
         from QGL.PulseSequencePlotter import plot_pulse_files
 
+        # With -hw and more than one worker, the sequence is created
+        # while it is being scheduled (see schedule_pipelined), unless
+        # the call of the function is profiled
+        pipelined = (opts.tohw and opts.workers > 1 and
+                not (profiler and opts.profile_exec))
+
         # Now execute the returned function, which should produce a list of sequences
-        sequences = resFunction()
+        if pipelined:
+            sequences = None
+        elif profiler and opts.profile_exec:
+            with profiler:
+                sequences = resFunction()
+        else:
+            sequences = resFunction()
+
+        if stats:
+            print_stats(stats, opts.stats)
+        if trace:
+            trace.write(opts.trace)
+        if profiler:
+            profiler.write(opts.profile)
 
         # In verbose mode, turn on DEBUG python logging for the QGL Compiler
         if opts.verbose:
@@ -438,8 +1270,13 @@ if __name__ == '__main__':
         if opts.tohw:
             print("Compiling sequences to hardware\n")
             # FIXME: Add option to supply axis_descriptors?
-            fileNames = qgl2_compile_to_hardware(sequences, opts.prefix,
-                                                 opts.suffix)
+            if pipelined:
+                fileNames = qgl2_compile_to_hardware(resFunction,
+                        opts.prefix, opts.suffix, pipelined=True,
+                        workers=opts.workers)
+            else:
+                fileNames = qgl2_compile_to_hardware(sequences, opts.prefix,
+                                                     opts.suffix)
             print(fileNames)
             if opts.showplot:
                 plot_pulse_files(fileNames)
@@ -453,3 +1290,19 @@ if __name__ == '__main__':
 
     if opts.verbose:
         print("Memory usage: {} MB".format(process.memory_info().rss // (1 << 20)))
+
+    return 0
+
+######
+# Run the main with
+# main.py <path to file with a qgl2decl to compile that creates
+#              sequences you want to compile and plot>
+#        -m <name of qgl2main if not decorated>
+#        [-o if you want the compiled qgl1 function saved to a file]
+#
+# To avoid the cost of starting the compiler for each program,
+# see pyqgl2.daemon, which takes the same arguments.
+#####
+
+if __name__ == '__main__':
+    sys.exit(run_main(parse_args(sys.argv[1:])))
@@ -0,0 +1,180 @@
+# Copyright 2016 by Raytheon BBN Technologies Corp.  All Rights Reserved.
+
+"""
+Profiling the compiler
+
+A CompileProfiler is a context manager that profiles the code run
+inside it (and accumulates the profile over each use), so that the
+caller can profile just the compilation (and, optionally, the call
+of the QGL1 function it creates), without the noise of parsing the
+command line, loading the channel library, etc.  This is what the
+--profile option of pyqgl2.main does.
+
+There are two formats of profile:
+
+    pstats: the profile is collected with cProfile, and saved in
+        its binary format, for pstats, snakeviz, etc.
+    collapsed: the call stacks are sampled, and saved in the
+        "folded stacks" text format used by flamegraph.pl and
+        speedscope: one line per call stack, with the number of
+        samples in which that stack was running
+
+cProfile records the time of each function for each of its callers,
+but not the call stacks, which are what a flame graph shows (and the
+compiler is deeply recursive, so the stacks can't be reconstructed
+from the callers), so the collapsed format uses a sampler instead:
+a thread that records the stack of the profiled thread once per
+interval.  Only the frames inside the profiled code are recorded.
+"""
+
+import cProfile
+import os
+import sys
+import threading
+
+
+PROFILE_FORMATS = ('pstats', 'collapsed')
+
+
+class StackSampler(object):
+    """
+    Context manager that samples the call stack of the thread
+    that enters it, once per interval (in seconds)
+
+    Only the frames called (directly or indirectly) by base_frame
+    are recorded; by default, base_frame is the frame that enters
+    the sampler.
+
+    samples maps each stack (a tuple of (filename, lineno, name)
+    tuples for the functions of the stack, outermost first) to
+    the number of times that stack was sampled.
+    """
+
+    def __init__(self, interval=0.001, base_frame=None):
+        self.interval = interval
+        self.samples = dict()
+
+        self.thread_id = None
+        self.base_frame = base_frame
+        self.stop_event = None
+        self.thread = None
+        self.old_switch_interval = None
+
+    def __enter__(self):
+        self.thread_id = threading.get_ident()
+        if self.base_frame is None:
+            self.base_frame = sys._getframe(1)
+        self.stop_event = threading.Event()
+
+        # The sampler can only run when the profiled thread releases
+        # the GIL, so make it switch threads at least as often as
+        # the sampling interval
+        self.old_switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self.old_switch_interval, self.interval))
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop_event.set()
+        self.thread.join()
+        sys.setswitchinterval(self.old_switch_interval)
+        return False
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+
+            stack = list()
+            while frame is not None and frame is not self.base_frame:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno,
+                        code.co_name))
+                frame = frame.f_back
+
+            # If the profiled thread has left the block (or
+            # hasn't entered it yet), then frame is None; if it
+            # is starting or stopping the profiler, then the
+            # outermost frame is in this module
+            if frame is None or not stack or stack[-1][0] == __file__:
+                continue
+
+            stack = tuple(reversed(stack))
+            self.samples[stack] = self.samples.get(stack, 0) + 1
+
+
+class CompileProfiler(object):
+    """
+    Context manager that profiles the code run inside it,
+    in the given format (see PROFILE_FORMATS)
+
+    The same CompileProfiler may be used several times; the
+    profile includes everything run inside any of them.
+    """
+
+    def __init__(self, profile_format='pstats', interval=0.001):
+        if profile_format not in PROFILE_FORMATS:
+            raise ValueError('unknown profile format [%s]' % profile_format)
+
+        self.profile_format = profile_format
+        self.interval = interval
+
+        self.profile = cProfile.Profile()
+        self.samples = dict()
+        self.sampler = None
+
+    def __enter__(self):
+        if self.profile_format == 'pstats':
+            self.profile.enable()
+        else:
+            self.sampler = StackSampler(self.interval, sys._getframe(1))
+            self.sampler.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.profile_format == 'pstats':
+            self.profile.disable()
+        else:
+            self.sampler.__exit__(exc_type, exc_value, traceback)
+            for stack, count in self.sampler.samples.items():
+                self.samples[stack] = self.samples.get(stack, 0) + count
+            self.sampler = None
+
+        return False
+
+    def write(self, path):
+        """
+        Write the profile to the given path
+        """
+
+        if self.profile_format == 'pstats':
+            self.profile.dump_stats(path)
+        else:
+            with open(path, 'w') as fout:
+                for line in format_collapsed(self.samples):
+                    print(line, file=fout)
+
+
+def func_label(func):
+    """
+    Return a label for the given (filename, lineno, name)
+    tuple, for a collapsed stack
+    """
+
+    filename, lineno, name = func
+
+    # Semicolons separate the frames of a stack, and the count
+    # follows the last space, so neither may appear in a label
+    label = '%s:%d:%s' % (os.path.basename(filename), lineno, name)
+    return label.replace(';', ':').replace(' ', '_')
+
+
+def format_collapsed(samples):
+    """
+    Return the lines of the given samples (see StackSampler)
+    in the collapsed ("folded stacks") format
+    """
+
+    return ['%s %d' % (';'.join(func_label(func) for func in stack), count)
+            for stack, count in sorted(samples.items())]
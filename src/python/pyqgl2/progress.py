@@ -0,0 +1,116 @@
+# Copyright 2016 by Raytheon BBN Technologies Corp.  All Rights Reserved.
+
+"""
+Progress reports from the stages of the compiler
+
+Each stage of the compiler (the importer, each iteration of the
+inliner, the evaluator, the flattener, and the sequence extractor)
+calls report_progress when it finishes.  If any listeners have been
+added to the active CompileContext (with add_progress_listener), then
+each is called with a CompileProgress describing the stage.
+
+A listener may stop the compilation by raising an exception (such as
+CompileCancelled), which propagates out of compile_function.  This is
+how compile_function_async cancels a compilation between stages.
+
+If there are no listeners, report_progress returns without counting
+the statements of the stage.
+"""
+
+import ast
+
+from pyqgl2.context import ContextState
+
+
+class CompileCancelled(Exception):
+    """
+    Raised by a progress listener to stop a compilation
+    """
+
+    pass
+
+
+class CompileProgress(object):
+    """
+    Describes a stage of the compiler that has just finished
+
+    stage is the name of the stage ('importer', 'inliner', 'evaluator',
+    'flattener', or 'extractor'), iteration is the number of the
+    iteration (for the inliner; otherwise None), and statements
+    is the number of statements in the qgl2main after the stage
+    (or None, if not applicable).
+    """
+
+    def __init__(self, stage, iteration=None, statements=None):
+        self.stage = stage
+        self.iteration = iteration
+        self.statements = statements
+
+    def __repr__(self):
+        text = '<CompileProgress %s' % self.stage
+        if self.iteration is not None:
+            text += ' iteration %d' % self.iteration
+        if self.statements is not None:
+            text += ' statements %d' % self.statements
+        return text + '>'
+
+    def __eq__(self, other):
+        return (isinstance(other, CompileProgress) and
+                (self.stage, self.iteration, self.statements) ==
+                (other.stage, other.iteration, other.statements))
+
+
+class ProgressListeners(object, metaclass=ContextState):
+    """
+    The progress listeners of the active CompileContext
+    """
+
+    LISTENERS = list()
+
+    CONTEXT_ATTRS = ('LISTENERS',)
+
+
+def add_progress_listener(listener):
+    """
+    Add a listener to the active CompileContext.  The listener
+    is called with a CompileProgress at the end of each stage.
+    """
+
+    ProgressListeners.LISTENERS.append(listener)
+
+
+def remove_progress_listener(listener):
+    """
+    Remove a listener from the active CompileContext
+    """
+
+    ProgressListeners.LISTENERS.remove(listener)
+
+
+def count_statements(ptree):
+    """
+    Return the number of statements in the given AST
+    """
+
+    return sum(1 for node in ast.walk(ptree) if isinstance(node, ast.stmt))
+
+
+def report_progress(stage, ptree=None, iteration=None):
+    """
+    Tell the listeners of the active CompileContext (if any)
+    that the given stage has finished, and that ptree (if not
+    None) is the qgl2main produced by the stage
+    """
+
+    listeners = ProgressListeners.LISTENERS
+    if not listeners:
+        return
+
+    if ptree is not None:
+        statements = count_statements(ptree)
+    else:
+        statements = None
+
+    event = CompileProgress(stage, iteration, statements)
+    for listener in list(listeners):
+        listener(event)
@@ -18,8 +18,9 @@ import ast
 from pyqgl2.lang import QGL2
 from pyqgl2.debugmsg import DebugMsg
 from pyqgl2.ast_util import NodeError, ast2str
+from pyqgl2.context import ContextState
 
-class QRegister(object):
+class QRegister(object, metaclass=ContextState):
     """
     Registers of Qubits.
 
@@ -30,6 +31,12 @@ class QRegister(object):
     KNOWN_QUBITS = dict()
     NUM_REGISTERS = 0
 
+    # kept separately for each CompileContext, but a new context
+    # starts with the qubits already allocated by its parent, so
+    # that a program doesn't allocate the qubits of its arguments
+    CONTEXT_ATTRS = ('KNOWN_QUBITS', 'NUM_REGISTERS')
+    CONTEXT_INHERIT = CONTEXT_ATTRS
+
     def __init__(self, *args):
         '''
         Valid constructor calls:
@@ -2,13 +2,21 @@
 import pickle
 import copy
 
+from pyqgl2.counters import count
+
 # copy.deepcopy is slow. This is _much_ faster.
 # FIXME: Can we do even better?
 
 def quickcopy(original):
     '''Quick equivalent of copy.deepcopy'''
 
+    count('quickcopy_calls')
+
     try:
-        return pickle.loads(pickle.dumps(original))
+        data = pickle.dumps(original)
     except pickle.PicklingError as exc:
+        count('quickcopy_deepcopies')
         return copy.deepcopy(original)
+
+    count('quickcopy_bytes', len(data))
+    return pickle.loads(data)
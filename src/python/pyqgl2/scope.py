@@ -398,7 +398,7 @@ def t8(a, b):
         print('---- ---- ---- ----')
         scope_check(t, module_names=module_names)
 
-        actual_msg = ('\n'.join(NodeError.LAST_MSGS)).strip()
+        actual_msg = ('\n'.join(NodeError.last_msgs())).strip()
         if expected_msg != actual_msg:
             print('ERROR in test %d' % ind)
             print('Expected:\n%s' % expected_msg)
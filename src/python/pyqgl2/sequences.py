@@ -7,11 +7,16 @@ import ast
 import os
 import sys
 
+from concurrent.futures import ProcessPoolExecutor
+
 from pyqgl2.ast_util import ast2str, NodeError
+from pyqgl2.context import CompileContext, ContextState
+from pyqgl2.counters import add_counts, get_counts
+from pyqgl2.explain import ExplainState, explain_output
 from pyqgl2.quickcopy import quickcopy
 from pyqgl2.qreg import is_qbit_create
 
-class SequenceExtractor(object):
+class SequenceExtractor(object, metaclass=ContextState):
     """
     Create QGL1 code from a modified AST
 
@@ -21,8 +26,33 @@ class SequenceExtractor(object):
     Note: this assumes that the AST is for one function
     definition that has already been inlined, successfully
     flattened, grouped, and sequenced already.
+
+    For long programs, most of the time is spent expanding the
+    statements over their QRegisters and converting the results
+    to source code.  If WORKERS is more than 1, and there are at
+    least MIN_PARALLEL_STATEMENTS statements, then find_sequences
+    divides the statements into chunks that are expanded and
+    converted in a pool of WORKERS processes, and the results are
+    merged in their original order.  The generated code is the
+    same either way.
     """
 
+    # The number of worker processes to use (0 or 1 means
+    # do not use a pool), and the minimum number of statements
+    # for which it's worth starting a pool
+    #
+    WORKERS = 0
+    MIN_PARALLEL_STATEMENTS = 2000
+
+    # The number of chunks to create for each worker, so that
+    # a worker that finishes its chunks early can take more
+    #
+    CHUNKS_PER_WORKER = 4
+
+    # These are user settings, like the debugging level
+    CONTEXT_ATTRS = ('WORKERS', 'MIN_PARALLEL_STATEMENTS')
+    CONTEXT_INHERIT = CONTEXT_ATTRS
+
     def __init__(self, importer, allocated_qregs):
 
         self.importer = importer
@@ -32,6 +62,13 @@ class SequenceExtractor(object):
         self.qbit_creates = list() # expressions that create Qubits
         self.sequence = []
 
+        # If the sequence was expanded and converted to source by
+        # a pool of workers, then this is the list of the source
+        # code for each element of the sequence (and self.sequence
+        # is empty).  Otherwise it is None.
+        #
+        self.sequence_source = None
+
         # the imports we need to make in order to satisfy the stubs
         #
         # the key is the name of the module (i.e. something like
@@ -233,40 +270,119 @@ class SequenceExtractor(object):
             stmnt = ast.parse("QBIT_{0} = QubitFactory('q{0}')".format(q))
             self.qbit_creates.append(stmnt)
 
-        lineNo = -1
-        while lineNo+1 < len(node.body):
-            lineNo += 1
-            # print("Line %d of %d" % (lineNo+1, len(node.body)))
-            stmnt = node.body[lineNo]
-            # print("Looking at stmnt %s" % stmnt)
-            if is_qbit_create(stmnt):
-                # drop it
-                continue
-
-            elif isinstance(stmnt, ast.Expr):
-                # expand calls on QRegisters into calls on Qubits
-                if (hasattr(stmnt, 'qgl2_type') and
-                        (stmnt.qgl2_type == 'stub' or stmnt.qgl2_type == 'measurement')):
-                    new_stmnts = self.expand_qreg_call(stmnt)
-                    self.sequence.extend(new_stmnts)
-                else:
-                    self.sequence.append(stmnt)
-            else:
-                NodeError.error_msg(stmnt,
-                                    'orphan statement %s' % ast.dump(stmnt))
+        # In explain mode, the output of each statement is recorded
+        # (see pyqgl2.explain), so the statements are always
+        # expanded here, rather than in a pool of workers
+        #
+        explain = ExplainState.EXPLAIN is not None
+
+        workers = SequenceExtractor.WORKERS
+        if (workers > 1 and not explain and
+                len(node.body) >= SequenceExtractor.MIN_PARALLEL_STATEMENTS):
+            self.sequence_source = self.expand_parallel(node.body, workers)
+            found = bool(self.sequence_source)
+        else:
+            for stmnt in node.body:
+                expanded = self.expand_statement(stmnt)
+                self.sequence.extend(expanded)
+                if explain and expanded:
+                    explain_output(stmnt, len(expanded),
+                            len(expanded) if self.is_pulse(stmnt) else 0)
+            found = bool(self.sequence)
 
         # print("Seqs: %s" % self.sequences)
-        if not self.sequence:
+        if not found:
             NodeError.warning_msg(node, "No qubit operations discovered")
             return False
 
         return True
 
-    def emit_function(self, func_name='qgl1_main', setup=None):
+    def is_pulse(self, stmnt):
+        '''
+        Returns True if the given statement of the main function
+        is a pulse (or measurement), rather than a control-flow
+        instruction
+        '''
+
+        return (isinstance(stmnt, ast.Expr) and
+                getattr(stmnt, 'qgl2_type', None) in ('stub', 'measurement') and
+                getattr(stmnt.value, 'qgl_return', None) != 'control')
+
+    def expand_statement(self, stmnt):
+        '''
+        Returns the list of statements (if any) to add to the
+        sequence for the given statement of the main function
+        '''
+
+        if is_qbit_create(stmnt):
+            # drop it
+            return []
+
+        elif isinstance(stmnt, ast.Expr):
+            # expand calls on QRegisters into calls on Qubits
+            if (hasattr(stmnt, 'qgl2_type') and
+                    (stmnt.qgl2_type == 'stub' or stmnt.qgl2_type == 'measurement')):
+                return self.expand_qreg_call(stmnt)
+            else:
+                return [stmnt]
+        else:
+            NodeError.error_msg(stmnt,
+                                'orphan statement %s' % ast.dump(stmnt))
+            return []
+
+    def expand_parallel(self, stmnts, workers):
+        '''
+        Expand the given statements, and convert the expanded
+        statements to source code, using a pool of worker processes.
+
+        Returns the list of the source code of the expanded
+        statements, in order.
+        '''
+
+        # Only the expressions become part of the sequence.
+        # Handle the other statements (the QRegister creations,
+        # which are dropped, and any orphans) here, rather than
+        # sending them to a worker
+        #
+        exprs = list()
+        for stmnt in stmnts:
+            if isinstance(stmnt, ast.Expr):
+                exprs.append(stmnt)
+            else:
+                self.expand_statement(stmnt)
+
+        n_chunks = workers * SequenceExtractor.CHUNKS_PER_WORKER
+        chunk_size = max(1, -(-len(exprs) // n_chunks))
+        chunks = [exprs[start:start + chunk_size]
+                for start in range(0, len(exprs), chunk_size)]
+
+        source = list()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(expand_chunk,
+                    [self.allocated_qregs] * len(chunks), chunks)
+
+            for chunk_source, messages, level, counts in results:
+                # Any messages were not printed by the worker,
+                # so emit them here, in order
+                #
+                for text in messages:
+                    NodeError._emit_msg(level, text)
+                source.extend(chunk_source)
+                add_counts(counts)
+
+        return source
+
+    def emit_function(self, func_name='qgl1_main', setup=None,
+            generator=False):
         """
         Create a function that, when run, creates the context
         in which the sequence is evaluated, and evaluate it.
 
+        If generator is True, then the function evaluates the
+        sequence lazily: it creates the context and then returns
+        a generator that yields each instruction of the sequence
+        as it is created.
+
         Assumes find_imports and find_sequences have already
         been called.
 
@@ -311,26 +427,71 @@ class SequenceExtractor(object):
             for setup_stmnt in setup:
                 preamble += indent + ('%s\n' % ast2str(setup_stmnt).strip())
 
-        sequence = [ast2str(item).strip() for item in self.sequence]
-
-        # TODO there must be a more elegant way to indent this properly
-        seq_str = indent + 'seq = [\n' + 2 * indent
-        seq_str += (',\n' + 2 * indent).join(sequence)
-        seq_str += '\n' + indent + ']\n'
+        # Keep the source of the sequence, in case the function
+        # is emitted again (as a generator)
+        #
+        if self.sequence_source is None:
+            self.sequence_source = [
+                    ast2str(item).strip() for item in self.sequence]
+        sequence = self.sequence_source
+
+        if generator:
+            seq_str = indent + 'def generate():\n'
+            seq_str += ''.join(
+                    2 * indent + 'yield %s\n' % item for item in sequence)
+            if not sequence:
+                # generate must still be a generator
+                seq_str += 2 * indent + 'yield from ()\n'
+
+            postamble = indent + 'return generate()\n'
+        else:
+            # TODO there must be a more elegant way to indent this properly
+            seq_str = indent + 'seq = [\n' + 2 * indent
+            seq_str += (',\n' + 2 * indent).join(sequence)
+            seq_str += '\n' + indent + ']\n'
 
-        postamble = indent + 'return seq\n'
+            postamble = indent + 'return seq\n'
 
         res =  preamble + seq_str + postamble
         return res
 
+def expand_chunk(allocated_qregs, stmnts):
+    '''
+    Worker for SequenceExtractor.expand_parallel: expand the given
+    statements over the given QRegisters, and convert each of the
+    expanded statements to source code.
+
+    Returns the list of source code, along with the messages
+    created while expanding the statements (which are not printed)
+    and their highest level, and the hot-path counts of the worker.
+    Expanding statements only creates errors, so each of the
+    messages is treated as an error.
+    '''
+
+    with CompileContext(inherit=False):
+        NodeError.LAST_N = sys.maxsize
+        NodeError.MUTE_ERR_LEVEL = NodeError.NODE_ERROR_FATAL + 1
+
+        extractor = SequenceExtractor(None, allocated_qregs)
+        source = list()
+        for stmnt in stmnts:
+            for new_stmnt in extractor.expand_statement(stmnt):
+                source.append(ast2str(new_stmnt).strip())
+
+        return (source, NodeError.last_msgs(), NodeError.MAX_ERR_LEVEL,
+                get_counts())
+
 def get_sequence_function(node, func_name, importer, allocated_qregs,
         intermediate_fout=None, saveOutput=False, filename=None,
-        setup=None):
+        setup=None, output_suffix=''):
     """
     Create a function that encapsulates the QGL code
     from the given AST node, which is presumed to already
     be fully pre-processed.
 
+    If saveOutput is True, the code is saved in a file named
+    after filename, with the given output_suffix, if any.
+
     TODO: we don't test that the node is fully pre-processed.
     TODO: each step of the preprocessor should mark the nodes
     so that we know whether or not they've been processed.
@@ -345,17 +506,51 @@ def get_sequence_function(node, func_name, importer, allocated_qregs,
         print(('#start function\n%s\n#end function' % code),
               file=intermediate_fout, flush=True)
     if saveOutput and filename:
-        newf = os.path.abspath(filename[:-3] + "qgl1.py")
+        newf = os.path.abspath(filename[:-3] + output_suffix + "qgl1.py")
         with open(newf, 'w') as compiledFile:
             compiledFile.write(code)
         print("Saved compiled code to %s" % newf)
 
     NodeError.diag_msg(
-            node, 'generated code:\n#start\n%s\n#end code' % code)
+            node, lambda: 'generated code:\n#start\n%s\n#end code' % code)
 
     # TODO: we might want to pass in elements of the local scope
     scratch_scope = dict()
     eval(compile(code, '<none>', mode='exec'), globals(), scratch_scope)
     NodeError.halt_on_error()
 
-    return scratch_scope[func_name]
+    # Keep the source, so the function can be recreated elsewhere
+    # (see pyqgl2.compile_pool)
+    qgl1_main = scratch_scope[func_name]
+    qgl1_main.qgl_source = code
+
+    # Keep the source of the generator form of the function too,
+    # but don't compile it unless it's used (see get_generator_function)
+    qgl1_main.qgl_generator_source = builder.emit_function(
+            func_name, setup, generator=True)
+
+    return qgl1_main
+
+def get_generator_function(qgl1_main):
+    """
+    Return the generator form of the given function (created
+    by get_sequence_function): a function that creates the same
+    context as qgl1_main, and then returns a generator that
+    yields each instruction of the sequence as it is created,
+    rather than creating all of them before returning any.
+
+    Returns None if the source of the generator form was not
+    kept (if qgl1_main was recreated from its qgl_source).
+    """
+
+    if not hasattr(qgl1_main, 'qgl_generator'):
+        code = getattr(qgl1_main, 'qgl_generator_source', None)
+        if code is None:
+            qgl1_main.qgl_generator = None
+        else:
+            scratch_scope = dict()
+            eval(compile(code, '<none>', mode='exec'), globals(),
+                    scratch_scope)
+            qgl1_main.qgl_generator = scratch_scope[qgl1_main.__name__]
+
+    return qgl1_main.qgl_generator
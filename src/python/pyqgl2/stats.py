@@ -0,0 +1,265 @@
+# Copyright 2016 by Raytheon BBN Technologies Corp.  All Rights Reserved.
+
+"""
+Per-stage statistics for a compilation
+
+If compile_function is given a CompileStats, then it records, for
+each stage of the compilation (the importer, each iteration of the
+inliner, the evaluator, replace_bindings, the flattener, and the
+sequence extractor), the wall time and CPU time of the stage, and the
+number of AST nodes and statements in the qgl2main before and after
+the stage.  Each call of the resulting QGL1 function is recorded as
+an 'exec' stage.  The hot-path counts of the compilation (see
+pyqgl2.counters) are also added to the CompileStats.
+
+If the CompileStats is created with track_memory=True, then it also
+records the peak memory allocated by each stage (as measured by
+tracemalloc).  Tracing memory allocations makes the compiler much
+slower, so this is not done by default.
+
+The stages use stats_stage to create their records.  If there is
+no CompileStats in the active CompileContext, stats_stage returns
+a record that does nothing (and does not count any nodes).
+"""
+
+import ast
+import json
+import time
+import tracemalloc
+
+from pyqgl2.context import ContextState
+from pyqgl2.counters import format_counts
+
+
+def count_nodes(ptree):
+    """
+    Return the number of nodes, and the number of statements,
+    in the given AST
+    """
+
+    nodes = 0
+    statements = 0
+    for node in ast.walk(ptree):
+        nodes += 1
+        if isinstance(node, ast.stmt):
+            statements += 1
+
+    return nodes, statements
+
+
+class StageStats(object):
+    """
+    The statistics for one stage of a compilation
+
+    The times are in seconds, and memory_peak is in bytes
+    (or None, if memory is not tracked).  The node and statement
+    counts are None if the stage doesn't have an input or
+    output AST.
+    """
+
+    FIELDS = ('stage', 'iteration', 'wall_time', 'cpu_time', 'memory_peak',
+            'nodes_in', 'nodes_out', 'statements_in', 'statements_out')
+
+    def __init__(self, stage, iteration=None):
+        self.stage = stage
+        self.iteration = iteration
+
+        self.wall_time = None
+        self.cpu_time = None
+        self.memory_peak = None
+
+        self.nodes_in = None
+        self.nodes_out = None
+        self.statements_in = None
+        self.statements_out = None
+
+    def __repr__(self):
+        return '<StageStats %s>' % str(self.to_dict())
+
+    def set_input(self, ptree):
+        if ptree is not None:
+            self.nodes_in, self.statements_in = count_nodes(ptree)
+
+    def set_output(self, ptree):
+        """
+        Record ptree as the AST created by this stage
+        """
+
+        if ptree is not None:
+            self.nodes_out, self.statements_out = count_nodes(ptree)
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in StageStats.FIELDS}
+
+
+class _NullStage(object):
+    """
+    The stage record used when statistics are not being collected
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set_output(self, ptree):
+        pass
+
+NULL_STAGE = _NullStage()
+
+
+class _StageTimer(object):
+    """
+    Context manager that measures one stage, and adds
+    its StageStats to a CompileStats when it is done
+    """
+
+    def __init__(self, stats, record):
+        self.stats = stats
+        self.record = record
+
+    def __enter__(self):
+        if self.stats.track_memory:
+            # The peak can only be reset (in Python 3.7) by
+            # discarding the traces, so the peak is the peak of
+            # the blocks allocated since the start of the stage
+            tracemalloc.clear_traces()
+
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        return self.record
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.record.wall_time = time.perf_counter() - self.start_wall
+        self.record.cpu_time = time.process_time() - self.start_cpu
+
+        if self.stats.track_memory:
+            self.record.memory_peak = tracemalloc.get_traced_memory()[1]
+
+        self.stats.stages.append(self.record)
+        return False
+
+
+class CompileStats(object):
+    """
+    The statistics for each stage of a compilation, in order
+    (see StageStats)
+    """
+
+    def __init__(self, track_memory=False):
+        self.track_memory = track_memory
+        self.stages = list()
+        self.counts = dict()
+
+    def stage(self, stage, ptree=None, iteration=None):
+        """
+        Return a context manager that measures the given stage.
+        The context manager returns the StageStats for the stage;
+        call its set_output method to record the AST created
+        by the stage.  ptree is the input to the stage.
+        """
+
+        if self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+        record = StageStats(stage, iteration)
+        record.set_input(ptree)
+
+        return _StageTimer(self, record)
+
+    def add_counts(self, counts):
+        """
+        Add the given hot-path counts to the counts for
+        this compilation
+        """
+
+        for name, value in counts.items():
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def stop(self):
+        """
+        Stop tracing memory, if it was started for these statistics
+        """
+
+        if self.track_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def total(self, field):
+        """
+        Return the total of the given field (such as 'wall_time')
+        over all of the stages
+        """
+
+        return sum(getattr(record, field) or 0 for record in self.stages)
+
+    def to_dict(self):
+        return {
+                'stages': [record.to_dict() for record in self.stages],
+                'wall_time': self.total('wall_time'),
+                'cpu_time': self.total('cpu_time'),
+                'memory_peak': (max(record.memory_peak or 0
+                        for record in self.stages)
+                    if self.track_memory and self.stages else None),
+                'counts': self.counts
+            }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def format_table(self):
+        """
+        Return a human-readable table of the statistics
+        """
+
+        lines = ['%-18s %9s %9s %10s %9s %9s' %
+                ('stage', 'wall(s)', 'cpu(s)', 'peak(KB)', 'stmnts', 'nodes')]
+
+        for record in self.stages:
+            name = record.stage
+            if record.iteration is not None:
+                name += ' %d' % record.iteration
+
+            peak = ('%10d' % (record.memory_peak // 1024)
+                    if record.memory_peak is not None else '%10s' % '-')
+            stmnts = ('%9d' % record.statements_out
+                    if record.statements_out is not None else '%9s' % '-')
+            nodes = ('%9d' % record.nodes_out
+                    if record.nodes_out is not None else '%9s' % '-')
+
+            lines.append('%-18s %9.3f %9.3f %s %s %s' %
+                    (name, record.wall_time, record.cpu_time,
+                        peak, stmnts, nodes))
+
+        lines.append('%-18s %9.3f %9.3f' %
+                ('total', self.total('wall_time'), self.total('cpu_time')))
+
+        if self.counts:
+            lines.append('')
+            lines.append(format_counts(self.counts))
+
+        return '\n'.join(lines)
+
+
+class StatsState(object, metaclass=ContextState):
+    """
+    The CompileStats (if any) of the active CompileContext
+    """
+
+    STATS = None
+
+    CONTEXT_ATTRS = ('STATS',)
+
+
+def stats_stage(stage, ptree=None, iteration=None):
+    """
+    Return a context manager that measures the given stage, if the
+    active CompileContext is collecting statistics, or one that does
+    nothing otherwise.  See CompileStats.stage.
+    """
+
+    stats = StatsState.STATS
+    if stats is None:
+        return NULL_STAGE
+
+    return stats.stage(stage, ptree, iteration)
@@ -88,11 +88,15 @@ def save_in_library(channels, new=False, libName=":memory:"):
 # FIXME: Put in separate file for cleanliness?
 # Control whether cr2/q3 are included?
 # doHW: Should we assign to specific APS devices?
-def create_default_channelLibrary(doHW=False, new=False, clName=":memory:"):
+def create_default_channelLibrary(doHW=False, new=False, clName=":memory:", numQubits=3):
     '''
     Create a default ChannelLibrary for testing / constructing sequences.
     Contains 3 qubits ('q1','q2','q3'), with a bidirectional edge between q1 and q2 ('cr' and 'cr2'),
     including physical channel assignments if doHw=True (default false).
+    If numQubits is more than 3, also contains qubits 'q4' ... 'q<numQubits>',
+    with an edge ('cr-qI-qJ') between every other pair of qubits
+    (for benchmarks that need many connected qubits).
+    The extra qubits and edges are not assigned to physical channels.
     Saves the CL in the named library (default in memory).
     If new=True, clears that library of any previous channels.
     Available afterwards as QGL.ChannelLibraries.channelLib
@@ -104,7 +108,7 @@ def create_default_channelLibrary(doHW=False, new=False, clName=":memory:"):
     import os
     channels = {}
     # assign_channels()
-    qubit_names = ['q1', 'q2', 'q3']
+    qubit_names = ['q%d' % num for num in range(1, max(3, numQubits) + 1)]
     logical_names = ['digitizerTrig', 'slave_trig']
     
     # assign_logical_channels()
@@ -173,6 +177,22 @@ def create_default_channelLibrary(doHW=False, new=False, clName=":memory:"):
     channels['M-q2q1-gate']  = mq2q1g
     channels['M-q2q1']       = Measurement(label='M-q2q1', gate_chan = mq2q1g, trig_chan=channels['digitizerTrig'], meas_type='autodyne')
     
+    # Edges between every other pair of qubits, if there are extra qubits
+    if numQubits > 3:
+        for num1 in range(1, numQubits + 1):
+            for num2 in range(num1 + 1, numQubits + 1):
+                if (num1, num2) == (1, 2):
+                    continue
+                eName = 'cr-q%d-q%d' % (num1, num2)
+                channels[eName + '-gate'] = LogicalMarkerChannel(label=eName + '-gate')
+                edge = Edge(label=eName,
+                            source=channels['q%d' % num1],
+                            target=channels['q%d' % num2],
+                            gate_chan=channels[eName + '-gate'])
+                edge.pulse_params['length'] = 30e-9
+                edge.pulse_params['phase'] = pi / 4
+                channels[eName] = edge
+
     if (doHW):
         # finalizeMapping() for APS2; assign physical channels
         # NOTE: APS7-10 added to support q3 and cr2
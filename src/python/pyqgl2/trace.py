@@ -0,0 +1,224 @@
+# Copyright 2016 by Raytheon BBN Technologies Corp.  All Rights Reserved.
+
+"""
+Tracing the passes of the compiler
+
+Each pass of the compiler runs inside a trace span:
+
+    NameSpaces: processing the imports, and finding the qgl2main
+    inline_callees: inlining the functions called by the qgl2main
+    Inliner: each iteration of the inliner
+    EvalTransformer.visit: the evaluator
+    replace_bindings: replacing the bindings found by the evaluator
+    Flattener.visit: the flattener
+    get_sequence_function: the sequence extractor
+
+and within these, there are nested spans for each call that is
+inlined ('inline NAME'), each function that is pre-inlined by
+inline_callees ('inline_function NAME'), and each loop that is
+unrolled by the evaluator ('for' or 'while', with the location of
+the loop and the number of iterations).
+
+If any trace hooks have been added to the active CompileContext
+(with add_trace_hook), then each hook's before method is called
+with a TraceSpan at the start of each span, and its after method
+is called with the same TraceSpan at the end.  Spans nest properly:
+the after of an inner span is always called before the after of
+the span that contains it.
+
+If there are no hooks, trace_span returns a span that does nothing.
+
+ChromeTrace is a hook that records the spans as trace events,
+in the JSON format used by chrome://tracing and Perfetto
+(https://ui.perfetto.dev).  Note that the work done in the worker
+processes of the sequence extractor (see SequenceExtractor.WORKERS)
+is not traced.
+"""
+
+import json
+import os
+import threading
+import time
+
+from pyqgl2.context import ContextState
+
+
+class TraceSpan(object):
+    """
+    A span of the compilation.  name is the name of the span,
+    category is the kind of span ('pass', 'inline', or 'unroll'),
+    and args is a dictionary of details (such as the location
+    of the loop being unrolled).  Use set_arg to add details
+    that are not known until the span ends.
+    """
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __repr__(self):
+        return '<TraceSpan %s %s %s>' % (self.category, self.name, self.args)
+
+    def set_arg(self, name, value):
+        self.args[name] = value
+
+
+class TraceHook(object):
+    """
+    Base class for trace hooks; subclasses override
+    before and/or after
+    """
+
+    def before(self, span):
+        pass
+
+    def after(self, span):
+        pass
+
+
+class TraceHooks(object, metaclass=ContextState):
+    """
+    The trace hooks of the active CompileContext
+    """
+
+    HOOKS = list()
+
+    CONTEXT_ATTRS = ('HOOKS',)
+
+
+def add_trace_hook(hook):
+    """
+    Add a hook (a TraceHook) to the active CompileContext
+    """
+
+    TraceHooks.HOOKS.append(hook)
+
+
+def remove_trace_hook(hook):
+    """
+    Remove a hook from the active CompileContext
+    """
+
+    TraceHooks.HOOKS.remove(hook)
+
+
+class _NullSpan(object):
+    """
+    The span used when there are no hooks
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set_arg(self, name, value):
+        pass
+
+NULL_SPAN = _NullSpan()
+
+
+class _ActiveSpan(object):
+    """
+    Context manager that calls the hooks at the start
+    and end of a span
+    """
+
+    def __init__(self, hooks, span):
+        self.hooks = hooks
+        self.span = span
+
+    def __enter__(self):
+        for hook in self.hooks:
+            hook.before(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # The hooks end the span in the reverse order,
+        # so that each hook sees properly nested spans
+        for hook in reversed(self.hooks):
+            hook.after(self.span)
+        return False
+
+
+def trace_span(name, category='pass', node=None, **args):
+    """
+    Return a context manager for a span with the given name,
+    category, and args.  If node is given, then its location is
+    added to the args.  The context manager returns the TraceSpan
+    (see TraceSpan.set_arg).
+
+    If there are no hooks in the active CompileContext, then the
+    context manager does nothing.
+    """
+
+    hooks = TraceHooks.HOOKS
+    if not hooks:
+        return NULL_SPAN
+
+    if node is not None and hasattr(node, 'qgl_fname'):
+        args['file'] = node.qgl_fname
+        args['line'] = getattr(node, 'lineno', 0)
+
+    return _ActiveSpan(list(hooks), TraceSpan(name, category, args))
+
+
+class ChromeTrace(TraceHook):
+    """
+    A TraceHook that records each span as a pair of trace events,
+    in the Trace Event Format used by chrome://tracing and Perfetto
+
+    Use write(path) to save the events as a JSON file that can
+    be loaded into the trace viewer.
+    """
+
+    def __init__(self):
+        self.events = list()
+        self.pid = os.getpid()
+        self.start_time = time.perf_counter()
+
+    def timestamp(self):
+        """
+        Return the current time, in microseconds since the trace began
+        """
+
+        return (time.perf_counter() - self.start_time) * 1e6
+
+    def event(self, phase, span):
+        return {
+                'name': span.name,
+                'cat': span.category,
+                'ph': phase,
+                'ts': self.timestamp(),
+                'pid': self.pid,
+                'tid': threading.get_ident()
+            }
+
+    def before(self, span):
+        self.events.append(self.event('B', span))
+
+    def after(self, span):
+        event = self.event('E', span)
+
+        # The args are added to the end event, because
+        # some of them are not known until the span ends
+        if span.args:
+            event['args'] = dict(span.args)
+
+        self.events.append(event)
+
+    def to_dict(self):
+        return {
+                'traceEvents': self.events,
+                'displayTimeUnit': 'ms'
+            }
+
+    def write(self, path):
+        """
+        Write the trace events to the given path, as JSON
+        """
+
+        with open(path, 'w') as fout:
+            json.dump(self.to_dict(), fout, default=str)
@@ -204,6 +204,7 @@ for c1, c2 in product(range(24), repeat=2):
 #         X90(q2)
 #         ZX90_CR(q2, q1)
 
+@memoize
 def entangling_mat(gate):
     """
     Helper function to create the entangling gate matrix
@@ -268,19 +269,527 @@ def clifford_mat(c, numQubits):
 
 
 def inverse_clifford(cMat):
+    """
+    Return the index of the Clifford that inverts the given Clifford
+    matrix (up to a global phase)
+
+    The inverse of a unitary is its conjugate transpose, so this
+    looks up the index of the conjugate transpose by its key (see
+    clifford_key), instead of searching all the Cliffords for the
+    one whose product with cMat is the identity.  The search is
+    only done if the lookup fails.
+    """
     dim = cMat.shape[0]
-    if dim == 2:
-        for ct in range(24):
-            if np.isclose(
-                    np.abs(np.dot(cMat, clifford_mat(ct, 1)).trace()), dim):
-                return ct
-    elif dim == 4:
-        for ct in range(len(C2Seqs)):
-            if np.isclose(
-                    np.abs(np.dot(cMat, clifford_mat(ct, 2)).trace()), dim):
-                return ct
+    if dim not in (2, 4):
+        raise Exception("Expected 2 or 4 qubit dimensional matrix.")
+
+    numQubits = 1 if dim == 2 else 2
+    adjoint = np.asarray(cMat).conj().T
+    inverse = clifford_index_table(numQubits).get(clifford_key(adjoint))
+    if inverse is None:
+        inverse = clifford_index_scan(adjoint)
+
+    # If we didn't find it, something is wrong
+    if inverse is None:
+        raise Exception("Couldn't find inverse clifford")
+    return inverse
+
+
+# Table-driven Clifford arithmetic
+#
+# RB only needs the index of the product of a sequence of Cliffords
+# (and the index of its inverse), not the matrices themselves, so
+# instead of multiplying matrices and then searching for the inverse,
+# these functions use tables built once per number of qubits:
+#
+#   clifford_index_table: the index of each Clifford, keyed by
+#       a canonical form of its matrix (see clifford_key)
+#   clifford_mult_table: the index of each product of two single
+#       qubit Cliffords (the two qubit table would have 11520**2
+#       entries, so products of two qubit Cliffords are computed
+#       as matrices, and then looked up in the index table)
+#   clifford_inverse_table: the index of the inverse of each Clifford
+
+# Clifford matrices are only equal up to a global phase, and products
+# of them are only equal up to rounding error (or noise), so the keys
+# are not made from the elements themselves.  Once the global phase is
+# fixed (see clifford_key), the real and imaginary parts of each element
+# of a one or two qubit Clifford are all r * cos(k * pi / 4), for r in
+# 1, 1/sqrt(2), or 1/2, which are CLIFFORD_PARTS.  Each part is snapped
+# to the nearest of these, and the key is made from their positions.
+# The closest of them are about 0.15 apart, so a lot of noise is needed
+# to snap a part to the wrong value.
+CLIFFORD_PARTS = np.unique(np.round(
+        [r * np.cos(k * pi / 4) for r in (1, 1 / np.sqrt(2), 0.5)
+            for k in range(8)], 12))
+
+# If any part of a matrix is further than this from all of the
+# CLIFFORD_PARTS, then the matrix is not a Clifford (and has no key)
+CLIFFORD_KEY_TOLERANCE = 1e-3
+
+
+def clifford_key(mat):
+    """
+    Return a canonical key for the given Clifford matrix, which
+    is the same for any matrix that is equal to it up to a global
+    phase (and rounding error), or None if the matrix is not a
+    Clifford
+
+    The phase is fixed by making the first element whose magnitude
+    is not (nearly) zero real and positive.
+    """
+
+    return clifford_keys(np.asarray(mat)[np.newaxis])[0]
+
+
+def clifford_keys(mats):
+    """
+    Return the clifford_key of each matrix in the given
+    array of matrices (of shape (n, dim, dim))
+    """
+
+    flat = np.asarray(mats, dtype=np.complex128).reshape(len(mats), -1)
+    pivots = flat[np.arange(len(flat)), np.argmax(np.abs(flat) > 0.25, axis=1)]
+
+    normalized = flat * (np.abs(pivots) / pivots)[:, np.newaxis]
+    parts = np.concatenate((normalized.real, normalized.imag), axis=1)
+
+    distances = np.abs(parts[:, :, np.newaxis] - CLIFFORD_PARTS)
+    positions = np.argmin(distances, axis=2).astype(np.int8)
+    errors = np.max(np.min(distances, axis=2), axis=1)
+
+    return [row.tobytes() if error <= CLIFFORD_KEY_TOLERANCE else None
+            for row, error in zip(positions, errors)]
+
+
+def clifford_group_size(numQubits):
+    assert numQubits <= 2, "Oops! I only handle one or two qubits"
+    if numQubits == 1:
+        return len(C1)
+    else:
+        return len(C2Seqs)
+
+
+@memoize
+def clifford_index_table(numQubits):
+    """
+    Return a dict that maps the clifford_key of each Clifford
+    on the given number of qubits to its index
+    """
+
+    return dict((clifford_key(clifford_mat(c, numQubits)), c)
+            for c in range(clifford_group_size(numQubits)))
+
+
+def clifford_index(mat):
+    """
+    Return the index of the given Clifford matrix
+
+    If the matrix has no key in the index table (for example, if it
+    is too noisy to snap to a Clifford), then fall back to searching
+    all of the Cliffords for the one that is closest to it (see
+    clifford_index_scan).
+    """
+
+    numQubits = 1 if mat.shape[0] == 2 else 2
+    index = clifford_index_table(numQubits).get(clifford_key(mat))
+    if index is None:
+        index = clifford_index_scan(mat)
+
+    if index is None:
+        raise Exception("Matrix is not a Clifford")
+    return index
+
+
+def clifford_index_scan(mat):
+    """
+    Return the index of the Clifford that is equal to the given
+    matrix (up to a global phase), by searching all of the Cliffords,
+    or None if there is no such Clifford
+    """
+
+    dim = mat.shape[0]
+    numQubits = 1 if dim == 2 else 2
+    for ct in range(clifford_group_size(numQubits)):
+        if np.isclose(np.abs(np.dot(
+                clifford_mat(ct, numQubits).conj().T, mat).trace()), dim):
+            return ct
+    return None
+
+
+@memoize
+def clifford_mult_table(numQubits):
+    """
+    Return the multiplication table for the single qubit Cliffords,
+    as an array where table[c1, c2] is the index of the product of
+    c1 and c2, where c1 is applied first (i.e. C[c2] * C[c1])
+    """
+
+    assert numQubits == 1, "Only single qubit Cliffords have a table"
+
+    size = clifford_group_size(numQubits)
+    table = np.zeros((size, size), dtype=np.int64)
+    for c1, c2 in product(range(size), repeat=2):
+        table[c1, c2] = clifford_index(
+                np.dot(clifford_mat(c2, numQubits), clifford_mat(c1, numQubits)))
+    return table
+
+
+@memoize
+def clifford_inverse_table(numQubits):
+    """
+    Return an array of the index of the inverse of each
+    Clifford on the given number of qubits
+    """
+
+    return np.array([clifford_index(clifford_mat(c, numQubits).conj().T)
+            for c in range(clifford_group_size(numQubits))], dtype=np.int64)
+
+
+def clifford_multiply(c1, c2, numQubits):
+    """
+    Return the index of the product of the Cliffords c1 and c2,
+    where c1 is applied first (i.e. C[c2] * C[c1])
+    """
+
+    if numQubits == 1:
+        return int(clifford_mult_table(1)[c1, c2])
+    else:
+        return clifford_index(np.dot(
+                clifford_mat(c2, numQubits), clifford_mat(c1, numQubits)))
+
+
+def clifford_product(seq, numQubits):
+    """
+    Return the index of the product of the given sequence of
+    Cliffords, where the first Clifford is applied first
+    """
+
+    if numQubits == 1:
+        table = clifford_mult_table(1)
+        total = 0
+        for c in seq:
+            total = table[total, c]
+        return int(total)
     else:
+        mat = reduce(lambda x, y: np.dot(y, x),
+                [clifford_mat(c, numQubits) for c in seq],
+                np.eye(2 ** numQubits, dtype=np.complex128))
+        return clifford_index(mat)
+
+
+def recovery_clifford(seq, numQubits):
+    """
+    Return the index of the Clifford that inverts the given
+    sequence of Cliffords (the RB recovery gate)
+    """
+
+    return int(clifford_inverse_table(numQubits)[
+            clifford_product(seq, numQubits)])
+
+
+# Batched Clifford arithmetic
+#
+# These compute the recovery gates of many sequences at once, from
+# their matrices, with numpy operations over the whole batch instead
+# of a Python loop over each sequence.  They don't need the gates
+# to be Cliffords (only the products), so they also work when some
+# of the gates are given as matrices instead of as Clifford indices.
+
+@memoize
+def clifford_mats(numQubits):
+    """
+    Return an array of the matrices of all the Cliffords on the
+    given number of qubits, of shape (size, dim, dim)
+    """
+
+    return np.array([clifford_mat(c, numQubits)
+            for c in range(clifford_group_size(numQubits))])
+
+
+def multiply_mats(mats):
+    """
+    Given an array of shape (n, length, dim, dim), of n sequences
+    of matrices, return an array of shape (n, dim, dim) of the
+    product of each sequence, where the first matrix is applied
+    first (i.e. mats[:, -1] * ... * mats[:, 0])
+
+    The products are computed pairwise, so there are only
+    log2(length) batched multiplications.
+    """
+
+    mats = np.asarray(mats, dtype=np.complex128)
+    count, length, dim = mats.shape[:3]
+    if length == 0:
+        return np.tile(np.eye(dim, dtype=np.complex128), (count, 1, 1))
+
+    while mats.shape[1] > 1:
+        odd = mats[:, mats.shape[1] - 1:] if mats.shape[1] % 2 else None
+        mats = np.matmul(mats[:, 1::2], mats[:, 0:mats.shape[1] - 1:2])
+        if odd is not None:
+            mats = np.concatenate((mats, odd), axis=1)
+
+    return mats[:, 0]
+
+
+def inverse_cliffords(mats):
+    """
+    Return an array of the index of the inverse of each Clifford
+    matrix in the given array (of shape (n, dim, dim)), like
+    inverse_clifford
+    """
+
+    mats = np.asarray(mats)
+    if mats.shape[1] not in (2, 4):
         raise Exception("Expected 2 or 4 qubit dimensional matrix.")
 
-    # If we got here something is wrong
-    raise Exception("Couldn't find inverse clifford")
+    table = clifford_index_table(1 if mats.shape[1] == 2 else 2)
+    adjoints = np.conj(np.swapaxes(mats, 1, 2))
+
+    inverses = list()
+    for key, adjoint in zip(clifford_keys(adjoints), adjoints):
+        inverse = table.get(key)
+        if inverse is None:
+            inverse = clifford_index_scan(adjoint)
+        if inverse is None:
+            raise Exception("Couldn't find inverse clifford")
+        inverses.append(inverse)
+
+    return np.array(inverses, dtype=np.int64)
+
+
+def recovery_cliffords(seqs, numQubits):
+    """
+    Return a list of the index of the recovery gate of each of
+    the given sequences of Cliffords, like recovery_clifford
+
+    The sequences are grouped by length, and the recovery gates
+    of each group are computed as a batch.
+    """
+
+    mats = clifford_mats(numQubits)
+
+    groups = dict()
+    for pos, seq in enumerate(seqs):
+        groups.setdefault(len(seq), list()).append(pos)
+
+    recovery = [None] * len(seqs)
+    for length, positions in groups.items():
+        indices = np.array([seqs[pos] for pos in positions],
+                dtype=np.int64).reshape(len(positions), length)
+        inverses = inverse_cliffords(multiply_mats(mats[indices]))
+        for pos, inverse in zip(positions, inverses):
+            recovery[pos] = int(inverse)
+
+    return recovery
+
+
+# Symplectic tableaux
+#
+# A Clifford is determined (up to a global phase) by how it maps
+# Paulis to Paulis under conjugation (P -> U P U^dagger), and so by
+# the images of the generators X_0 .. X_n-1, Z_0 .. Z_n-1.  A tableau
+# is a tuple of these 2n images, first the Xs, then the Zs, where each
+# image is a Pauli, represented (exactly) as a tuple of ints (x, z, k)
+# for the Pauli i**k * X**x * Z**z: bit j of x (or z) is set if
+# there is an X (or Z) on qubit j, which is the j'th factor of the
+# matrix (so qubit 0 is the leftmost factor of np.kron).  For example,
+# Y on qubit 0 is (1, 1, 1), because Y = i * X * Z.
+#
+# Unlike the matrices, tableaux can be composed and inverted exactly,
+# with integer arithmetic, and the same functions work for any number
+# of qubits.  Tableaux are tuples, so they can be used as dict keys.
+
+def pauli_multiply(p1, p2):
+    """
+    Return the product of the two given Paulis (p1 * p2)
+    """
+
+    x1, z1, k1 = p1
+    x2, z2, k2 = p2
+
+    # Moving the Zs of p1 past the Xs of p2 gives a -1
+    # for each qubit where they anticommute
+    k = k1 + k2 + 2 * bin(z1 & x2).count('1')
+    return (x1 ^ x2, z1 ^ z2, k % 4)
+
+
+def tableau_identity(numQubits):
+    """
+    Return the tableau of the identity on the given number of qubits
+    """
+
+    return (tuple((1 << j, 0, 0) for j in range(numQubits)) +
+            tuple((0, 1 << j, 0) for j in range(numQubits)))
+
+
+def tableau_apply(tableau, pauli):
+    """
+    Return the image of the given Pauli under the Clifford
+    with the given tableau
+    """
+
+    numQubits = len(tableau) // 2
+    x, z, k = pauli
+
+    image = (0, 0, k)
+    for j in range(numQubits):
+        if (x >> j) & 1:
+            image = pauli_multiply(image, tableau[j])
+    for j in range(numQubits):
+        if (z >> j) & 1:
+            image = pauli_multiply(image, tableau[numQubits + j])
+    return image
+
+
+def tableau_compose(tableau1, tableau2):
+    """
+    Return the tableau of the product of the Cliffords with the
+    given tableaux, where tableau1 is applied first
+    (i.e. C2 * C1, like clifford_multiply)
+    """
+
+    return tuple(tableau_apply(tableau2, image) for image in tableau1)
+
+
+def tableau_inverse(tableau):
+    """
+    Return the tableau of the inverse of the given Clifford
+    """
+
+    numQubits = len(tableau) // 2
+
+    def bit(row, col):
+        x, z, _ = tableau[row]
+        if col < numQubits:
+            return (x >> col) & 1
+        return (z >> (col - numQubits)) & 1
+
+    # The matrix of the x and z bits is symplectic, so its inverse
+    # is its transpose, with the X and Z halves swapped.  This gives
+    # the inverse up to the signs of the images.
+    inverse = list()
+    for row in range(2 * numQubits):
+        swapped = (row + numQubits) % (2 * numQubits)
+        x = sum(bit(numQubits + j, swapped) << j for j in range(numQubits))
+        z = sum(bit(j, swapped) << j for j in range(numQubits))
+        inverse.append((x, z, bin(x & z).count('1') % 2))
+    inverse = tuple(inverse)
+
+    # The product maps each generator to plus or minus itself,
+    # which is the tableau of a Pauli; applying it again after
+    # the inverse cancels the signs
+    return tableau_compose(inverse, tableau_compose(tableau, inverse))
+
+
+def pauli_mat(pauli, numQubits):
+    """
+    Return the matrix of the given Pauli
+    """
+
+    x, z, k = pauli
+
+    factors = [np.dot(np.linalg.matrix_power(pX, (x >> j) & 1),
+                np.linalg.matrix_power(pZ, (z >> j) & 1))
+            for j in range(numQubits)]
+    return (1j ** k) * reduce(np.kron, factors)
+
+
+def tableaux_from_mats(mats):
+    """
+    Return a list of the tableaux of the Cliffords with the given
+    matrices (an array of shape (n, dim, dim))
+    """
+
+    mats = np.asarray(mats, dtype=np.complex128)
+    dim = mats.shape[1]
+    numQubits = dim.bit_length() - 1
+
+    paulis = [(x, z, 0) for x in range(dim) for z in range(dim)]
+    pauli_mats = np.array([pauli_mat(pauli, numQubits) for pauli in paulis])
+
+    adjoints = np.conj(np.swapaxes(mats, 1, 2))
+    columns = list()
+    for generator in tableau_identity(numQubits):
+        images = np.matmul(np.matmul(mats, pauli_mat(generator, numQubits)),
+                adjoints)
+
+        # The coefficient of each Pauli in each image: one of them
+        # is a power of i, and the rest are zero
+        coefficients = np.einsum('pab,nab->np',
+                np.conj(pauli_mats), images) / dim
+        best = np.argmax(np.abs(coefficients), axis=1)
+        phases = np.angle(coefficients[np.arange(len(mats)), best])
+        powers = np.round(phases / (pi / 2)).astype(np.int64) % 4
+
+        columns.append([(paulis[p][0], paulis[p][1], int(k))
+                for p, k in zip(best, powers)])
+
+    return [tuple(images) for images in zip(*columns)]
+
+
+def tableau_from_mat(mat):
+    """
+    Return the tableau of the Clifford with the given matrix
+    """
+
+    return tableaux_from_mats(np.asarray(mat)[np.newaxis])[0]
+
+
+@memoize
+def clifford_tableaux(numQubits):
+    """
+    Return a list of the tableau of each Clifford on the
+    given number of qubits, in the order of their indices
+    """
+
+    return tableaux_from_mats(clifford_mats(numQubits))
+
+
+@memoize
+def tableau_index_table(numQubits):
+    """
+    Return a dict that maps the tableau of each Clifford
+    on the given number of qubits to its index
+    """
+
+    return dict((tableau, c)
+            for c, tableau in enumerate(clifford_tableaux(numQubits)))
+
+
+def clifford_tableau(c, numQubits):
+    """
+    Return the tableau of the Clifford with the given index
+    """
+
+    return clifford_tableaux(numQubits)[c]
+
+
+def tableau_index(tableau):
+    """
+    Return the index of the Clifford with the given tableau
+    """
+
+    numQubits = len(tableau) // 2
+    if numQubits > 2:
+        raise Exception("Clifford indices only exist for one or two qubits")
+
+    try:
+        return tableau_index_table(numQubits)[tableau]
+    except KeyError:
+        raise Exception("No Clifford with the given tableau")
+
+
+def tableau_product(seq, numQubits):
+    """
+    Return the tableau of the product of the given sequence
+    of Cliffords (indices or tableaux), where the first
+    Clifford is applied first
+    """
+
+    total = tableau_identity(numQubits)
+    for c in seq:
+        if not isinstance(c, tuple):
+            c = clifford_tableau(c, numQubits)
+        total = tableau_compose(total, c)
+    return total
@@ -10,12 +10,13 @@ from qgl2.qgl1 import MEAS, Id, X, AC, clifford_seq, Y90m, X90
 # TODO: Redo more of Cliffords as QGL2. See issues 51-53 that make this hard.
 
 # from QGL.Cliffords import clifford_seq, clifford_mat, inverse_clifford
-from qgl2.Cliffords import clifford_mat, inverse_clifford
+from qgl2.Cliffords import recovery_clifford, recovery_cliffords
 
 from qgl2.basic_sequences.helpers import create_cal_seqs, measConcurrently, cal_descriptor, delay_descriptor
 
 from qgl2.util import init
 
+from concurrent.futures import ProcessPoolExecutor
 from csv import reader
 from functools import reduce
 import operator
@@ -23,6 +24,24 @@ import os
 
 import numpy as np
 
+def add_recovery_gates(seqs, numQubits):
+    """
+    Append the recovery gate to each of the given sequences
+
+    For one qubit, the recovery gates come from the Clifford
+    multiplication table, one sequence at a time (integer lookups
+    are faster than multiplying matrices); for two qubits, where
+    there is no multiplication table, the matrices of all the
+    sequences are multiplied and inverted as a batch.
+    """
+
+    if numQubits == 1:
+        for seq in seqs:
+            seq.append(recovery_clifford(seq, numQubits))
+    else:
+        for seq, gate in zip(seqs, recovery_cliffords(seqs, numQubits)):
+            seq.append(gate)
+
 # This is not pulses, just math; so this is just the original
 def create_RB_seqs(numQubits, lengths, repeats=32, interleaveGate=None, recovery=True):
     """
@@ -61,16 +80,116 @@ def create_RB_seqs(numQubits, lengths, repeats=32, interleaveGate=None, recovery
         seqs = newSeqs
 
     if recovery:
-        # Calculate the recovery gate
-        for seq in seqs:
-            if len(seq) == 1:
-                mat = clifford_mat(seq[0], numQubits)
-            else:
-                mat = reduce(lambda x,y: np.dot(y,x), [clifford_mat(c, numQubits) for c in seq])
-            seq.append(inverse_clifford(mat))
+        # Calculate the recovery gates
+        add_recovery_gates(seqs, numQubits)
 
     return seqs
 
+# The value used to pad the rows of the arrays created by
+# create_RB_seqs_parallel (which are not all the same length)
+RB_PAD = -1
+
+# The number of sequences in each chunk of create_RB_seqs_parallel.
+# The chunks (and their seeds) don't depend on the number of workers,
+# so neither does the output.
+RB_CHUNK_SIZE = 64
+
+def create_RB_seqs_chunk(numQubits, lengths, seed, width,
+        interleaveGate=None, recovery=True):
+    """
+    Worker for create_RB_seqs_parallel: create one sequence of
+    each of the given lengths, using a random generator created
+    from the given seed (a numpy SeedSequence), and return them
+    as the rows of an array of the given width, padded with RB_PAD.
+    """
+
+    cliffGroupSize = 24 if numQubits == 1 else 11520
+
+    rng = np.random.default_rng(seed)
+    rows = np.full((len(lengths), width), RB_PAD, dtype=np.int16)
+
+    seqs = []
+    for length in lengths:
+        # Subtract one from length for recovery gate
+        seq = rng.integers(0, cliffGroupSize, size=length-1)
+
+        # Possibly inject the interleaved gate
+        if interleaveGate:
+            seq = np.vstack((seq, interleaveGate * np.ones(
+                len(seq), dtype=np.int64))).flatten(order='F')
+
+        seqs.append(seq.tolist())
+
+    if recovery:
+        # Calculate the recovery gates
+        add_recovery_gates(seqs, numQubits)
+
+    for row, seq in zip(rows, seqs):
+        row[:len(seq)] = seq
+
+    return rows
+
+def create_RB_seqs_parallel(numQubits, lengths, repeats=32, interleaveGate=None,
+        recovery=True, seed=None, workers=None):
+    """
+    Like create_RB_seqs, but divides the work (mostly computing
+    the recovery gates) among a pool of worker processes, and returns
+    the sequences as a compact array of Clifford numbers instead of
+    a list of lists.
+
+    The sequences are divided into chunks of RB_CHUNK_SIZE sequences,
+    and each chunk uses its own random generator, seeded from the
+    given seed (an int, or None for a random seed) by a numpy
+    SeedSequence.  The output for a given seed is the same for any
+    number of workers (but differs from create_RB_seqs, which uses
+    the global numpy random state).
+
+    workers is the number of worker processes (by default, the
+    number of CPUs).  If workers is 1, no pool is used.
+
+    Returns an int16 array with one row for each sequence, in the
+    same order as create_RB_seqs.  Sequences shorter than the row
+    are padded with RB_PAD; use RB_seqs_to_lists to convert the
+    array to the list of lists that SingleQubitRB, etc, expect.
+    """
+
+    if numQubits not in (1, 2):
+        raise Exception("Can only handle one or two qubits.")
+
+    seq_lengths = [length for length in lengths for _ in range(repeats)]
+
+    width = max(lengths) - 1
+    if interleaveGate:
+        width *= 2
+    if recovery:
+        width += 1
+
+    chunks = [seq_lengths[start:start + RB_CHUNK_SIZE]
+            for start in range(0, len(seq_lengths), RB_CHUNK_SIZE)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+
+    args = [(numQubits, chunk, chunk_seed, width, interleaveGate, recovery)
+            for chunk, chunk_seed in zip(chunks, seeds)]
+
+    if workers == 1 or len(chunks) <= 1:
+        results = [create_RB_seqs_chunk(*arg) for arg in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(create_RB_seqs_chunk, *zip(*args)))
+
+    if not results:
+        return np.zeros((0, width), dtype=np.int16)
+
+    return np.vstack(results)
+
+def RB_seqs_to_lists(seqs):
+    """
+    Convert an array of sequences created by create_RB_seqs_parallel
+    to a list of lists of ints, like those created by create_RB_seqs
+    """
+
+    return [[int(c) for c in row if c != RB_PAD] for row in seqs]
+
 @qgl2decl
 def SingleQubitRB(qubit: qreg, seqs, purity=False, add_cals=True):
     """
@@ -0,0 +1,24 @@
+# Programs for test/test_budget.py
+
+from qgl2.qgl2 import qgl2decl, qreg
+from qgl2.qgl1 import X, Y, MEAS
+from qgl2.util import init
+
+@qgl2decl
+def pulses(q: qreg):
+    X(q)
+    Y(q)
+
+@qgl2decl
+def sweep(q: qreg, count):
+    for i in range(count):
+        init(q)
+        for j in range(3):
+            pulses(q)
+        MEAS(q)
+
+@qgl2decl
+def countdown(q: qreg, count):
+    while count > 0:
+        X(q)
+        count -= 1
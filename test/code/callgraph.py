@@ -0,0 +1,47 @@
+# Copyright 2016 by Raytheon BBN Technologies Corp.  All Rights Reserved.
+
+# Functions with a simple call graph, for testing the inliner:
+# main calls middle and leaf2, and middle calls leaf1 and leaf2.
+# middle, leaf2, and leaf3 are not QGL2 procedures (because they
+# contain return statements) so they can't be inlined into their
+# callers.  main2 also calls leaf3, which is independent of leaf2.
+# (The evaluator doesn't permit this, so this program can be
+# imported and inlined, but not compiled.)
+
+from qgl2.qgl2 import qgl2decl, qreg, QRegister
+from qgl2.qgl1 import X, Y
+
+@qgl2decl
+def leaf1(q: qreg):
+    X(q)
+
+@qgl2decl
+def leaf2(q: qreg):
+    Y(q)
+    return
+
+@qgl2decl
+def middle(q: qreg):
+    leaf1(q)
+    for i in range(2):
+        leaf2(q)
+    return
+
+@qgl2decl
+def main():
+    q = QRegister('q1')
+    middle(q)
+    leaf2(q)
+
+@qgl2decl
+def leaf3(q: qreg):
+    leaf1(q)
+    X(q)
+    return
+
+@qgl2decl
+def main2():
+    q = QRegister('q1')
+    middle(q)
+    leaf2(q)
+    leaf3(q)
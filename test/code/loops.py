@@ -1,6 +1,9 @@
 from qgl2.qgl2 import qgl2decl, qgl2main, qreg
 from qgl2.qgl2 import QRegister
-from qgl2.qgl1 import Id, X90, Y90, X, Y, MEAS
+from qgl2.qgl1 import Id, X90, Y90, X, Y, MEAS, Utheta
+
+from itertools import product
+from math import pi
 
 @qgl2decl
 def classical_continue():
@@ -48,3 +51,41 @@ def runtime_break():
             X90(q1)
             # this should produce an error
             break
+
+@qgl2decl
+def loop_invariant():
+    q1 = QRegister("q1")
+    lengths = [1e-7, 2e-7]
+
+    for ct in range(3):
+        # these do not depend on ct, and can be evaluated once
+        total = sum(lengths)
+        step = total / len(lengths)
+        Id(q1, length=step * (ct + 1))
+
+@qgl2decl
+def loop_variant():
+    q1 = QRegister("q1")
+    lengths = [1e-7]
+
+    for ct in range(3):
+        # lengths is reassigned within the loop, so this must be
+        # evaluated on every iteration
+        total = sum(lengths)
+        Id(q1, length=total)
+        lengths = lengths + [1e-7]
+
+@qgl2decl
+def loop_invariant_exprs():
+    q1 = QRegister("q1")
+    periods = 2
+
+    for ct in range(3):
+        # the QRegister, the iterable of the inner loop, and
+        # 2 * pi * periods do not depend on ct, and can be
+        # evaluated once
+        allChans = QRegister(q1)
+        for prep in product([Id, X], repeat=2):
+            for pulse in prep:
+                pulse(allChans)
+        Utheta(q1, amp=0.5, phase=2 * pi * periods / (ct + 1))
@@ -28,3 +28,10 @@ def main4(q:qreg, amps, shape):
 def main5(qs:qreg):
     for q in qs:
         X(q)
+
+@qgl2decl
+def main_alias(amps):
+    q = QRegister('q1')
+    for a in amps:
+        b = a
+        Xtheta(q, amp=b)
@@ -0,0 +1,91 @@
+import asyncio
+import threading
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from pyqgl2.context import CompileContext
+from pyqgl2.main import compile_function_async
+from pyqgl2.progress import CompileProgress, add_progress_listener
+from QGL import *
+
+from .helpers import channel_setup
+
+def run(coroutine):
+    # Like asyncio.run (which is new in Python 3.7)
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+class TestCompileAsync(unittest.TestCase):
+    def setUp(self):
+        channel_setup()
+
+    def tearDown(self):
+        pass
+
+    def test_progress(self):
+        q1 = QubitFactory('q1')
+        amps = [1, 2, 3]
+        events = list()
+
+        async def compile_main1():
+            return await compile_function_async(
+                    "test/code/toplevel_binding.py", "main1", (amps,),
+                    progress=events.append)
+
+        resFunction = run(compile_main1())
+        self.assertEqual(resFunction(), [Xtheta(q1, amp=a) for a in amps])
+
+        stages = [event.stage for event in events]
+        self.assertEqual(stages[0], 'importer')
+        self.assertEqual(stages[-3:], ['evaluator', 'flattener', 'extractor'])
+
+        inliner = [event for event in events if event.stage == 'inliner']
+        self.assertEqual([event.iteration for event in inliner],
+                list(range(len(inliner))))
+        self.assertTrue(inliner[-1].statements > 0)
+
+        # the loop is unrolled by the evaluator
+        self.assertTrue(events[-3].statements >= len(amps))
+        self.assertEqual(events[-1], CompileProgress('extractor'))
+
+    def test_cancel(self):
+        # When the importer is done, cancel the task, and hold the
+        # compilation until the cancellation has been seen, so the
+        # compilation can't finish first.  The compilation stops
+        # at the end of the importer.
+        released = threading.Event()
+        stages = list()
+        tasks = list()
+
+        def hold(event):
+            stages.append(event.stage)
+            if event.stage == 'importer':
+                loop, task = tasks[0]
+                loop.call_soon_threadsafe(task.cancel)
+                released.wait(10)
+
+        context = CompileContext()
+        with context:
+            add_progress_listener(hold)
+
+        executor = ThreadPoolExecutor(max_workers=1)
+
+        async def compile_and_cancel():
+            task = asyncio.ensure_future(compile_function_async(
+                    "test/code/toplevel_binding.py", "main1", ([1, 2],),
+                    context=context, executor=executor))
+            tasks.append((asyncio.get_event_loop(), task))
+            try:
+                await task
+            finally:
+                released.set()
+
+        with self.assertRaises(asyncio.CancelledError):
+            run(compile_and_cancel())
+
+        executor.shutdown(wait=True)
+        self.assertEqual(stages, ['importer'])
@@ -0,0 +1,66 @@
+import unittest
+
+from pyqgl2.ast_util import NodeError, QGL2CompileError
+from pyqgl2.budget import CompileBudget, set_budget
+from pyqgl2.context import CompileContext
+from pyqgl2.main import compile_function
+from pyqgl2.qreg import QRegister
+
+from .helpers import channel_setup
+
+class TestBudget(unittest.TestCase):
+    def setUp(self):
+        channel_setup()
+
+    def tearDown(self):
+        pass
+
+    def compile(self, main_name, count, **budget):
+        context = CompileContext()
+        with context:
+            set_budget(**budget)
+
+        return compile_function("test/code/budget.py", main_name,
+                (QRegister('q1'), count), context=context)
+
+    def test_within_budget(self):
+        # 3 iterations of init, 3 * 2 pulses, and MEAS
+        resFunction = self.compile('sweep', 3, statements=100)
+        self.assertEqual(len(resFunction()), 3 * (1 + 6 + 1))
+
+    def test_statements(self):
+        # A sweep that is much too long is halted early,
+        # and the inner loop is blamed for most of the statements
+        with self.assertRaises(QGL2CompileError) as cm:
+            self.compile('sweep', 10**6, statements=1000)
+
+        self.assertEqual(cm.exception.level, NodeError.NODE_ERROR_FATAL)
+        lines = cm.exception.messages[-1].split('\n')
+        self.assertIn('compile budget exceeded', lines[0])
+        self.assertIn('limit 1000', lines[0])
+        self.assertEqual(lines[1], 'statements created, by source location:')
+        self.assertTrue(lines[2].endswith(':16: for: 750'), lines[2])
+        self.assertTrue(lines[3].endswith(':14: for: 250'), lines[3])
+
+    def test_while(self):
+        with self.assertRaises(QGL2CompileError) as cm:
+            self.compile('countdown', 10**6, statements=100)
+
+        lines = cm.exception.messages[-1].split('\n')
+        self.assertTrue(lines[2].endswith(':22: while: 101'), lines[2])
+
+    def test_seconds(self):
+        with self.assertRaises(QGL2CompileError) as cm:
+            self.compile('sweep', 10**6, seconds=0.5)
+        self.assertIn('seconds elapsed (limit 0.5)', cm.exception.messages[-1])
+
+    def test_inherited(self):
+        # The limits are inherited by new contexts,
+        # but the usage of each compilation is not
+        with CompileContext():
+            set_budget(statements=10)
+            with CompileContext():
+                self.assertEqual(CompileBudget.MAX_STATEMENTS, 10)
+                self.assertIsNone(CompileBudget.USAGE)
+
+        self.assertIsNone(CompileBudget.MAX_STATEMENTS)
@@ -0,0 +1,265 @@
+import unittest
+import numpy as np
+
+from functools import reduce
+
+from qgl2.basic_sequences.RB import create_RB_seqs
+from qgl2.Cliffords import clifford_mat, clifford_index, clifford_key
+from qgl2.Cliffords import clifford_mult_table, clifford_inverse_table
+from qgl2.Cliffords import clifford_multiply, clifford_product
+from qgl2.Cliffords import recovery_clifford, inverse_clifford
+from qgl2.Cliffords import clifford_mats, multiply_mats, inverse_cliffords
+from qgl2.Cliffords import recovery_cliffords
+from qgl2.Cliffords import pauli_multiply, tableau_identity, tableau_compose
+from qgl2.Cliffords import tableau_inverse, tableau_from_mat, tableau_index
+from qgl2.Cliffords import clifford_tableau, tableau_product
+from qgl2.Cliffords import pX, pZ, pI
+
+def is_identity(mat):
+    return np.isclose(np.abs(np.trace(mat)), mat.shape[0])
+
+def inverse_clifford_scan(cMat):
+    # the original inverse_clifford: search all the Cliffords for
+    # the one whose product with cMat is the identity
+    dim = cMat.shape[0]
+    numQubits = 1 if dim == 2 else 2
+    for ct in range(24 if dim == 2 else 11520):
+        if np.isclose(np.abs(np.dot(
+                cMat, clifford_mat(ct, numQubits)).trace()), dim):
+            return ct
+    return None
+
+class TestCliffordTables(unittest.TestCase):
+
+    def test_key(self):
+        # the key doesn't depend on the global phase
+        for c in (0, 5, 17):
+            mat = clifford_mat(c, 1)
+            for phase in (1j, -1, np.exp(0.3j)):
+                self.assertEqual(clifford_key(mat), clifford_key(phase * mat))
+            self.assertEqual(clifford_index(np.exp(1.1j) * mat), c)
+
+        with self.assertRaises(Exception):
+            clifford_index(np.array([[1, 0], [0, np.exp(0.1j)]]))
+
+    def test_mult_table(self):
+        table = clifford_mult_table(1)
+        self.assertEqual(table.shape, (24, 24))
+
+        for c1 in range(24):
+            # each row is a permutation of the group
+            self.assertEqual(sorted(table[c1]), list(range(24)))
+            for c2 in range(24):
+                mat = np.dot(clifford_mat(c2, 1), clifford_mat(c1, 1))
+                check = np.dot(mat, clifford_mat(table[c1, c2], 1).conj().T)
+                self.assertTrue(is_identity(check), (c1, c2))
+
+    def test_inverse_table(self):
+        for numQubits, size in ((1, 24), (2, 11520)):
+            inverse = clifford_inverse_table(numQubits)
+            self.assertEqual(len(inverse), size)
+            for c in range(0, size, 7):
+                self.assertTrue(is_identity(np.dot(
+                        clifford_mat(inverse[c], numQubits),
+                        clifford_mat(c, numQubits))), c)
+
+    def test_two_qubit_multiply(self):
+        np.random.seed(11)
+        for c1, c2 in np.random.randint(0, 11520, size=(50, 2)):
+            mat = np.dot(clifford_mat(c2, 2), clifford_mat(c1, 2))
+            product = clifford_multiply(c1, c2, 2)
+            self.assertTrue(is_identity(np.dot(
+                    mat, clifford_mat(product, 2).conj().T)))
+
+    def test_recovery(self):
+        np.random.seed(12)
+        for numQubits, size in ((1, 24), (2, 11520)):
+            for length in (1, 2, 5, 20):
+                seq = np.random.randint(0, size, size=length).tolist()
+                mat = reduce(lambda x, y: np.dot(y, x),
+                        [clifford_mat(c, numQubits) for c in seq])
+                self.assertEqual(clifford_index(mat),
+                        clifford_product(seq, numQubits))
+
+                mat = np.dot(clifford_mat(
+                        recovery_clifford(seq, numQubits), numQubits), mat)
+                self.assertTrue(is_identity(mat), seq)
+
+    def test_create_RB_seqs(self):
+        np.random.seed(13)
+        for numQubits in (1, 2):
+            seqs = create_RB_seqs(numQubits, [2, 3, 8], repeats=4,
+                    interleaveGate=3)
+            self.assertEqual([len(seq) for seq in seqs],
+                    [3] * 4 + [5] * 4 + [15] * 4)
+            for seq in seqs:
+                mat = reduce(lambda x, y: np.dot(y, x),
+                        [clifford_mat(c, numQubits) for c in seq])
+                self.assertTrue(is_identity(mat), seq)
+
+    def test_inverse_clifford(self):
+        # inverse_clifford agrees with the scan for every single qubit
+        # Clifford, for a sample of the two qubit Cliffords, and for
+        # products of Cliffords (with a global phase and rounding error)
+        np.random.seed(14)
+        mats = [clifford_mat(c, 1) for c in range(24)]
+        mats += [clifford_mat(c, 2) for c in np.random.randint(0, 11520, 6)]
+        for numQubits, size in ((1, 24), (2, 11520)):
+            for length in (2, 50):
+                seq = np.random.randint(0, size, size=length)
+                mats.append(np.exp(2j * np.pi * np.random.rand()) *
+                        reduce(lambda x, y: np.dot(y, x),
+                            [clifford_mat(c, numQubits) for c in seq]))
+
+        for mat in mats:
+            self.assertEqual(inverse_clifford(mat), inverse_clifford_scan(mat))
+
+    def test_inverse_clifford_noisy(self):
+        # noisy matrices give the same inverse as the scan (for as
+        # much noise as the scan tolerates), and as the scan of the
+        # matrix without the noise
+        np.random.seed(20)
+        mats = [clifford_mat(c, 1) for c in range(24)]
+        mats += [clifford_mat(c, 2) for c in np.random.randint(0, 11520, 3)]
+
+        for mat in mats:
+            expected = inverse_clifford_scan(mat)
+            for noise in (3e-7, 1e-6, 1e-5):
+                noisy = mat + noise * (np.random.randn(*mat.shape) +
+                        1j * np.random.randn(*mat.shape)) / np.sqrt(2)
+                self.assertEqual(inverse_clifford(noisy), expected)
+                self.assertEqual(
+                        list(inverse_cliffords(noisy[np.newaxis])), [expected])
+                if noise < 1e-5:
+                    self.assertEqual(inverse_clifford_scan(noisy), expected)
+
+    def test_key_noise(self):
+        # small noise doesn't change the key; large noise means
+        # that there is no key
+        np.random.seed(21)
+        mat = clifford_mat(1234, 2)
+        noise = np.random.randn(4, 4) + 1j * np.random.randn(4, 4)
+        self.assertEqual(clifford_key(mat + 1e-5 * noise), clifford_key(mat))
+        self.assertIsNone(clifford_key(mat + 1e-2 * noise))
+
+    def test_inverse_clifford_errors(self):
+        with self.assertRaises(Exception):
+            inverse_clifford(np.eye(8))
+        with self.assertRaises(Exception):
+            inverse_clifford(np.array([[1, 0], [0, np.exp(0.1j)]]))
+
+    def test_multiply_mats(self):
+        np.random.seed(15)
+        for numQubits, size in ((1, 24), (2, 11520)):
+            for length in (0, 1, 2, 3, 7, 8):
+                seqs = np.random.randint(0, size, size=(5, length))
+                products = multiply_mats(clifford_mats(numQubits)[seqs])
+                self.assertEqual(products.shape,
+                        (5, 2 ** numQubits, 2 ** numQubits))
+
+                for seq, product in zip(seqs, products):
+                    mat = reduce(lambda x, y: np.dot(y, x),
+                            [clifford_mat(c, numQubits) for c in seq],
+                            np.eye(2 ** numQubits))
+                    self.assertTrue(np.allclose(mat, product), seq)
+
+    def test_inverse_cliffords(self):
+        # gates given as matrices (with arbitrary phases) rather
+        # than as Clifford indices
+        np.random.seed(16)
+        for numQubits, size in ((1, 24), (2, 11520)):
+            seqs = np.random.randint(0, size, size=(10, 6))
+            phases = np.exp(2j * np.pi * np.random.rand(10, 6, 1, 1))
+            products = multiply_mats(phases * clifford_mats(numQubits)[seqs])
+
+            inverses = inverse_cliffords(products)
+            self.assertEqual(list(inverses),
+                    [inverse_clifford(product) for product in products])
+
+        with self.assertRaises(Exception):
+            inverse_cliffords(np.tile(np.diag([1, np.exp(0.1j)]), (2, 1, 1)))
+
+    def test_recovery_cliffords(self):
+        np.random.seed(17)
+        for numQubits, size in ((1, 24), (2, 11520)):
+            seqs = [np.random.randint(0, size, size=length).tolist()
+                    for length in (3, 1, 5, 3, 0, 5, 12)]
+            self.assertEqual(recovery_cliffords(seqs, numQubits),
+                    [recovery_clifford(seq, numQubits) for seq in seqs])
+
+class TestCliffordTableaux(unittest.TestCase):
+
+    def test_pauli_multiply(self):
+        X = (1, 0, 0)
+        Z = (0, 1, 0)
+        Y = (1, 1, 1)
+        self.assertEqual(pauli_multiply(X, Z), (1, 1, 0))
+        self.assertEqual(pauli_multiply(Z, X), (1, 1, 2))
+        self.assertEqual(pauli_multiply(Y, Y), (0, 0, 0))
+        self.assertEqual(pauli_multiply(X, Y), (0, 1, 1))
+
+    def test_identity(self):
+        for numQubits in (1, 2):
+            self.assertEqual(clifford_tableau(0, numQubits),
+                    tableau_identity(numQubits))
+            self.assertEqual(tableau_index(tableau_identity(numQubits)), 0)
+
+    def test_single_qubit(self):
+        # composition and inversion agree with the tables
+        mult = clifford_mult_table(1)
+        inverse = clifford_inverse_table(1)
+        for c1 in range(24):
+            tableau = clifford_tableau(c1, 1)
+            self.assertEqual(tableau_index(tableau_inverse(tableau)),
+                    inverse[c1])
+            for c2 in range(24):
+                self.assertEqual(tableau_index(tableau_compose(
+                        tableau, clifford_tableau(c2, 1))), mult[c1, c2])
+
+    def test_two_qubits(self):
+        np.random.seed(18)
+        inverse = clifford_inverse_table(2)
+        for c1, c2 in np.random.randint(0, 11520, size=(100, 2)):
+            tableau = clifford_tableau(c1, 2)
+            self.assertEqual(tableau_index(tableau_inverse(tableau)),
+                    inverse[c1])
+            self.assertEqual(tableau_index(tableau_compose(
+                    tableau, clifford_tableau(c2, 2))),
+                    clifford_multiply(c1, c2, 2))
+
+        for length in (1, 10, 100):
+            seq = np.random.randint(0, 11520, size=length).tolist()
+            self.assertEqual(tableau_index(tableau_product(seq, 2)),
+                    clifford_product(seq, 2))
+
+    def test_three_qubits(self):
+        # there are no indices for three qubits, but the tableaux of
+        # products and inverses agree with those of the matrices
+        H = np.array([[1, 1], [1, -1]]) / np.sqrt(2)
+        S = np.diag([1, 1j])
+        CNOT = np.array([[1, 0, 0, 0], [0, 1, 0, 0],
+            [0, 0, 0, 1], [0, 0, 1, 0]])
+        gates = [reduce(np.kron, [H, pI, pI]), reduce(np.kron, [pI, S, pI]),
+                reduce(np.kron, [pI, pI, np.dot(H, S)]),
+                np.kron(CNOT, pI), np.kron(pI, CNOT),
+                reduce(np.kron, [pX, pI, pZ])]
+
+        np.random.seed(19)
+        mats = list()
+        for _ in range(10):
+            picks = np.random.randint(0, len(gates), size=6)
+            mats.append(reduce(lambda x, y: np.dot(y, x),
+                    [gates[pick] for pick in picks]))
+
+        for mat1, mat2 in zip(mats, mats[1:]):
+            tableau1 = tableau_from_mat(mat1)
+            self.assertEqual(len(tableau1), 6)
+            self.assertEqual(tableau_compose(tableau1, tableau_from_mat(mat2)),
+                    tableau_from_mat(np.dot(mat2, mat1)))
+            self.assertEqual(tableau_inverse(tableau1),
+                    tableau_from_mat(mat1.conj().T))
+            self.assertEqual(tableau_compose(tableau1,
+                    tableau_inverse(tableau1)), tableau_identity(3))
+
+        with self.assertRaises(Exception):
+            tableau_index(tableau_from_mat(mats[0]))
@@ -0,0 +1,92 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from pyqgl2.compile_pool import compile_many, compile_job
+from pyqgl2.importer import enable_module_cache, disable_module_cache
+from pyqgl2.qreg import QRegister
+from QGL import *
+
+from test.helpers import channel_setup
+
+class TestCompilePool(unittest.TestCase):
+    def setUp(self):
+        channel_setup()
+
+    def tearDown(self):
+        pass
+
+    def test_compile_job(self):
+        # the result of a job can be pickled, and recreates
+        # a function that generates the same sequence
+        amps = np.linspace(0, 1, 5)
+        result = compile_job(("test/code/toplevel_binding.py", "main1", (amps,)))
+        self.assertTrue(result.succeeded())
+        self.assertIn('COMPILING', result.output)
+
+        result = pickle.loads(pickle.dumps(result))
+
+        q1 = QubitFactory('q1')
+        expectedseq = [Xtheta(q1, amp=a) for a in amps]
+        self.assertEqual(result.function()(), expectedseq)
+
+    def test_compile_job_error(self):
+        result = compile_job(("test/code/scope.py", "B"))
+        self.assertFalse(result.succeeded())
+        self.assertIsNone(result.function())
+        self.assertTrue(result.messages)
+
+    def test_compile_many(self):
+        amps_list = [np.linspace(0, 1, 11), [0.5, 0.25], range(3)]
+        jobs = [("test/code/toplevel_binding.py", "main1", (amps,))
+                for amps in amps_list]
+        jobs.insert(1, ("test/code/scope.py", "B"))
+
+        results = compile_many(jobs, workers=2, initializer=channel_setup)
+        self.assertEqual(len(results), len(jobs))
+        self.assertFalse(results[1].succeeded())
+        del results[1]
+
+        q1 = QubitFactory('q1')
+        for result, amps in zip(results, amps_list):
+            self.assertTrue(result.succeeded())
+            expectedseq = [Xtheta(q1, amp=a) for a in amps]
+            self.assertEqual(result.function()(), expectedseq)
+
+    def test_module_cache(self):
+        # with the module cache enabled, the second compile of a
+        # file reuses its modules, and creates the same sequence;
+        # a file that changes is read again
+        tmpdir = tempfile.mkdtemp()
+        fname = os.path.join(tmpdir, 'toplevel_binding.py')
+        shutil.copy("test/code/toplevel_binding.py", fname)
+
+        amps = np.linspace(0, 1, 5)
+        job = (fname, "main1", (amps,))
+
+        enable_module_cache()
+        try:
+            first = compile_job(job)
+            second = compile_job(job)
+
+            with open(fname, 'a') as fout:
+                fout.write('\n# changed\n')
+            third = compile_job(job)
+        finally:
+            disable_module_cache()
+            shutil.rmtree(tmpdir)
+
+        self.assertEqual(first.counts.get('module_cache_hits', 0), 0)
+        self.assertGreater(second.counts['module_cache_hits'], 0)
+        self.assertEqual(second.counts.get('module_cache_misses', 0), 0)
+        self.assertEqual(third.counts['module_cache_misses'], 1)
+
+        q1 = QubitFactory('q1')
+        expectedseq = [Xtheta(q1, amp=a) for a in amps]
+        for result in (first, second, third):
+            self.assertTrue(result.succeeded())
+            self.assertEqual(result.source, first.source)
+            self.assertEqual(result.function()(), expectedseq)
@@ -0,0 +1,90 @@
+import unittest
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+
+from pyqgl2.ast_util import NodeError
+from pyqgl2.context import CompileContext, current_context
+from pyqgl2.debugmsg import DebugMsg
+from pyqgl2.eval import EvalTransformer
+from pyqgl2.main import compile_function
+from pyqgl2.qreg import QRegister
+from QGL import *
+
+from .helpers import channel_setup
+
+class TestCompileContext(unittest.TestCase):
+    def setUp(self):
+        channel_setup()
+
+    def tearDown(self):
+        pass
+
+    def test_isolation(self):
+        NodeError.reset()
+
+        with CompileContext():
+            NodeError.error_msg(None, 'error inside the context')
+            self.assertTrue(NodeError.error_detected())
+            self.assertEqual(NodeError.LAST_ERROR_MSG,
+                    'error inside the context')
+
+        self.assertFalse(NodeError.error_detected())
+        self.assertEqual(NodeError.LAST_ERROR_MSG, '')
+
+    def test_settings_inherited(self):
+        old_level = DebugMsg.set_level(DebugMsg.LOW)
+        try:
+            with CompileContext():
+                self.assertEqual(DebugMsg.ACTIVE_LEVEL, DebugMsg.LOW)
+                DebugMsg.set_level(DebugMsg.HIGH)
+            self.assertEqual(DebugMsg.ACTIVE_LEVEL, DebugMsg.LOW)
+        finally:
+            DebugMsg.set_level(old_level)
+
+    def test_context_not_shared(self):
+        # compile_function creates its own context, and does
+        # not change the state of the caller's context
+        NodeError.reset()
+        QRegister.reset()
+        q1 = QRegister('q1')
+
+        resFunction = compile_function(
+                "test/code/toplevel_binding.py", "main1", ([0.5],))
+
+        self.assertIsNot(resFunction.qgl_context, current_context())
+        self.assertEqual(list(QRegister.KNOWN_QUBITS), [1])
+        self.assertEqual(EvalTransformer.PRECOMPUTED_VALUES, dict())
+
+        # an explicit context is used as given
+        context = CompileContext()
+        resFunction = compile_function(
+                "test/code/toplevel_binding.py", "main1", ([0.5],),
+                context=context)
+        self.assertIs(resFunction.qgl_context, context)
+
+    def test_concurrent_compiles(self):
+        # compile several variants in parallel threads, and check
+        # that they don't interfere.  compile_function creates a
+        # new context for each compilation.
+        amps_list = [np.linspace(0, 1, 11), range(7), [0.5, 0.25]]
+
+        def compile_one(amps):
+            return compile_function(
+                    "test/code/toplevel_binding.py", "main1", (amps,))
+
+        # QGL (and the import machinery) are not thread-safe when the
+        # modules are imported for the first time, so compile once
+        # before starting the threads.  The generated functions are
+        # run serially, because they use QGL's channel library.
+        #
+        compile_one([0])
+
+        with ThreadPoolExecutor(max_workers=len(amps_list)) as pool:
+            resFunctions = list(pool.map(compile_one, amps_list))
+
+        q1 = QubitFactory('q1')
+        for resFunction, amps in zip(resFunctions, amps_list):
+            expectedseq = [Xtheta(q1, amp=a) for a in amps]
+            seqs = resFunction()
+            self.assertEqual(seqs, expectedseq)
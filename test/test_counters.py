@@ -0,0 +1,70 @@
+import unittest
+
+from pyqgl2.context import CompileContext
+from pyqgl2.counters import COUNTER_NAMES, count, get_counts
+from pyqgl2.main import compile_function
+from pyqgl2.qreg import QRegister
+from pyqgl2.stats import CompileStats
+
+from .helpers import channel_setup
+
+class TestCounters(unittest.TestCase):
+    def setUp(self):
+        channel_setup()
+
+    def tearDown(self):
+        pass
+
+    def test_counts(self):
+        stats = CompileStats()
+        resFunction = compile_function(
+                "test/code/toplevel_binding.py", "main1", ([1, 2, 3],),
+                stats=stats)
+        counts = resFunction.qgl_counts
+
+        self.assertEqual(sorted(counts), sorted(COUNTER_NAMES))
+        self.assertEqual(stats.counts, counts)
+
+        # the loop is unrolled once, with three iterations
+        self.assertEqual(counts['for_iterations'], 3)
+        self.assertEqual(counts['while_iterations'], 0)
+
+        self.assertTrue(counts['quickcopy_calls'] > 0)
+        self.assertTrue(counts['quickcopy_bytes'] > counts['quickcopy_calls'])
+        self.assertTrue(counts['resolve_sym_calls'] > 0)
+        self.assertTrue(counts['native_eval_calls'] > 0)
+        self.assertTrue(counts['ast2str_calls'] > 0)
+        self.assertTrue(counts['ast2str_chars'] > counts['ast2str_calls'])
+
+        # each compilation has its own counts
+        resFunction = compile_function(
+                "test/code/toplevel_binding.py", "main1", ([1, 2, 3, 4, 5],))
+        self.assertEqual(resFunction.qgl_counts['for_iterations'], 5)
+
+    def test_inline_expansions(self):
+        # The calls to hadamard and CZ_k are each inlined
+        # once, before the loops are unrolled
+        resFunction = compile_function(
+                "test/code/qft.py", "qft", (QRegister('q1', 'q2'),))
+        self.assertEqual(resFunction.qgl_counts['inline_expansions'], 2)
+        self.assertEqual(resFunction.qgl_counts['for_iterations'], 3)
+
+    def test_shared_context(self):
+        # If two compilations share a context, then the counts of
+        # each compilation don't include the counts of the other,
+        # but the context has the counts of both
+        context = CompileContext()
+        with context:
+            count('for_iterations', 10)
+
+        first = compile_function(
+                "test/code/toplevel_binding.py", "main1", ([1, 2],),
+                context=context)
+        second = compile_function(
+                "test/code/toplevel_binding.py", "main1", ([1, 2, 3],),
+                context=context)
+
+        self.assertEqual(first.qgl_counts['for_iterations'], 2)
+        self.assertEqual(second.qgl_counts['for_iterations'], 3)
+        with context:
+            self.assertEqual(get_counts()['for_iterations'], 15)
@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from pyqgl2.daemon import CompileServer, send_request
+from pyqgl2.main import parse_args
+
+from test.helpers import channel_setup
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        channel_setup()
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'qgl2d.sock')
+
+        self.server = CompileServer(self.path)
+        self.thread = threading.Thread(target=self.server.serve)
+        self.thread.start()
+
+    def tearDown(self):
+        if self.thread.is_alive():
+            send_request({'command': 'stop'}, self.path)
+        self.thread.join()
+        shutil.rmtree(self.tmpdir)
+
+    def compile(self, argv):
+        return send_request(
+                {'argv': argv, 'cwd': os.getcwd()}, self.path)
+
+    def test_compile(self):
+        # compile the same program twice, to make sure that
+        # the first request doesn't disturb the second
+        for _ in range(2):
+            reply = self.compile(['test/code/loops.py', '-m', 'loop_invariant'])
+            self.assertEqual(reply['status'], 0, reply['output'])
+            self.assertIn('COMPILING [test/code/loops.py]', reply['output'])
+            self.assertIn('Generated sequences', reply['output'])
+
+    def test_cache(self):
+        # a second request with the same arguments reuses the
+        # compiled program (and prints the same output), until
+        # the source file changes
+        fname = os.path.join(self.tmpdir, 'loops.py')
+        shutil.copy('test/code/loops.py', fname)
+        argv = [fname, '-m', 'loop_invariant']
+
+        first = self.compile(argv)
+        self.assertEqual(first['status'], 0, first['output'])
+        compiled = self.server.cache.functions[
+                self.server.cache.run_key(parse_args(argv))]
+
+        # the output of the compile (including its
+        # timestamps) is printed again
+        second = self.compile(argv)
+        self.assertEqual(second['status'], 0, second['output'])
+        importer_line = [line for line in second['output'].split('\n')
+                if 'CALLING IMPORTER' in line][0]
+        self.assertIn(importer_line, first['output'])
+        self.assertIs(self.server.cache.functions[
+                self.server.cache.run_key(parse_args(argv))], compiled)
+
+        with open(fname, 'a') as fout:
+            fout.write('\n# changed\n')
+        third = self.compile(argv)
+        self.assertEqual(third['status'], 0, third['output'])
+        self.assertIsNot(self.server.cache.functions[
+                self.server.cache.run_key(parse_args(argv))], compiled)
+
+        # requests for information about the compile always compile
+        reply = self.compile(argv + ['--stats', 'text'])
+        self.assertEqual(reply['status'], 0, reply['output'])
+        self.assertIn('importer', reply['output'])
+
+    def test_channel_library_cache(self):
+        # a channel library is loaded once, and then reused
+        # while its file is unchanged
+        cl_name = os.path.join(self.tmpdir, 'cl.sqlite')
+        open(cl_name, 'w').close()
+        argv = ['test/code/loops.py', '-m', 'loop_invariant', '-cl', cl_name]
+
+        reply = self.compile(argv)
+        self.assertEqual(reply['status'], 0, reply['output'])
+        self.assertIn('Loaded Channel Library', reply['output'])
+
+        reply = self.compile(argv)
+        self.assertEqual(reply['status'], 0, reply['output'])
+        self.assertIn('Using Channel Library', reply['output'])
+
+    def test_errors(self):
+        # argparse errors have the same status as the commandline
+        reply = self.compile(['-no-such-option'])
+        self.assertEqual(reply['status'], 2)
+        self.assertIn('usage:', reply['output'])
+
+        reply = self.compile(['test/code/scope.py', '-m', 'B'])
+        self.assertEqual(reply['status'], 1)
+        self.assertIn('compilation failed', reply['output'])
+
+        # the daemon is still usable after a failure
+        reply = self.compile(['test/code/loops.py', '-m', 'loop_invariant'])
+        self.assertEqual(reply['status'], 0, reply['output'])
+
+    def test_stale_socket(self):
+        # a second daemon cannot use the same socket
+        with self.assertRaises(OSError):
+            CompileServer(self.path)
+
+        send_request({'command': 'stop'}, self.path)
+        self.thread.join()
+        self.assertFalse(os.path.exists(self.path))
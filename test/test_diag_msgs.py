@@ -0,0 +1,90 @@
+import unittest
+
+from pyqgl2.ast_util import NodeError, QGL2CompileError
+from pyqgl2.context import CompileContext
+from pyqgl2.debugmsg import DebugMsg
+from pyqgl2.main import compile_function
+from pyqgl2.qreg import QRegister
+
+from .helpers import channel_setup
+
+class MsgMaker(object):
+    """
+    A callable message that counts how many times it has been called
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.text
+
+class TestDiagMsgs(unittest.TestCase):
+    def setUp(self):
+        channel_setup()
+
+    def tearDown(self):
+        pass
+
+    def test_muted_msg_deferred(self):
+        msg = MsgMaker('expensive diagnostic')
+        with CompileContext():
+            NodeError.diag_msg(None, msg)
+            self.assertEqual(msg.calls, 0)
+
+            # Fetching the messages creates the text, once
+            self.assertEqual(NodeError.last_msgs(),
+                    ['diag: expensive diagnostic'])
+            self.assertEqual(NodeError.last_msgs(),
+                    ['diag: expensive diagnostic'])
+            self.assertEqual(msg.calls, 1)
+
+    def test_printed_msg(self):
+        # Messages that are printed are created immediately
+        msg = MsgMaker('printed diagnostic')
+        with CompileContext():
+            NodeError.MUTE_ERR_LEVEL = NodeError.NODE_ERROR_NONE
+            NodeError.diag_msg(None, msg)
+            self.assertEqual(msg.calls, 1)
+            self.assertIn('diag: printed diagnostic', NodeError.ALL_PRINTED)
+
+    def test_error_msgs(self):
+        # The text of errors is in the QGL2CompileError
+        with CompileContext():
+            NodeError.diag_msg(None, lambda: 'muted diagnostic')
+            NodeError.error_msg(None, lambda: 'an error')
+            with self.assertRaises(QGL2CompileError) as cm:
+                NodeError.halt_on_error()
+
+        self.assertEqual(cm.exception.messages,
+                ['diag: muted diagnostic', 'error: an error'])
+
+    def test_debug_msg(self):
+        msg = MsgMaker('debugging')
+        with CompileContext():
+            DebugMsg.set_level(DebugMsg.NONE)
+            self.assertFalse(DebugMsg.is_active(DebugMsg.HIGH))
+            DebugMsg.log(msg, DebugMsg.HIGH)
+            self.assertEqual(msg.calls, 0)
+
+            DebugMsg.add_tag('tag', DebugMsg.LOW)
+            self.assertTrue(DebugMsg.is_active(DebugMsg.LOW, 'tag'))
+            DebugMsg.log(msg, DebugMsg.LOW, 'tag')
+            self.assertEqual(msg.calls, 1)
+
+    def test_fewer_ast2str(self):
+        # The diagnostics for each inlined call are not
+        # created unless they are printed
+        qs = QRegister('q1', 'q2')
+
+        context = CompileContext()
+        with context:
+            NodeError.MUTE_ERR_LEVEL = NodeError.NODE_ERROR_NONE
+        verbose = compile_function(
+                "test/code/qft.py", "qft", (qs,), context=context)
+        quiet = compile_function("test/code/qft.py", "qft", (qs,))
+
+        self.assertTrue(quiet.qgl_counts['ast2str_calls'] <
+                verbose.qgl_counts['ast2str_calls'])
@@ -1,8 +1,14 @@
+import ast
+import re
 import unittest
 import numpy as np
 from itertools import product
 
+from pyqgl2.ast_util import ast2str
+from pyqgl2.eval import EvalTransformer, SimpleEvaluator
+from pyqgl2.ast_util import QGL2CompileError
 from pyqgl2.main import compile_function
+from pyqgl2.qreg import QRegister
 from QGL import *
 
 from test.helpers import testable_sequence, \
@@ -50,11 +56,227 @@ class TestEvalTransformer(unittest.TestCase):
         assertPulseSequenceEqual(self, seqs, expectedseq)
 
     def test_runtime_break(self):
-        with self.assertRaises(SystemExit):
+        with self.assertRaises(QGL2CompileError):
             resFunction = compile_function("test/code/loops.py",
                                            "runtime_break")
 
     def test_runtime_continue(self):
-        with self.assertRaises(SystemExit):
+        with self.assertRaises(QGL2CompileError):
             resFunction = compile_function("test/code/loops.py",
                                            "runtime_continue")
+
+    def test_loop_invariant(self):
+        resFunction = compile_function("test/code/loops.py",
+                                       "loop_invariant")
+        seqs = resFunction()
+
+        q1 = QubitFactory('q1')
+
+        expectedseq = [Id(q1, length=1.5e-7 * (ct + 1)) for ct in range(3)]
+
+        assertPulseSequenceEqual(self, seqs, expectedseq)
+
+    def test_loop_variant(self):
+        resFunction = compile_function("test/code/loops.py",
+                                       "loop_variant")
+        seqs = resFunction()
+
+        q1 = QubitFactory('q1')
+
+        expectedseq = [Id(q1, length=1e-7 * (ct + 1)) for ct in range(3)]
+
+        assertPulseSequenceEqual(self, seqs, expectedseq)
+
+    def test_loop_invariant_exprs(self):
+        resFunction = compile_function("test/code/loops.py",
+                                       "loop_invariant_exprs")
+        seqs = resFunction()
+
+        q1 = QubitFactory('q1')
+
+        expectedseq = list()
+        for ct in range(3):
+            for prep in product([Id, X], repeat=2):
+                expectedseq += [pulse(q1) for pulse in prep]
+            expectedseq.append(
+                    Utheta(q1, amp=0.5, phase=2 * np.pi * 2 / (ct + 1)))
+
+        assertPulseSequenceEqual(self, seqs, expectedseq)
+
+    def split_invariants(self, loop_text, local_variables, loop_values=None):
+        # Helper: find the loop-invariant assignments in the body of
+        # the given for loop, given the values of the local variables
+        evaluator = EvalTransformer(SimpleEvaluator(None, local_variables))
+        loop = ast.parse(loop_text).body[0]
+        hoisted, remaining = evaluator.split_loop_invariants(
+                loop.body, [loop.target.id], loop_values)
+        return ([stmnt.targets[0].id for stmnt in hoisted],
+                len(remaining))
+
+    def test_split_loop_invariants(self):
+        q1 = QRegister('q1')
+
+        # the body of loop_invariant: both assignments are hoisted,
+        # even though step is passed to Id
+        hoisted, remaining = self.split_invariants(
+                'for ct in range(3):\n'
+                '    total = sum(lengths)\n'
+                '    step = total / len(lengths)\n'
+                '    Id(q1, length=step * (ct + 1))\n',
+                {'q1': q1, 'lengths': [1e-7, 2e-7]})
+        self.assertEqual(hoisted, ['total', 'step'])
+        self.assertEqual(remaining, 1)
+
+        # the same body, after Id has been inlined: the temporary
+        # depends on ct, but can't modify step
+        hoisted, remaining = self.split_invariants(
+                'for ct in range(3):\n'
+                '    total = sum(lengths)\n'
+                '    step = total / len(lengths)\n'
+                '    length___tmp = step * (ct + 1)\n'
+                '    Id(q1, length=length___tmp)\n',
+                {'q1': q1, 'lengths': [1e-7, 2e-7]}, range(3))
+        self.assertEqual(hoisted, ['total', 'step'])
+        self.assertEqual(remaining, 2)
+
+        hoisted, remaining = self.split_invariants(
+                'for ct in range(3):\n'
+                '    n = len(spacings)\n'
+                '    Id(q1, length=n)\n',
+                {'q1': q1, 'spacings': [1, 2]})
+        self.assertEqual(hoisted, ['n'])
+
+        hoisted, remaining = self.split_invariants(
+                'for ct in range(3):\n'
+                '    theta = 2 * 3.14159 * periods\n'
+                '    Xtheta(q1, amp=theta)\n',
+                {'q1': q1, 'periods': 2})
+        self.assertEqual(hoisted, ['theta'])
+
+        # the body of loop_variant: lengths is reassigned
+        hoisted, remaining = self.split_invariants(
+                'for ct in range(3):\n'
+                '    total = sum(lengths)\n'
+                '    Id(q1, length=total)\n'
+                '    lengths = lengths + [1e-7]\n',
+                {'q1': q1, 'lengths': [1e-7]})
+        self.assertEqual(hoisted, [])
+        self.assertEqual(remaining, 3)
+
+        # a mutable value that is passed to a function might be
+        # modified by that function, so it must not be hoisted
+        hoisted, remaining = self.split_invariants(
+                'for ct in range(3):\n'
+                '    amps = list(base)\n'
+                '    update(amps, ct)\n',
+                {'base': [0.5]})
+        self.assertEqual(hoisted, [])
+
+        # ... and neither can anything computed from a value
+        # that is modified by a function
+        hoisted, remaining = self.split_invariants(
+                'for ct in range(3):\n'
+                '    total = sum(amps)\n'
+                '    update(amps, total)\n',
+                {'amps': [0.5]})
+        self.assertEqual(hoisted, [])
+
+    def hoist_invariants(self, loop_text, local_variables, loop_values=None):
+        # Helper: like split_invariants, but return the text of the
+        # hoisted statements and of the rest of the body, with the
+        # new temporary names replaced by TMP
+        evaluator = EvalTransformer(SimpleEvaluator(None, local_variables))
+        loop = ast.parse(loop_text).body[0]
+        hoisted, remaining = evaluator.split_loop_invariants(
+                loop.body, [loop.target.id], loop_values)
+
+        def text(stmnt):
+            return re.sub(r'___inv_[0-9]+', 'TMP', ast2str(stmnt).strip())
+
+        return ([text(stmnt) for stmnt in hoisted],
+                [text(stmnt) for stmnt in remaining])
+
+    def test_hoist_invariant_exprs(self):
+        q1 = QRegister('q1')
+        measChans = QRegister('q1')
+
+        # the invariant part of an expression is assigned to a new
+        # name, both in a parameter and (as it is after inlining)
+        # in an assignment
+        hoisted, remaining = self.hoist_invariants(
+                'for k in range(3):\n'
+                '    U90(q1, phase=2 * pi * periods * k)\n',
+                {'q1': q1, 'pi': np.pi, 'periods': 2}, range(3))
+        self.assertEqual(hoisted, ['TMP = ((2 * pi) * periods)'])
+        self.assertEqual(remaining, ['U90(q1, phase=(TMP * k))'])
+
+        hoisted, remaining = self.hoist_invariants(
+                'for k in range(3):\n'
+                '    phase = 2 * pi * periods / len(spacings) * k\n'
+                '    U90(q1, phase=phase)\n',
+                {'q1': q1, 'pi': np.pi, 'periods': 2, 'spacings': [1, 2]},
+                range(3))
+        self.assertEqual(hoisted,
+                ['TMP = (((2 * pi) * periods) / len(spacings))'])
+        self.assertEqual(remaining,
+                ['phase = (TMP * k)', 'U90(q1, phase=phase)'])
+
+        # a QRegister of invariant names is hoisted, and so is the
+        # iterable of an inner loop, including an itertools iterator
+        # (as a tuple, because every iteration iterates over it)
+        hoisted, remaining = self.hoist_invariants(
+                'for amp in amps:\n'
+                '    allChans = QRegister(q1, measChans)\n'
+                '    init(allChans)\n'
+                '    for prep in product([Id, X], repeat=len(q1)):\n'
+                '        Utheta(q1, amp=amp)\n',
+                {'q1': q1, 'measChans': measChans, 'product': product,
+                    'Id': Id, 'X': X, 'amps': [0.1, 0.2]}, [0.1, 0.2])
+        self.assertEqual(hoisted, [
+                'allChans = QRegister(q1, measChans)',
+                'TMP = tuple(product([Id, X], repeat=len(q1)))'])
+        self.assertEqual(remaining[0], 'init(allChans)')
+        self.assertTrue(remaining[1].startswith('for prep in TMP:'))
+
+        # an iterator that is used up at once may be hoisted
+        hoisted, remaining = self.hoist_invariants(
+                'for ct in range(3):\n'
+                '    n = len(list(product([0, 1], repeat=2)))\n'
+                '    foo(n, ct)\n',
+                {'product': product}, range(3))
+        self.assertEqual(hoisted,
+                ['n = len(list(product([0, 1], repeat=2)))'])
+
+        # but not an iterator that is assigned to a name, because
+        # every iteration would use the same iterator
+        hoisted, remaining = self.hoist_invariants(
+                'for ct in range(3):\n'
+                '    preps = product([0, 1], repeat=2)\n'
+                '    for prep in preps:\n'
+                '        foo(prep)\n',
+                {'product': product}, range(3))
+        self.assertEqual(hoisted, [])
+
+        # a mutable value is not hoisted out of a parameter, because
+        # the function might modify it
+        hoisted, remaining = self.hoist_invariants(
+                'for ct in range(3):\n'
+                '    update(list(base))\n',
+                {'base': [0.5]}, range(3))
+        self.assertEqual(hoisted, [])
+
+        # nor is anything that refers to a name without a value at
+        # compile time (such as a measurement result)
+        hoisted, remaining = self.hoist_invariants(
+                'for ct in range(3):\n'
+                '    Id(q1, length=m * 2)\n',
+                {'q1': q1}, range(3))
+        self.assertEqual(hoisted, [])
+
+        # and a QRegister of a loop variable is not hoisted
+        hoisted, remaining = self.hoist_invariants(
+                'for q in qubits:\n'
+                '    reg = QRegister(q)\n'
+                '    X(reg)\n',
+                {'qubits': [q1, measChans]})
+        self.assertEqual(hoisted, [])
@@ -0,0 +1,56 @@
+import unittest
+
+from pyqgl2.explain import ExpansionMap
+from pyqgl2.main import compile_function
+from pyqgl2.qreg import QRegister
+
+from .helpers import channel_setup
+
+class TestExplain(unittest.TestCase):
+    def setUp(self):
+        channel_setup()
+
+    def tearDown(self):
+        pass
+
+    def test_qft(self):
+        explain = ExpansionMap()
+        resFunction = compile_function(
+                "test/code/qft.py", "qft", (QRegister('q1', 'q2'),),
+                explain=explain)
+        seq = resFunction()
+
+        self.assertIs(resFunction.qgl_explain, explain)
+
+        lines = dict(((record.lineno, (record.statements, record.pulses,
+                sorted(record.kinds)))
+            for record in explain.lines.values()))
+
+        # The outer loop produces everything but the measurements:
+        # two hadamards (2 pulses each) and one CZ_k (4 pulses)
+        self.assertEqual(lines[21], (8, 8, ['for']))
+        self.assertEqual(lines[22], (4, 4, ['call']))
+        self.assertEqual(lines[23], (4, 4, ['for']))
+        self.assertEqual(lines[24], (4, 4, ['call']))
+        self.assertEqual(lines[25], (2, 2, []))
+
+        # The lines of the helpers
+        self.assertEqual(lines[8], (2, 2, []))
+        self.assertEqual(lines[14], (1, 1, []))
+
+        # Every statement of the sequence is counted for its own line
+        # (and the loops are the top of the ranking)
+        self.assertEqual(lines[21][0] + lines[25][0], len(seq))
+        self.assertEqual(explain.ranked()[0].lineno, 21)
+
+        # The time of each loop and call is recorded
+        self.assertTrue(explain.lines[('test/code/qft.py', 21)].seconds > 0)
+
+        table = explain.format_table(limit=3)
+        self.assertEqual(len(table.split('\n')), 5)
+        self.assertIn('test/code/qft.py:21', table.split('\n')[1])
+
+    def test_no_explain(self):
+        resFunction = compile_function(
+                "test/code/qft.py", "qft", (QRegister('q1', 'q2'),))
+        self.assertIsNone(resFunction.qgl_explain)
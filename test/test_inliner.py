@@ -1,5 +1,13 @@
+import ast
+import re
 import unittest
+import numpy as np
 
+from pyqgl2.inline import NameRedirector, callee_levels, inline_callees
+from pyqgl2.inline import InlineSettings, TempVarManager, TEMP_NAME_STRIDE
+from pyqgl2.ast_util import QGL2CompileError, ast2str
+from pyqgl2.context import CompileContext
+from pyqgl2.importer import NameSpaces
 from pyqgl2.main import compile_function
 from QGL import *
 
@@ -13,10 +21,14 @@ class TestInliner(unittest.TestCase):
         pass
 
     def test_scope1(self):
-        with self.assertRaises(SystemExit):
+        with self.assertRaises(QGL2CompileError) as cm:
             resFunction = compile_function("test/code/scope.py",
                                            "B")
 
+        # the error carries the messages that explain it
+        self.assertTrue(cm.exception.messages)
+        self.assertIn(cm.exception.messages[-1], str(cm.exception))
+
     def test_scope2(self):
         resFunction = compile_function("test/code/scope.py",
                                        "C")
@@ -30,3 +42,104 @@ class TestInliner(unittest.TestCase):
         ]
 
         assertPulseSequenceEqual(self, seqs, expectedseq)
+
+    def test_callee_levels(self):
+        importer = NameSpaces("test/code/callgraph.py", "main")
+        levels = callee_levels(importer.qglmain, importer)
+
+        names = [set(func.name for func in level) for level in levels]
+        self.assertEqual(names,
+                [{'X', 'Y'}, {'leaf1', 'leaf2'}, {'middle'}])
+
+    def test_inline_callees(self):
+        # only the functions that aren't procedures are inlined,
+        # and each of them is only inlined once
+        importer = NameSpaces("test/code/callgraph.py", "main")
+        self.assertEqual(inline_callees(importer.qglmain, importer), 2)
+
+        leaf1 = importer.resolve_sym(importer.qglmain.qgl_fname, 'leaf1')
+        leaf2 = importer.resolve_sym(importer.qglmain.qgl_fname, 'leaf2')
+        middle = importer.resolve_sym(importer.qglmain.qgl_fname, 'middle')
+
+        self.assertFalse(hasattr(leaf1, 'qgl_inlined'))
+        self.assertIs(leaf2.qgl_inlined.qgl_inlined, leaf2.qgl_inlined)
+
+        # middle was inlined after leaf2, so its call to leaf2
+        # was replaced with a call to the inlined version
+        inlined_calls = [node.func.id for node in ast.walk(middle.qgl_inlined)
+                if isinstance(node, ast.Call)]
+        self.assertIn(leaf2.qgl_inlined.name, inlined_calls)
+        self.assertNotIn('leaf1', inlined_calls)
+
+        self.assertEqual(inline_callees(importer.qglmain, importer), 0)
+
+    def test_inline_callees_parallel(self):
+        # inlining each level of the call graph in a pool of workers
+        # creates the same functions (with different temporary names)
+        def inline(workers):
+            with CompileContext(inherit=False):
+                InlineSettings.WORKERS = workers
+                InlineSettings.MIN_PARALLEL_STATEMENTS = 0
+                importer = NameSpaces("test/code/callgraph.py", "main2")
+                self.assertEqual(
+                        inline_callees(importer.qglmain, importer), 3)
+
+                funcs = [importer.resolve_sym(importer.qglmain.qgl_fname,
+                    name).qgl_inlined for name in ('leaf2', 'leaf3', 'middle')]
+                for func in funcs:
+                    self.assertIs(importer.resolve_sym(
+                        importer.qglmain.qgl_fname, func.name), func)
+                self.assertEqual(len(set(func.name for func in funcs)), 3)
+
+                # names created later are distinct from the
+                # names created by the workers
+                last_name = TempVarManager.create_temp_var_manager(
+                        ).create_tmp_name()
+                self.assertNotIn(last_name,
+                        ''.join(ast2str(func) for func in funcs))
+
+            texts = [ast2str(func) for func in funcs]
+            indexes = [int(index) for index in
+                    re.findall('___qgl2_tmp_([0-9]+)', ''.join(texts))]
+            return indexes, [re.sub('___qgl2_tmp_[0-9]+', '___qgl2_tmp',
+                text) for text in texts]
+
+        serial_indexes, serial_texts = inline(0)
+        parallel_indexes, parallel_texts = inline(2)
+        self.assertEqual(parallel_texts, serial_texts)
+
+        # the workers created the names
+        self.assertLess(max(serial_indexes), TEMP_NAME_STRIDE)
+        self.assertGreater(max(parallel_indexes), TEMP_NAME_STRIDE)
+
+    def test_redirect_numpy_scalars(self):
+        # numpy integer, float64 and complex128 values are replaced
+        # with exact Python literals; other numpy scalars (and arrays)
+        # are referenced through the table
+        values = {
+            'i': np.int64(7),
+            'f': np.float64(0.1),
+            'c': np.complex128(1 + 2j),
+            'h': np.float32(0.1),
+            'a': np.arange(3)
+            }
+
+        for name in ['i', 'f', 'c']:
+            node = NameRedirector(values).visit(ast.Name(id=name, ctx=ast.Load()))
+            self.assertIsInstance(node, ast.Num)
+            self.assertIs(type(node.n), type(values[name].item()))
+            self.assertEqual(node.n, values[name])
+
+        for name in ['h', 'a']:
+            node = NameRedirector(values).visit(ast.Name(id=name, ctx=ast.Load()))
+            self.assertIsInstance(node, ast.Subscript)
+            self.assertEqual(node.value.id, '_T')
+            self.assertEqual(node.slice.value.s, name)
+
+        # pooled names are replaced with a reference to their
+        # element of the pool
+        node = NameRedirector(values, pooled={'p': ('a', 2)}).visit(
+                ast.Name(id='p', ctx=ast.Load()))
+        self.assertIsInstance(node, ast.Subscript)
+        self.assertEqual(node.slice.value.n, 2)
+        self.assertEqual(node.value.slice.value.s, 'a')
@@ -5,7 +5,9 @@ import unittest
 
 from .helpers import testable_sequence, discard_zero_Ids, \
     channel_setup, assertPulseSequenceEqual
+from pyqgl2.context import CompileContext
 from pyqgl2.main import compile_function
+from pyqgl2.sequences import SequenceExtractor
 
 from QGL import *
 
@@ -36,6 +38,23 @@ class TestMulti(unittest.TestCase):
 
         assertPulseSequenceEqual(self, seqs, expected)
 
+    def test_multiQbitTest2_parallel(self):
+        # expanding the QRegisters and generating the code
+        # in a pool of workers creates the same code
+        serialFunction = compile_function("test/code/multi.py",
+                                      "multiQbitTest2")
+
+        context = CompileContext()
+        with context:
+            SequenceExtractor.WORKERS = 2
+            SequenceExtractor.MIN_PARALLEL_STATEMENTS = 0
+        resFunction = compile_function("test/code/multi.py",
+                                      "multiQbitTest2", context=context)
+
+        self.assertEqual(resFunction.qgl_source, serialFunction.qgl_source)
+        assertPulseSequenceEqual(self, testable_sequence(resFunction()),
+                testable_sequence(serialFunction()))
+
     def test_doSimple(self):
         q2 = QubitFactory('q2')
         expected = [
@@ -0,0 +1,104 @@
+import os
+import pstats
+import tempfile
+import time
+import unittest
+
+from pyqgl2.main import compile_function, parse_args
+from pyqgl2.profiling import CompileProfiler, StackSampler, format_collapsed
+from pyqgl2.qreg import QRegister
+
+from .helpers import channel_setup
+
+def spin(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+def spin_outer(seconds):
+    spin(seconds)
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        channel_setup()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for name in os.listdir(self.tmpdir):
+            os.remove(os.path.join(self.tmpdir, name))
+        os.rmdir(self.tmpdir)
+
+    def compile_qft(self):
+        resFunction = compile_function(
+                "test/code/qft.py", "qft", (QRegister('q1', 'q2'),))
+        return resFunction
+
+    def test_pstats(self):
+        profiler = CompileProfiler('pstats')
+        with profiler:
+            self.compile_qft()
+
+        path = os.path.join(self.tmpdir, 'qft.prof')
+        profiler.write(path)
+
+        names = set(func[2] for func in pstats.Stats(path).stats)
+        self.assertIn('compile_function', names)
+
+        # Nothing outside of the block is profiled
+        self.assertNotIn('test_pstats', names)
+
+    def test_collapsed(self):
+        profiler = CompileProfiler('collapsed', interval=0.0005)
+        with profiler:
+            self.compile_qft()
+
+        # A second use adds to the same profile
+        with profiler:
+            spin_outer(0.05)
+
+        path = os.path.join(self.tmpdir, 'qft.folded')
+        profiler.write(path)
+
+        with open(path) as fin:
+            lines = fin.read().splitlines()
+        self.assertTrue(lines)
+
+        stacks = list()
+        for line in lines:
+            frames, count = line.rsplit(' ', 1)
+            self.assertTrue(int(count) > 0)
+            stacks.append([frame.split(':')[-1]
+                    for frame in frames.split(';')])
+
+        # Every stack starts inside one of the profiled blocks
+        self.assertTrue(any(stack[:2] == ['compile_qft', 'compile_function']
+                for stack in stacks))
+        self.assertTrue(all(stack[0] in ('compile_qft', 'spin_outer')
+                for stack in stacks))
+        self.assertIn(['spin_outer', 'spin'], stacks)
+
+    def test_sampler(self):
+        with StackSampler(interval=0.001) as sampler:
+            spin_outer(0.05)
+
+        names = [[func[2] for func in stack] for stack in sampler.samples]
+        self.assertIn(['spin_outer', 'spin'], names)
+
+        lines = format_collapsed(sampler.samples)
+        self.assertEqual(sum(int(line.rsplit(' ', 1)[1]) for line in lines),
+                sum(sampler.samples.values()))
+
+    def test_options(self):
+        opts = parse_args(['--profile', 'out.prof', 'test/code/qft.py'])
+        self.assertEqual(opts.profile, 'out.prof')
+        self.assertEqual(opts.profile_format, 'pstats')
+        self.assertFalse(opts.profile_exec)
+
+        opts = parse_args(['--profile', 'out.folded',
+            '--profile-format', 'collapsed', '--profile-exec',
+            'test/code/qft.py'])
+        self.assertEqual(opts.profile_format, 'collapsed')
+        self.assertTrue(opts.profile_exec)
+
+        with self.assertRaises(ValueError):
+            CompileProfiler('callgrind')
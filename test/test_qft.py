@@ -11,6 +11,7 @@ from test.helpers import channel_setup, testable_sequence
 from test.helpers import assertPulseSequenceEqual, \
     get_cal_seqs_1qubit, get_cal_seqs_2qubits
 
+from pyqgl2.test_cl import create_default_channelLibrary
 from QGL import *
 
 class TestQFT(unittest.TestCase):
@@ -44,5 +45,34 @@ class TestQFT(unittest.TestCase):
 
         assertPulseSequenceEqual(self, seqs, expected_seq)
 
+    def test_qft_wide(self):
+        # The default channel library only connects q1 and q2;
+        # with more qubits, every pair of qubits is connected
+        create_default_channelLibrary(False, True, numQubits=5)
+
+        names = ['q%d' % num for num in range(1, 6)]
+        qs = [QubitFactory(name) for name in names]
+
+        resFunction = compile_function('test/code/qft.py', 'qft',
+                (QRegister(*names),))
+        seqs = resFunction()
+        seqs = testable_sequence(seqs)
+
+        expected_seq = list()
+        for i in range(len(qs)):
+            expected_seq += H(qs[i])
+            for j in range(i + 1, len(qs)):
+                theta = 2 * pi / 2**(j - i)
+                expected_seq += [
+                    Ztheta(qs[j], theta/2),
+                    CNOT(qs[i], qs[j]),
+                    Ztheta(qs[j], -theta/2),
+                    CNOT(qs[i], qs[j])
+                ]
+        expected_seq += [MEAS(q) for q in qs]
+        expected_seq = testable_sequence(expected_seq)
+
+        assertPulseSequenceEqual(self, seqs, expected_seq)
+
 def H(q):
     return [Y90(q), X(q)]
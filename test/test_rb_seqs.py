@@ -0,0 +1,55 @@
+import unittest
+import numpy as np
+
+from functools import reduce
+
+from qgl2.basic_sequences.RB import create_RB_seqs_parallel, RB_seqs_to_lists, RB_PAD
+from qgl2.Cliffords import clifford_mat
+
+class TestRBSeqs(unittest.TestCase):
+
+    def assertRecovers(self, seqs, numQubits):
+        # each sequence (including its recovery gate) is
+        # the identity, up to a phase
+        dim = 2 ** numQubits
+        for seq in seqs:
+            mat = reduce(lambda x, y: np.dot(y, x),
+                    [clifford_mat(c, numQubits) for c in seq])
+            self.assertTrue(
+                    np.isclose(np.abs(np.trace(mat)), dim), seq)
+
+    def test_shape(self):
+        seqs = create_RB_seqs_parallel(1, [2, 4, 8], repeats=5, seed=1, workers=1)
+        self.assertEqual(seqs.shape, (15, 8))
+        self.assertEqual(seqs.dtype, np.int16)
+
+        lists = RB_seqs_to_lists(seqs)
+        self.assertEqual([len(seq) for seq in lists], [2] * 5 + [4] * 5 + [8] * 5)
+        self.assertTrue(np.all(seqs[:5, 2:] == RB_PAD))
+        self.assertTrue(all(0 <= c < 24 for seq in lists for c in seq))
+        self.assertRecovers(lists, 1)
+
+    def test_interleave(self):
+        seqs = RB_seqs_to_lists(create_RB_seqs_parallel(
+                1, [3], repeats=4, interleaveGate=7, seed=2, workers=1))
+        for seq in seqs:
+            self.assertEqual(len(seq), 5)
+            self.assertEqual(seq[1::2][:2], [7, 7])
+        self.assertRecovers(seqs, 1)
+
+    def test_deterministic(self):
+        # the output depends on the seed, but not on the number of workers
+        # (there are several chunks, so the pool is used)
+        args = (1, [2, 3, 4], 40)
+        serial = create_RB_seqs_parallel(*args, seed=1234, workers=1)
+        parallel = create_RB_seqs_parallel(*args, seed=1234, workers=3)
+        other = create_RB_seqs_parallel(*args, seed=4321, workers=1)
+
+        self.assertTrue(np.array_equal(serial, parallel))
+        self.assertFalse(np.array_equal(serial, other))
+
+    def test_two_qubits(self):
+        seqs = create_RB_seqs_parallel(2, [2, 3], repeats=2, seed=5, workers=1)
+        self.assertEqual(seqs.shape, (4, 3))
+        self.assertTrue(np.all(seqs[seqs != RB_PAD] < 11520))
+        self.assertRecovers(RB_seqs_to_lists(seqs), 2)
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from collections import Counter
+
+from benchmarks.scaling import MAIN_NAME, fit_exponent, generate_program
+from pyqgl2.main import compile_function
+from pyqgl2.qreg import QRegister
+from QGL.PatternUtils import flatten
+
+from .helpers import channel_setup
+
+class TestScaling(unittest.TestCase):
+    def setUp(self):
+        channel_setup()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_generated_program(self):
+        # 2 nested loops of 3 trips, each iteration calling 2
+        # helpers (each a chain of 3 calls) and doing 2 runtime ifs
+        path = os.path.join(self.tmpdir, 'scaling.py')
+        with open(path, 'w') as fout:
+            fout.write(generate_program(trips=3, depth=2, helpers=2,
+                    call_depth=3, qubits=2, ifs=2))
+
+        resFunction = compile_function(
+                path, MAIN_NAME, (QRegister('q1', 'q2'),))
+        seqs = resFunction()
+
+        names = Counter(
+                getattr(inst, 'label', None) or type(inst).__name__
+                for inst in flatten(seqs))
+
+        # Each helper chain does X90, Y90, X90, on each qubit
+        iterations = 3 * 3
+        self.assertEqual(names['X90'], iterations * 2 * 2 * 2)
+        self.assertEqual(names['Y90'], iterations * 2 * 1 * 2)
+        self.assertEqual(names['ComparisonInstruction'], iterations * 2)
+
+    def test_fit_exponent(self):
+        sizes = [1, 2, 4, 8, 16]
+
+        exponent, r_squared = fit_exponent(sizes, [3 * x for x in sizes])
+        self.assertAlmostEqual(exponent, 1.0)
+        self.assertAlmostEqual(r_squared, 1.0)
+
+        exponent, _ = fit_exponent(sizes, [x * x + 0.5 for x in sizes])
+        self.assertTrue(1.5 < exponent < 2.0)
+
+        # A constant cost has an exponent of zero
+        exponent, _ = fit_exponent(sizes, [2.0] * len(sizes))
+        self.assertAlmostEqual(exponent, 0.0)
+
+        # Not enough points to fit
+        self.assertEqual(fit_exponent([4, 4], [1, 2]), (None, None))
@@ -0,0 +1,111 @@
+import filecmp
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+import pyqgl2.main
+
+from pyqgl2.main import compile_function, qgl2_compile_to_hardware
+from pyqgl2.main import schedule_pipelined, schedule_segments
+from pyqgl2.main import split_segments
+from pyqgl2.qreg import QRegister
+from QGL.ControlFlow import Wait
+from QGL.Scheduler import schedule
+
+from test.helpers import channel_setup
+
+class TestScheduleSegments(unittest.TestCase):
+    def setUp(self):
+        channel_setup()
+
+    def tearDown(self):
+        pass
+
+    def test_split(self):
+        resFunction = compile_function(
+                "src/python/qgl2/basic_sequences/Rabi.py", "RabiAmp",
+                (QRegister('q1'), np.linspace(0, 1, 5), 0))
+        seq = resFunction()
+
+        segments = list(split_segments(iter(seq)))
+        self.assertEqual(len(segments), 5)
+        self.assertEqual(sum(segments, []), seq)
+        for segment in segments:
+            self.assertIsInstance(segment[0], Wait)
+            self.assertFalse(any(isinstance(instr, Wait)
+                for instr in segment[1:]))
+
+    def test_same_schedule(self):
+        # scheduling each segment separately gives the same result
+        # as scheduling the whole sequence.  The scheduler modifies
+        # its input, so each needs a fresh sequence.
+        for filename, main_name in [
+                ("test/code/tomo.py", "main"),
+                ("test/code/reset.py", "reset1"),
+                ("test/code/reset.py", "reset4"),
+                ("test/code/multi.py", "multiQbitTest2")]:
+            resFunction = compile_function(filename, main_name)
+            expected = schedule(resFunction())
+
+            self.assertEqual(schedule_segments(resFunction()), expected)
+            self.assertEqual(schedule_segments(iter(resFunction())),
+                    expected)
+
+    def test_segments(self):
+        # the generator form of the function creates the same segments
+        for filename, main_name in [
+                ("test/code/tomo.py", "main"),
+                ("test/code/multi.py", "multiQbitTest2")]:
+            resFunction = compile_function(filename, main_name)
+            self.assertEqual(list(resFunction.qgl_segments()),
+                    list(split_segments(resFunction())))
+
+    def test_schedule_pipelined(self):
+        # the schedule made by the workers is the same as the schedule
+        # made here, with any number of chunks, with one worker or more
+        resFunction = compile_function(
+                "src/python/qgl2/basic_sequences/RB.py", "SingleQubitRB",
+                (QRegister('q1'), [[1, 2, 3], [4, 5], [6]] * 8, False, True))
+        # SingleQubitRB makes random choices, so each schedule starts
+        # from the same state
+        random.seed(1)
+        np.random.seed(1)
+        expected = schedule(resFunction())
+
+        old_chunk = pyqgl2.main.SCHEDULE_CHUNK
+        try:
+            for chunk in [1, 5, 1000]:
+                pyqgl2.main.SCHEDULE_CHUNK = chunk
+                for workers in [1, 2, 3]:
+                    random.seed(1)
+                    np.random.seed(1)
+                    self.assertEqual(
+                            schedule_pipelined(resFunction, workers),
+                            expected)
+        finally:
+            pyqgl2.main.SCHEDULE_CHUNK = old_chunk
+
+    def test_pipelined_compile_to_hardware(self):
+        channel_setup(doHW=True)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            resFunction = compile_function(
+                    "src/python/qgl2/basic_sequences/Rabi.py", "RabiAmp",
+                    (QRegister('q1'), np.linspace(0, 1, 5), 0))
+
+            qgl2_compile_to_hardware(resFunction(),
+                    os.path.join(tmpdir, 'serial/Rabi'))
+            qgl2_compile_to_hardware(resFunction,
+                    os.path.join(tmpdir, 'pipelined/Rabi'), pipelined=True,
+                    workers=2)
+
+            for name in ['Rabi-APS1.aps2', 'Rabi-APS2.aps2']:
+                self.assertTrue(filecmp.cmp(
+                        os.path.join(tmpdir, 'serial', name),
+                        os.path.join(tmpdir, 'pipelined', name),
+                        shallow=False))
+        finally:
+            shutil.rmtree(tmpdir)
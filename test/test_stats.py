@@ -0,0 +1,65 @@
+import json
+import unittest
+
+from pyqgl2.context import CompileContext
+from pyqgl2.main import compile_function
+from pyqgl2.stats import CompileStats, StatsState
+from QGL import *
+
+from .helpers import channel_setup
+
+class TestCompileStats(unittest.TestCase):
+    def setUp(self):
+        channel_setup()
+
+    def tearDown(self):
+        pass
+
+    def test_stages(self):
+        q1 = QubitFactory('q1')
+        amps = [1, 2, 3]
+        stats = CompileStats(track_memory=True)
+
+        resFunction = compile_function(
+                "test/code/toplevel_binding.py", "main1", (amps,),
+                stats=stats)
+        self.assertIs(resFunction.qgl_stats, stats)
+        self.assertEqual(resFunction(), [Xtheta(q1, amp=a) for a in amps])
+        stats.stop()
+
+        names = [record.stage for record in stats.stages]
+        self.assertEqual(names[:2], ['importer', 'inline_callees'])
+        self.assertEqual(names[-5:], ['evaluator', 'replace_bindings',
+                'flattener', 'extractor', 'exec'])
+
+        inliner = [record for record in stats.stages
+                if record.stage == 'inliner']
+        self.assertTrue(len(inliner) > 0)
+        self.assertEqual([record.iteration for record in inliner],
+                list(range(len(inliner))))
+
+        for record in stats.stages:
+            self.assertTrue(record.wall_time >= 0)
+            self.assertTrue(record.cpu_time >= 0)
+            self.assertTrue(record.memory_peak >= 0)
+
+        # the loop is unrolled by the evaluator
+        evaluator = stats.stages[names.index('evaluator')]
+        self.assertTrue(evaluator.statements_out >= len(amps))
+
+        as_dict = json.loads(stats.to_json())
+        self.assertEqual([record['stage'] for record in as_dict['stages']],
+                names)
+        self.assertIn('total', stats.format_table())
+
+    def test_no_stats(self):
+        # statistics are only collected in the context
+        # that was given the CompileStats
+        stats = CompileStats()
+        with CompileContext():
+            compile_function(
+                    "test/code/toplevel_binding.py", "main1", ([1],),
+                    stats=stats)
+        self.assertTrue(len(stats.stages) > 0)
+        self.assertIsNone(stats.stages[0].memory_peak)
+        self.assertIsNone(StatsState.STATS)
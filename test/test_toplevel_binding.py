@@ -1,7 +1,11 @@
+import os
+import shutil
+import tempfile
 import unittest
 import numpy as np
 
-from pyqgl2.main import compile_function
+from pyqgl2.eval import EvalTransformer
+from pyqgl2.main import compile_function, compile_function_batch
 from pyqgl2.qreg import QRegister
 from QGL import *
 
@@ -89,6 +93,54 @@ class TestTopLevelBinding(unittest.TestCase):
 
         self.assertEqual(seqs, expectedseq)
 
+    def test_main1_tuple_float32(self):
+        # float32 values do not survive a round trip through repr()
+        # and float, so make sure they're passed through unchanged
+        q1 = QubitFactory('q1')
+        amps = np.array([0.1, 0.2, 0.3], dtype=np.float32)
+        expectedseq = [Xtheta(q1, amp=a) for a in amps]
+
+        # tuple input for toplevel_bindings
+        resFunction = compile_function(
+            "test/code/toplevel_binding.py",
+            "main1",
+            (amps,)
+            )
+        seqs = resFunction()
+
+        self.assertEqual(seqs, expectedseq)
+        for pulse in seqs:
+            self.assertIsInstance(pulse.amp, np.float32)
+
+    def test_main_alias_pooled(self):
+        # a plain copy of a loop variable over a numpy array is
+        # referenced through the constant pool, just like the loop
+        # variable itself, rather than stored once per iteration
+        q1 = QubitFactory('q1')
+        amps = np.array([0.1, 0.2, 0.3], dtype=np.float32)
+        expectedseq = [Xtheta(q1, amp=a) for a in amps]
+
+        resFunction = compile_function(
+            "test/code/toplevel_binding.py",
+            "main_alias",
+            (amps,)
+            )
+
+        with resFunction.qgl_context:
+            values = list(EvalTransformer.PRECOMPUTED_VALUES.values())
+        pools = [v for v in values if isinstance(v, np.ndarray)]
+        self.assertEqual(len(pools), 1)
+        self.assertFalse(any(isinstance(v, np.generic) for v in values))
+
+        # the pool holds a copy, so changing the array after
+        # compiling does not change the sequence
+        amps[0] = 0.9
+
+        seqs = resFunction()
+        self.assertEqual(seqs, expectedseq)
+        for pulse in seqs:
+            self.assertIsInstance(pulse.amp, np.float32)
+
     def test_main2_dict(self):
         q1 = QubitFactory('q1')
         amps = [1,2,3,4,5]
@@ -190,6 +242,52 @@ class TestTopLevelBinding(unittest.TestCase):
 
         self.assertEqual(seqs, expectedseq)
 
+    def test_main4_batch(self):
+        # compile several variants at once, and make sure each
+        # function uses its own bindings even though all of them
+        # are called after the last one is compiled
+        q1 = QubitFactory('q1')
+        q2 = QubitFactory('q2')
+        amps = range(5)
+        shapes = [PulseShapes.tanh, PulseShapes.gaussian]
+        bindings_list = [
+            (QRegister('q1'), amps, shapes[0]),
+            {"q": QRegister('q2'), "amps": amps, "shape": shapes[1]}
+            ]
+
+        results = compile_function_batch(
+            "test/code/toplevel_binding.py",
+            "main4",
+            bindings_list
+            )
+        self.assertEqual(len(results), 2)
+
+        for (resFunction, elapsed), q, shape in zip(results, [q1, q2], shapes):
+            self.assertGreater(elapsed, 0)
+            expectedseq = [Xtheta(q, amp=a, shape_fun=shape) for a in amps]
+            seqs = resFunction()
+            self.assertEqual(seqs, expectedseq)
+
+    def test_main4_batch_save(self):
+        # each variant saves its QGL1 code in a separate file
+        amps = range(5)
+        bindings_list = [
+            (QRegister('q1'), amps, PulseShapes.tanh),
+            (QRegister('q2'), amps, PulseShapes.gaussian)
+            ]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'toplevel_binding.py')
+            shutil.copy("test/code/toplevel_binding.py", filename)
+
+            compile_function_batch(
+                filename, "main4", bindings_list, saveOutput=True)
+
+            for variant in range(len(bindings_list)):
+                saved = os.path.join(
+                        tmpdir, 'toplevel_binding_%dqgl1.py' % variant)
+                self.assertTrue(os.path.exists(saved))
+
     def test_main5(self):
         # qreg list of qubits
         q1 = QubitFactory('q1')
@@ -0,0 +1,118 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyqgl2.context import CompileContext
+from pyqgl2.main import compile_function
+from pyqgl2.qreg import QRegister
+from pyqgl2.trace import ChromeTrace, TraceHook, NULL_SPAN
+from pyqgl2.trace import add_trace_hook, remove_trace_hook, trace_span
+
+from .helpers import channel_setup
+
+class SpanRecorder(TraceHook):
+    """
+    Records the spans as a tree of (name, args, children)
+    """
+
+    def __init__(self):
+        self.stack = [('root', dict(), list())]
+
+    def before(self, span):
+        node = (span.name, span.args, list())
+        self.stack[-1][2].append(node)
+        self.stack.append(node)
+
+    def after(self, span):
+        node = self.stack.pop()
+        assert node[0] == span.name
+
+class TestTrace(unittest.TestCase):
+    def setUp(self):
+        channel_setup()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def compile_qft(self, *hooks):
+        context = CompileContext()
+        with context:
+            for hook in hooks:
+                add_trace_hook(hook)
+
+        resFunction = compile_function(
+                "test/code/qft.py", "qft", (QRegister('q1', 'q2'),),
+                context=context)
+        resFunction()
+        return resFunction
+
+    def test_spans(self):
+        recorder = SpanRecorder()
+        self.compile_qft(recorder)
+
+        self.assertEqual(len(recorder.stack), 1)
+        passes = recorder.stack[0][2]
+        names = [name for name, _, _ in passes]
+
+        self.assertEqual(names[:2], ['NameSpaces', 'inline_callees'])
+        self.assertEqual(names[-5:], ['EvalTransformer.visit',
+                'replace_bindings', 'Flattener.visit',
+                'get_sequence_function', 'exec'])
+
+        inliner = [span for span in passes if span[0] == 'Inliner']
+        self.assertEqual([args['iteration'] for _, args, _ in inliner],
+                list(range(len(inliner))))
+
+        # The calls are inlined in the first iteration of the inliner
+        self.assertEqual([name for name, _, _ in inliner[0][2]],
+                ['inline hadamard', 'inline CZ_k'])
+
+        # The outer loop is unrolled by the evaluator, and the
+        # inner loop is unrolled once for each of its iterations
+        evaluator = passes[names.index('EvalTransformer.visit')]
+        self.assertEqual([name for name, _, _ in evaluator[2]], ['for'])
+        outer_name, outer_args, inner = evaluator[2][0]
+        self.assertEqual(outer_args['file'], 'test/code/qft.py')
+        self.assertEqual(outer_args['line'], 21)
+        self.assertEqual([name for name, _, _ in inner], ['for', 'for'])
+        self.assertEqual([args['line'] for _, args, _ in inner], [23, 23])
+
+    def test_chrome_trace(self):
+        trace = ChromeTrace()
+        self.compile_qft(trace)
+
+        path = os.path.join(self.tmpdir, 'trace.json')
+        trace.write(path)
+        with open(path) as fin:
+            events = json.load(fin)['traceEvents']
+
+        # Each begin event has a matching end event, and they nest
+        stack = list()
+        for event in events:
+            self.assertIn(event['ph'], ('B', 'E'))
+            if event['ph'] == 'B':
+                stack.append(event)
+            else:
+                begin = stack.pop()
+                self.assertEqual(begin['name'], event['name'])
+                self.assertTrue(begin['ts'] <= event['ts'])
+        self.assertEqual(stack, [])
+
+        categories = set(event['cat'] for event in events)
+        self.assertEqual(categories, {'pass', 'inline', 'unroll'})
+
+    def test_no_hooks(self):
+        # Without hooks, spans do nothing
+        recorder = SpanRecorder()
+        with CompileContext():
+            self.assertIs(trace_span('test'), NULL_SPAN)
+            add_trace_hook(recorder)
+            with trace_span('test', x=1) as span:
+                span.set_arg('y', 2)
+            remove_trace_hook(recorder)
+            self.assertIs(trace_span('test'), NULL_SPAN)
+
+        self.assertEqual(recorder.stack[0][2], [('test', {'x': 1, 'y': 2}, [])])